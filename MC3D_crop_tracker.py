@@ -19,9 +19,10 @@ sys.path.insert(0,detector_path)
 from pytorch_retinanet_detector_directional.retinanet.model import resnet50 
 
 # filter,homography, and frame loader
-from util_track.mp_loader import FrameLoader
+from util_track.mp_loader import MultiCameraLoader
 from util_track.kf import Torch_KF
-from util_track.mp_writer import OutputWriter
+from util_track.mp_writer import OutputWriter, TrackWriter, load_track_chunks, load_track_metadata
+from util_track.metadata import TrackMetadata
 from homography import Homography,Homography_Wrapper, load_i24_csv
 from mot_evaluator import MOT_Evaluator
 
@@ -44,7 +45,9 @@ class MC_Crop_Tracker():
                  cd = None,
                  PLOT = True,
                  OUT = None,
-                 early_cutoff = 1000):
+                 early_cutoff = 1000,
+                 output_file = "_outputs/3D_tracking_results.csv",
+                 chunk_dir = None):
         """
         sequences       - (list) of paths to video sequences
         detector        - pytorch object detector
@@ -56,6 +59,9 @@ class MC_Crop_Tracker():
         PLOT            - if true, will plot tracking outputs
         OUT             - (str or None) path to write output frames to
         early_cutoff    - (int) terminate tracking at this frame 
+        output_file     - (str) path of the output csv
+        chunk_dir       - (str or None) directory to which tracked states are streamed during
+                          tracking (see TrackWriter). If None, <output_file>_chunks is used
         """
         
         # parse params
@@ -112,28 +118,29 @@ class MC_Crop_Tracker():
             self.crop_detector.eval()
         
         
-        # for each sequence,open start a FrameLoader process
+        # a single loader process decodes all sequences and keeps them time-synchronized
         self.cameras = []
         self.sequences = []
-        self.loaders = []
         for sequence in sequences:
             # get camera name
             name = re.search("p\dc\d",sequence).group(0)
             self.cameras.append(name)
             self.sequences.append(name +"_0_4k")
-            l = FrameLoader(sequence,self.device,self.d,self.s,downsample = 1)
-            self.loaders.append(l)
+        self.loader = MultiCameraLoader(sequences,self.device,sync_tolerance = 0.02,return_originals = PLOT)
         
-        self.n_frames = len(self.loaders[0])
-        time.sleep(1)
+        self.n_frames = len(self.loader)
         
  
+        # homography camera index for each camera, so per-object lookups need no name lists
+        self.cam_hg_idxs = self.hg.cam_index(self.cameras)
+        
         # store camera center of view info
         self.centers = torch.tensor([camera_centers[key] for key in self.cameras])
 
         # a single output csv will be written
         # optionally, frames can be written (to one folder per sequence)
-        self.output_file = "_outputs/3D_tracking_results.csv"
+        self.output_file = output_file
+        self.chunk_dir = chunk_dir if chunk_dir is not None else os.path.splitext(output_file)[0] + "_chunks"
         self.writers = []
         if OUT is not None:
             for cam in self.cameras:
@@ -155,14 +162,11 @@ class MC_Crop_Tracker():
         
         # Initialize data storage objects
         self.next_obj_id = 0             # next id for a new object (incremented during tracking)
-        self.fsld = {}                   # fsld[id] stores frames since last detected for object id
+        n_classes = max([key for key in class_dict.keys() if isinstance(key,int)]) + 1
+        self.meta = TrackMetadata(n_classes = n_classes)  # stores fsld, class evidence, confidences and cameras for each object
     
-        self.all_tracks = []             # stores states for each object
-        self.all_classes = {}            # stores class evidence for each object
-        self.all_confs = {}
-        self.all_cameras = {}
         self.all_times = []
-        self.all_ts_bias = []
+        self.track_writer = None
     
         # superfluous features
         self.time_metrics = {            
@@ -184,55 +188,31 @@ class MC_Crop_Tracker():
         self.idx_colors = np.random.rand(10000,3)
         self.cutoff_frame = early_cutoff
         
-        #temporary timestamp overwriting
-        with open("/home/worklab/Documents/derek/3D-playground/final_saved_alpha_timestamps.cpkl","rb") as f:
-            self.ts = pickle.load(f)
-        self.timestamps = [0 for i in self.loaders]
+        self.timestamps = [0 for i in self.cameras]
         
-        self.ts_bias = [0 for i in self.loaders]
+        self.ts_bias = [0 for i in self.cameras]
         #self.ts_bias = [0.0506,0.0604,0.035,0.028]
         
         print("Initialized MC Crop Tracker for {} sequences".format(len(self.cameras)))
         
     def __next__(self):
-        next_frames = [next(l) for l in self.loaders]
-        
-        frame_nums = [chunk[0] for chunk in next_frames]
+        # frames from the loader are already synchronized across cameras
+        frame_num,frames,original_ims,timestamps = next(self.loader)
         
-        for item in frame_nums: # catch last frame of sequence
-            if item == -1:
-                self.frame_num = -1
-                return
+        if frame_num == -1: # catch last frame of sequence
+            self.frame_num = -1
+            return
         
-        self.frames = torch.stack([chunk[1] for chunk in next_frames])
-        self.original_ims = [chunk[2] for chunk in next_frames]
-        self.frame_num = frame_nums[0]
+        self.frames = frames
+        self.original_ims = original_ims
+        self.frame_num = frame_num
         
         prev_ts = self.timestamps.copy()
-        self.timestamps = [chunk[3] for chunk in next_frames]
+        self.timestamps = timestamps
         for idx in range(len(self.timestamps)):
             if self.timestamps[idx] is None:
                 self.timestamps[idx] = prev_ts[idx] + 1/30.0
                 
-                
-        
-    def time_sync_cameras(self):
-        
-        try:
-            latest = max(self.timestamps)
-            for i in range(len(self.timestamps)):
-                while latest - self.timestamps[i]  >= 0.02:
-                    fr_num,fr,orig_im,timestamp = next(self.loaders[i])
-                    self.frames[i] = fr
-                    self.original_ims[i] = orig_im
-                    self.timestamps[i] = self.ts[self.sequences[i]][fr_num]
-                    if self.timestamps[i] is None:
-                        self.timestamps[i] = self.ts[self.sequences[i]][fr_num - 1] + 1/30.0
-                    # if fr_num == -1 or fr_num > self.frame_num:
-                    #     self.frame_num = fr_num
-                    #print("Skipped a frame for camera {} to synchronize.".format(self.cameras[i]))
-        except TypeError:
-            pass # None for timestamp value
         
     def estimate_ts_bias(self,boxes,camera_idxs):
         """
@@ -357,8 +337,8 @@ class MC_Crop_Tracker():
             scores = scores[idxs]
             camera_idxs = camera_idxs[idxs]
         
-        # get list of camera_ids to pass to hg
-        cam_list = [self.cameras[i] for i in camera_idxs]
+        # get homography camera index for each detection
+        cam_list = self.cam_hg_idxs[camera_idxs.long()]
         
         heights = self.hg.guess_heights(labels)
         boxes = self.hg.im_to_state(detections,heights = heights,name = cam_list)
@@ -387,96 +367,67 @@ class MC_Crop_Tracker():
         Updates each detection matched to an existing tracklet, adds new tracklets 
         for unmatched detections, and increments counters / removes tracklets not matched
         to any detection
+        
+        returns - list of ids in pre_ids not matched to any detection
         """
-
-        # 1. Update tracked and matched objects
-        update_array = np.zeros([len(matchings),5])
-        update_ids = []
-        update_classes = []
-        update_confs = []
-        update_cameras = []
+        matchings = torch.from_numpy(np.array(matchings,dtype = np.int64).reshape(-1,2))
         
-        for i in range(len(matchings)):
-            a = matchings[i,0] # index of pre_loc
-            b = matchings[i,1] # index of detections
-           
-            update_array[i,:] = detections[b,:5]
-            update_ids.append(pre_ids[a])
-            update_classes.append(labels[b])
-            update_confs.append(scores[b])
-            update_cameras.append(cameras[b])
-            
-            self.fsld[pre_ids[a]] = 0 # fsld = 0 since this id was detected this frame
-            self.updated_this_frame.append(pre_ids[a])
-            
-        if len(update_array) > 0:    
+        # 1. Update tracked and matched objects
+        update_ids = [pre_ids[a] for a in matchings[:,0].tolist()]
+        if len(update_ids) > 0:    
+            b = matchings[:,1] # index of detections
+            update_array = detections[b,:5].double().numpy()
             self.filter.update(update_array,update_ids)
             
-            # store class and confidence (used to parse good objects)
-            for i in range(len(update_ids)):
-                self.all_classes[update_ids[i]][int(update_classes[i])] += 1
-                self.all_confs[update_ids[i]].append(update_confs[i])
-                self.all_cameras[update_ids[i]].append(update_cameras[i])
+            # store class and confidence (used to parse good objects), fsld = 0 since these ids were detected this frame
+            self.meta.update(update_ids,labels[b],scores[b],cameras[b])
               
         
         # 2. For each detection not in matchings, add a new object
-
-        
-        new_array = np.zeros([len(detections) - len(matchings),5])
-        new_directions = np.zeros([len(detections) - len(matchings)])
-        new_ids = []
-        new_classes = []
-        new_times = []
-        cur_row = 0
-        for i in range(len(detections)):
-            if len(matchings) == 0 or i not in matchings[:,1]:
-                
-                new_ids.append(self.next_obj_id)
-                new_array[cur_row,:] = detections[i,:5]
-                new_directions[cur_row] = detections[i,5]
-                new_times.append(detection_times[i])
-                
-                self.fsld[self.next_obj_id] = 0
-                self.all_classes[self.next_obj_id] = np.zeros(8)
-                self.all_confs[self.next_obj_id] = []
-                self.all_cameras[self.next_obj_id] = []
-                self.updated_this_frame.append(self.next_obj_id)
-                
-                cls = int(labels[i])
-                self.all_classes[self.next_obj_id][cls] += 1
-                self.all_confs[self.next_obj_id].append(scores[i])
-                self.all_cameras[self.next_obj_id].append(cameras[i])
-                new_classes.append(self.class_dict[cls])                    
-                
-                self.next_obj_id += 1
-                cur_row += 1
-        if len(new_array) > 0:   
+        unmatched = torch.ones(len(detections),dtype = torch.bool)
+        unmatched[matchings[:,1]] = False
+        new_idxs = torch.nonzero(unmatched).view(-1)
+        
+        if len(new_idxs) > 0:   
+            new_array = detections[new_idxs,:5].double().numpy()
+            new_directions = detections[new_idxs,5].double().numpy()
+            new_ids = list(range(self.next_obj_id,self.next_obj_id + len(new_idxs)))
+            new_times = np.array([detection_times[i] for i in new_idxs.tolist()])
+            self.next_obj_id += len(new_idxs)
+            
+            self.meta.add(new_ids,labels[new_idxs],scores[new_idxs],cameras[new_idxs])
             
-            #new_times = np.array([new_time for i in new_array])
-            new_times = np.array(new_times)
             if mean_object_sizes:
+                new_classes = [self.class_dict[int(cls)] for cls in labels[new_idxs].tolist()]
                 self.filter.add(new_array,new_ids,new_directions,new_times,init_speed = True,classes = new_classes)
             else:
                 self.filter.add(new_array,new_ids,new_directions,new_times,init_speed = True)
+        
+        # 3. Objects not detected in any camera view
+        undetected = torch.ones(len(pre_ids),dtype = torch.bool)
+        undetected[matchings[:,0]] = False
+        return [pre_ids[i] for i in torch.nonzero(undetected).view(-1).tolist()]
       
     
-    def increment_fslds(self,undetected,pre_ids):
+    def increment_fslds(self,undetected):
         start = time.time()
         
         # For each untracked object, increment fsld        
-        for id in undetected:
-            self.fsld[id] += 1
+        self.meta.missed(undetected)
         
         #  Remove lost objects
-        removals = []
-        for id in pre_ids:
-            if self.fsld[id] >= self.f_max :#and len(self.all_classes[id]) < self.f_init:  # after a burn-in period, objects are no longer removed unless they leave frame
-                removals.append(id)
-                self.fsld.pop(id,None) # remove key from fsld
-        if len(removals) > 0:
-            self.filter.remove(removals)    
+        removals = self.meta.lost(undetected,self.f_max)
+        self.remove(removals)
     
         self.time_metrics['add and remove'] += time.time() - start
+    
+    def remove(self,ids):
+        """
+        Removes objects from the filter and metadata store
+        """
+        if len(ids) > 0:
+            self.filter.remove(ids)
+            self.meta.remove(ids)
         
     
     def remove_overlaps(self):
@@ -500,7 +451,7 @@ class MC_Crop_Tracker():
             boxes_new[:,2] = torch.max(boxes[:,0:4,0],dim = 1)[0]
             boxes_new[:,1] = torch.min(boxes[:,0:4,1],dim = 1)[0]
             boxes_new[:,3] = torch.max(boxes[:,0:4,1],dim = 1)[0]
-            scores = torch.tensor([len(self.all_classes[id]) for id in ids])
+            scores = torch.from_numpy(self.meta.n_detections(ids))
             
             
             # we can use NMS to get the indices of objects to keep if we input the number of frames alive as the confidence
@@ -515,7 +466,7 @@ class MC_Crop_Tracker():
             
             if len(removals) > 0:
                 removals = list(set(removals))
-                self.filter.remove(removals)
+                self.remove(removals)
    
     def remove_anomalies(self,x_bounds = [300,600]):
         """
@@ -553,7 +504,7 @@ class MC_Crop_Tracker():
         
         if len(removals) > 0:
             removals = list(set(removals))
-            self.filter.remove(removals)         
+            self.remove(removals)         
     
     
     def iou(self,a,b):
@@ -745,10 +696,9 @@ class MC_Crop_Tracker():
             Detections output by either localizer or detector (xysr form)
         post_locations : tensor [m,4] 
             Estimated object locations after update step (xysr form)
-        all_classes : dict
-            indexed by object id, where each entry is a list of the predicted class (int)
-            for that object at every frame in which is was detected. The most common
-            class is assumed to be the correct class        
+        all_classes : TrackMetadata
+            class evidence for each object id. The most common class is assumed
+            to be the correct class        
         class_dict : dict
             indexed by class int, the string class names for each class
         frame : int, optional
@@ -792,14 +742,13 @@ class MC_Crop_Tracker():
             dts = self.filter.get_dt(self.timestamps[im_idx] + self.ts_bias[im_idx])
             ids,post_boxes = self.filter.view(with_direction = True,dt = dts)
             boxes = []
-            classes = []
             speeds = []
             directions = []
             dims = []
+            classes = all_classes.best_class(ids).tolist()
             for i,row in enumerate(post_boxes):
                 boxes.append(row[0:6])
                 speeds.append(((np.abs(row[6]) * 3600/5280 * 10).round())/10) # in mph
-                classes.append(np.argmax(self.all_classes[ids[i]]))            
                 directions.append("WB" if row[5] == -1 else "EB")
                 dims.append((row[2:5]*10).round()/10) 
             if len(boxes) > 0:
@@ -1049,10 +998,21 @@ class MC_Crop_Tracker():
         return iou
     
     def track(self):
+        """
+        Tracks all frames. Object states are streamed to chunk files in chunk_dir
+        during tracking (then written to csv by write_results_csv), and all completed
+        frames are flushed to disk even if tracking raises an exception
+        """
+        self.track_writer = TrackWriter(self.chunk_dir)
+        try:
+            self.track_frames()
+        finally:
+            self.track_writer.close()
+    
+    def track_frames(self):
         
         self.start_time = time.time()
         next(self) # advances frame
-        self.time_sync_cameras()
         self.clock_time = max(self.timestamps)
         
         
@@ -1101,7 +1061,6 @@ class MC_Crop_Tracker():
                 start = time.time()
                 all_matches = []
                 order = np.array(self.timestamps).argsort()
-                self.updated_this_frame = []
                 
                 avg_time = sum(self.timestamps) / len(self.timestamps)
                 dts = self.filter.get_dt(avg_time) # necessary dt for each object to get to timestamp time
@@ -1120,21 +1079,16 @@ class MC_Crop_Tracker():
                 # select the time for each relevant detection
                 start = time.time()
                 if len(matchings) > 0: # we only need to predict object locations for objects with updates
-                    filter_idxs = [match[0] for match in matchings]
-                    match_times = [self.timestamps[camera_idxs[match[1]]] + self.ts_bias[camera_idxs[match[1]]] for match in matchings]
-                    dts = self.filter.get_dt(match_times,idxs = filter_idxs)
-                    self.filter.predict(dt = dts)
+                    match_idxs = torch.from_numpy(np.array(matchings)[:,:2].astype(np.int64))
+                    cam_times = torch.tensor(self.timestamps,dtype = torch.double) + torch.tensor(self.ts_bias,dtype = torch.double)
+                    match_times = cam_times[camera_idxs[match_idxs[:,1]].long()]
+                    self.filter.predict_to(match_times,idxs = match_idxs[:,0])
                         
                 detection_times = [self.timestamps[cam_idx] + self.ts_bias[cam_idx] for cam_idx in camera_idxs]
-                self.manage_tracks(detections,matchings,pre_ids,labels,scores,camera_idxs,detection_times)
+                undetected = self.manage_tracks(detections,matchings,pre_ids,labels,scores,camera_idxs,detection_times)
 
                 # for objects not detected in any camera view
-                updated = list(set(self.updated_this_frame))
-                undetected = []
-                for id in pre_ids:
-                    if id not in updated:
-                        undetected.append(id)
-                self.increment_fslds(pre_ids,undetected)
+                self.increment_fslds(undetected)
 
                 self.time_metrics['update'] += time.time() - start
 
@@ -1161,15 +1115,13 @@ class MC_Crop_Tracker():
                     
                     diff = torch.abs(torch.pow(cc_x-obj_x,2) + torch.pow(cc_y-obj_y,2))
                     cam_idxs = torch.argmin(diff,dim = 1)
-                    cam_names = [self.cameras[i] for i in cam_idxs]
+                    cam_names = self.cam_hg_idxs[cam_idxs]
                     self.time_metrics["crop and align"] += time.time() -start
                     
                     start = time.time()
                     # predict time-correct a prioris in each camera
-                    obj_times = [self.timestamps[idx] + self.ts_bias[idx] for idx in cam_idxs]
-                    
-                    dts = self.filter.get_dt(obj_times)
-                    self.filter.predict(dt = dts) 
+                    cam_times = torch.tensor(self.timestamps,dtype = torch.double) + torch.tensor(self.ts_bias,dtype = torch.double)
+                    self.filter.predict_to(cam_times[cam_idxs]) 
                     pre_ids, pre_loc = self.filter.view(with_direction = True)
                     im_objs = self.hg.state_to_im(pre_loc,name = cam_names)
                     self.time_metrics['predict'] += time.time() - start
@@ -1216,7 +1168,7 @@ class MC_Crop_Tracker():
     
                     # convert each box using the appropriate H into state
                     n_objs = reg_boxes.shape[0]
-                    cam_names_repeated = [cam for cam in cam_names for i in range(reg_boxes.shape[1])]
+                    cam_names_repeated = cam_names.repeat_interleave(reg_boxes.shape[1])
                     reg_boxes = reg_boxes.reshape(-1,8,2)
                     heights = self.hg.guess_heights(classes.reshape(-1))
                     reg_boxes_state = self.hg.im_to_state(reg_boxes,heights = heights,name = cam_names_repeated)
@@ -1236,20 +1188,8 @@ class MC_Crop_Tracker():
     
                     camera_idxs = cam_idxs
                     
-                    # update classes, confs and fsld
-                    for i in range(len(pre_ids)):
-                        id = pre_ids[i]
-                        conf = confs[i]
-                        cls = classes[i]
-                        camera = camera_idxs[i]
-                        
-                        if confs[i] < self.sigma_c:
-                            self.fsld[id] += 1
-                        else:
-                            self.fsld[id] = 0
-                        self.all_confs[id].append(confs)
-                        self.all_classes[id][cls.item()] += 1
-                        self.all_cameras[id].append(camera)
+                    # update classes, confs and fsld (fsld is only reset by confident detections)
+                    self.meta.update(pre_ids,classes,confs,camera_idxs,detected = confs >= self.sigma_c)
                         
                     self.time_metrics["update"] += time.time() - start
                 
@@ -1273,25 +1213,20 @@ class MC_Crop_Tracker():
             dts = self.filter.get_dt(clock_time)
             
             post_ids,post_locations = self.filter.view(with_direction = True,dt = dts)
-            for i in range(len(post_locations)):
-                id = post_ids[i]
-                box = post_locations[i]
-                datum =  [  id,clock_time,box[:self.state_size]   ]
-                self.all_tracks.append(datum)
-                self.all_ts_bias.append(self.ts_bias.copy())
+            post_states = post_locations[:,:self.state_size] if len(post_ids) > 0 else []
+            self.track_writer(post_ids,clock_time,post_states,self.ts_bias,self.meta.n_detections(post_ids),self.meta.best_class(post_ids))
             self.time_metrics['store'] += time.time() - start  
             
             
             # Plot
             start = time.time()
             if self.PLOT:
-                self.plot(detections,camera_idxs,post_locations,self.all_classes,pre_locations = pre_loc,label_len = 5,crops = crop_boxes)
+                self.plot(detections,camera_idxs,post_locations,self.meta,pre_locations = pre_loc,label_len = 5,crops = crop_boxes)
             self.time_metrics['plot'] += time.time() - start
        
             # load next frame  
             start = time.time()
             next(self)
-            self.time_sync_cameras()
             torch.cuda.synchronize()
             torch.cuda.empty_cache()
             self.time_metrics["load"] += time.time() - start
@@ -1327,6 +1262,10 @@ class MC_Crop_Tracker():
             - Acceleration is not calculated 
             - Height is added as column 44
             - Temporarily, timestamps are parsed from a separate timestamp data .pkl file 
+            - Object states are read back one chunk at a time from the TrackWriter files
+              written during tracking, and short tracks are dropped chunk by chunk. Detection
+              counts and classes are also read from the chunk files, so results can be
+              written from the chunks of a run that crashed (or ran in another process)
         """
         
         # create main data header
@@ -1391,66 +1330,77 @@ class MC_Crop_Tracker():
             gen = "3D Detector"
             camera = "p1c1" # default dummy value
             
-            for i,item in enumerate(self.all_tracks):
-                print("\rWriting outputs for frame-object {} of {}".format(i,len(self.all_tracks)), end = '\r', flush = True)
-                id = item[0]
-                timestamp = item[1]
-                state = item[2]
+            # final detection count and class of each object
+            meta_ids,meta_n_detections,meta_classes = load_track_metadata(self.chunk_dir)
+            
+            # stream tracked states back one chunk at a time
+            n_rows = 0
+            for ids,timestamps,states,ts_bias in load_track_chunks(self.chunk_dir):
+                n_rows += len(ids)
+                print("\rWriting outputs for frame-object {}".format(n_rows), end = '\r', flush = True)
+                
+                # remove short anomalous tracks
+                meta_idx = np.searchsorted(meta_ids,ids)
+                n_detections = meta_n_detections[meta_idx]
+                keep = (n_detections > self.f_init) & (states[:,0] != 0)
+                if keep.sum() == 0:
+                    continue
+                
+                ids = ids[keep]
+                timestamps = timestamps[keep]
+                ts_bias = ts_bias[keep]
+                classes = meta_classes[meta_idx][keep]
+                states = torch.from_numpy(states[keep]).float()
+                
+                # generate space coords
+                space = self.hg.state_to_space(states,name = camera)
+                flat_space = space[:,:4,:2].reshape(len(states),-1).data.numpy()
+                
+                # generate im coords
+                bbox_3D = self.hg.state_to_im(states,name = camera)
+                flat_3D = bbox_3D.reshape(len(states),-1).data.numpy()
+                
+                # generate im 2D bbox
+                minx = torch.min(bbox_3D[:,:,0],dim = 1)[0].tolist()
+                maxx = torch.max(bbox_3D[:,:,0],dim = 1)[0].tolist()
+                miny = torch.min(bbox_3D[:,:,1],dim = 1)[0].tolist()
+                maxy = torch.max(bbox_3D[:,:,1],dim = 1)[0].tolist()
                 
-                if len(self.all_classes[id]) > self.f_init: # remove short anomalous tracks
+                states = states.data.numpy()
+                for i in range(len(states)):
+                    state = states[i]
                     
-                    state = state.float()
+                    obj_line = []
                     
-                    if state[0] != 0:
-                        
-                        # generate space coords
-                        space = self.hg.state_to_space(state.unsqueeze(0))
-                        space = space.squeeze(0)[:4,:2]
-                        flat_space = list(space.reshape(-1).data.numpy())
-                        
-                        # generate im coords
-                        bbox_3D = self.hg.state_to_im(state.unsqueeze(0),name = camera)
-                        flat_3D = list(bbox_3D.squeeze(0).reshape(-1).data.numpy())
-                        
-                        # generate im 2D bbox
-                        minx = torch.min(bbox_3D[:,:,0],dim = 1)[0].item()
-                        maxx = torch.max(bbox_3D[:,:,0],dim = 1)[0].item()
-                        miny = torch.min(bbox_3D[:,:,1],dim = 1)[0].item()
-                        maxy = torch.max(bbox_3D[:,:,1],dim = 1)[0].item()
-                        
-                        
-                        obj_line = []
-                        
-                        obj_line.append("-") # frame number is not useful in this data
-                        obj_line.append(timestamp)
-                        obj_line.append(id)
-                        obj_line.append(self.class_dict[np.argmax(self.all_classes[id])])
-                        obj_line.append(minx)
-                        obj_line.append(miny)
-                        obj_line.append(maxx)
-                        obj_line.append(maxy)
-                        obj_line.append(0)
-                        obj_line.append(0)
+                    obj_line.append("-") # frame number is not useful in this data
+                    obj_line.append(timestamps[i].item())
+                    obj_line.append(ids[i].item())
+                    obj_line.append(self.class_dict[int(classes[i])])
+                    obj_line.append(minx[i])
+                    obj_line.append(miny[i])
+                    obj_line.append(maxx[i])
+                    obj_line.append(maxy[i])
+                    obj_line.append(0)
+                    obj_line.append(0)
 
-                        obj_line.append(gen)
-                        obj_line = obj_line + flat_3D + flat_space 
-                        state = state.data.numpy()
-                        obj_line.append(state[5])
-                        
-                        obj_line.append(camera)
-                        
-                        obj_line.append(0) # acceleration = 0 assumption
-                        obj_line.append(state[6])
-                        obj_line.append(state[0])
-                        obj_line.append(state[1])
-                        obj_line.append(np.pi/2.0 if state[5] == -1 else 0)
-                        obj_line.append(state[3])
-                        obj_line.append(state[2])
-                        obj_line.append(state[4])
+                    obj_line.append(gen)
+                    obj_line = obj_line + list(flat_3D[i]) + list(flat_space[i]) 
+                    obj_line.append(state[5])
+                    
+                    obj_line.append(camera)
+                    
+                    obj_line.append(0) # acceleration = 0 assumption
+                    obj_line.append(state[6])
+                    obj_line.append(state[0])
+                    obj_line.append(state[1])
+                    obj_line.append(np.pi/2.0 if state[5] == -1 else 0)
+                    obj_line.append(state[3])
+                    obj_line.append(state[2])
+                    obj_line.append(state[4])
 
 
-                        obj_line.append(self.all_ts_bias[i])
-                        out.writerow(obj_line)
+                    obj_line.append(ts_bias[i].tolist())
+                    out.writerow(obj_line)
                             
                             
         # end file writing
@@ -1554,11 +1504,7 @@ if __name__ == "__main__":
                     7:"trailer"
                     }
     
-    # load homography
-    with open("i24_all_homography.cpkl","rb") as f:
-        hg_old = pickle.load(f)
-        hg  = Homography()
-        hg.correspondence = hg_old.correspondence
+    # load homography - EB and WB correspondences are read from their .npz caches
     hg  = Homography_Wrapper()
 
     # load detector
@@ -1625,7 +1571,15 @@ if __name__ == "__main__":
             "mu_R3":mu_R3,
             "H3":H3
             }
-        
+    
+    # interacting multiple models - cruising model and maneuvering model with 10x process noise
+    IMM = True
+    if IMM:
+        kf_params["IMM"] = {
+            "Q_scale":[1.0,10.0],
+            "transition":[[0.97,0.03],
+                          [0.10,0.90]]
+            }
         
     
     #%% Run tracker
@@ -29,6 +29,7 @@ class Camera_Wrapper():
     def __init__(self,sequence,ds = 2):
         self.cap = cv2.VideoCapture(sequence)
         self.ds = ds
+        self.sequence = sequence
         
         #checksum_path="/home/worklab/Documents/derek/I24-video-processing/I24-video-ingest/resources/timestamp_pixel_checksum_6.pkl"
         #geom_path="/home/worklab/Documents/derek/I24-video-processing/I24-video-ingest/resources/timestamp_geometry_4K.pkl"
@@ -39,9 +40,9 @@ class Camera_Wrapper():
         checksum_path2="/home/worklab/Documents/derek/test-scripts/ts/timestamp_pixel_checksum_6_h12.pkl"
         geom_path2="/home/worklab/Documents/derek/test-scripts/ts/ts_geom_h12.pkl"
         
-        self.checksums = tsu.get_precomputed_checksums(checksum_path)
+        self.checksums = tsu.get_checksum_table(tsu.get_precomputed_checksums(checksum_path))
         self.geom = tsu.get_timestamp_geometry(geom_path)
-        self.checksums2 = tsu.get_precomputed_checksums(checksum_path2)
+        self.checksums2 = tsu.get_checksum_table(tsu.get_precomputed_checksums(checksum_path2))
         self.geom2 = tsu.get_timestamp_geometry(geom_path2)
         
         self.frame = None
@@ -49,21 +50,36 @@ class Camera_Wrapper():
         self.name = re.search("p\dc\d",sequence).group(0)
         
         self.all_ts = []
+        
+        # parsed timestamps are cached per video, if not yet cached they are parsed 
+        # and the cache is written once the whole video has been read
+        self.ts_parser = tsu.TimestampIndex.parser_signature([self.geom,self.geom2],[self.checksums,self.checksums2])
+        self.ts_index = tsu.TimestampIndex.load(sequence,self.ts_parser)
+        self.position = -1
+        self.parsed = []
     
         self.running_frame = None
         
     def __next__(self):
         last_ts = self.ts
         ret,self.frame = self.cap.read()
+        self.position += 1
         
-        # try both timestamp geometries
-        self.ts = tsu.parse_frame_timestamp(frame_pixels = self.frame, timestamp_geometry = self.geom, precomputed_checksums = self.checksums)[0]
-        if self.ts is None:
-            self.ts = tsu.parse_frame_timestamp(frame_pixels = self.frame, timestamp_geometry = self.geom2, precomputed_checksums = self.checksums2)[0]
-            
+        if not ret and self.ts_index is None and len(self.parsed) == self.position:
+            self.ts_index = tsu.TimestampIndex.write(self.sequence,self.parsed,self.ts_parser)
+        
+        if self.ts_index is not None:
+            self.ts = self.ts_index[self.position] if self.position < len(self.ts_index) else None
+        else:
+            # try both timestamp geometries
+            self.ts = tsu.parse_frame_timestamp(frame_pixels = self.frame, timestamp_geometry = self.geom, precomputed_checksums = self.checksums)[0]
             if self.ts is None:
-                self.ts = last_ts + 1/30.0
-                print("No timestamp parsed: {}".format(self.name))
+                self.ts = tsu.parse_frame_timestamp(frame_pixels = self.frame, timestamp_geometry = self.geom2, precomputed_checksums = self.checksums2)[0]
+            self.parsed.append(self.ts)
+            
+        if self.ts is None:
+            self.ts = last_ts + 1/30.0
+            print("No timestamp parsed: {}".format(self.name))
         
         self.all_ts.append(self.ts)
 
@@ -82,11 +98,28 @@ class Camera_Wrapper():
     def __len__(self):
         return int(self.cap.get(7))    
     
-    def skip(count):
+    def skip(self,count):
         for i in range(count):
             self.cap.grab()
+            self.position += 1
         
         next(self)
+    
+    def skip_to_time(self,target_time):
+        """
+        Advances to the first frame with timestamp >= target_time. If the timestamp 
+        index is cached the target frame is found with a binary search, otherwise 
+        (first pass over the video) frames are read and parsed one at a time. Stops 
+        at the last frame if no frame is late enough
+        """
+        if self.ts_index is None:
+            next(self)
+            while self.ts < target_time and self.position < len(self) - 1:
+                next(self)
+            return
+        
+        target = min(self.ts_index.seek(target_time),len(self.ts_index) - 1)
+        self.skip(max(target - self.position - 1,0))
 
 class Data_Reader():
     
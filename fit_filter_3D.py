@@ -24,7 +24,7 @@ from pytorch_retinanet_detector_directional.retinanet.model import resnet50
 
 from i24_fit_filter_dataset import Filtering_Dataset,collate
 from util_track.kf import Torch_KF
-from homography import Homography, load_i24_csv
+from homography import Homography, load_i24_csv, load_homography, save_homography
 
 
 def iou(a,b):
@@ -62,13 +62,13 @@ def iou(a,b):
 
 def get_homographies():
     try:
-        with open("i24_all_homography.cpkl","rb") as f:
-            hg = pickle.load(f)
+        hg = load_homography("i24_all_homography.npz")
         
-    except FileNotFoundError:
+    except (FileNotFoundError,ValueError):
         print("Regenerating i24 homgraphy...")
         
         hg = Homography()
+        fit_boxes,fit_heights,fit_names = [],[],[]
         for camera_name in ["p1c1","p1c2","p1c3","p1c4","p1c5","p1c6","p2c1","p2c2","p2c3","p2c4","p2c5","p2c6","p3c1","p3c2","p3c3"]:
             
             print("Adding camera {} to homography".format(camera_name))
@@ -98,11 +98,14 @@ def get_homographies():
         
             # load homography
             hg.add_i24_camera(point_file,vp_file,camera_name)
-            heights = hg.guess_heights(classes)
-            hg.scale_Z(boxes,heights,name = camera_name)
+            fit_boxes.append(boxes)
+            fit_heights.append(hg.guess_heights(classes))
+            fit_names.append(camera_name)
             
-        with open("i24_all_homography.cpkl","wb") as f:
-            pickle.dump(hg,f)
+        # scale Z axis, jointly for all cameras
+        hg.scale_Z(fit_boxes,fit_heights,name = fit_names)
+        
+        save_homography(hg,"i24_all_homography.npz")
     return hg
 
 
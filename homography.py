@@ -9,24 +9,109 @@ import sys, os
 import csv
 import _pickle as pickle
 
-def get_homographies(save_file = "i24_all_homography.cpkl", directory = "/home/worklab/Documents/derek/i24-dataset-gen/DATA/tform2", direction = "EB",fit_Z = True):
+# version of the array-based homography cache format written by save_homography
+HG_CACHE_VERSION = 1
+
+def save_homography(hg,save_file):
+    """
+    Writes all correspondences of a Homography object to a single .npz file. Each
+    correspondence entry (H, H_inv, P, vps, corr_pts, space_pts, ...) is stored as
+    its own array under the key "<camera name>/<entry>", alongside a schema version
+    and the list of camera names, so no pickled objects are needed to load it
+    
+    hg - Homography object
+    save_file - str path to .npz file
+    """
+    names = sorted(hg.correspondence.keys())
+    arrays = {"version":np.array(HG_CACHE_VERSION),
+              "names":np.array(names,dtype = str),
+              "default_correspondence":np.array("" if hg.default_correspondence is None else hg.default_correspondence)
+              }
+    for name in names:
+        for key,val in hg.correspondence[name].items():
+            arrays["{}/{}".format(name,key)] = np.asarray(val,dtype = float)
+    
+    # write to temporary file first so an interrupted write never leaves a corrupt cache
+    tmp_file = os.path.splitext(save_file)[0] + ".tmp.npz"
+    np.savez(tmp_file,**arrays)
+    os.replace(tmp_file,save_file)
+    
+def load_homography(save_file,names = None):
+    """
+    Loads a Homography object from a file written by save_homography. Arrays are 
+    read lazily, so only the correspondences for the requested cameras are loaded.
+    If no .npz file exists but a legacy pickled Homography (.cpkl) with the same
+    name does, it is unpickled and converted to .npz once
+    
+    save_file - str path to .npz (or legacy .cpkl) file
+    names - None or list of str camera names to load - if None, all are loaded
+    
+    returns - Homography object
+    """
+    npz_file = os.path.splitext(save_file)[0] + ".npz"
+    pkl_file = os.path.splitext(save_file)[0] + ".cpkl"
+    
+    if not os.path.exists(npz_file):
+        if not os.path.exists(pkl_file):
+            raise FileNotFoundError("No homography cache at {}".format(npz_file))
+        
+        print("Converting {} to {}".format(pkl_file,npz_file))
+        with open(pkl_file,"rb") as f:
+            hg_old = pickle.load(f)
+        hg = Homography()
+        hg.correspondence = hg_old.correspondence
+        hg.default_correspondence = hg_old.default_correspondence
+        hg.changed()
+        save_homography(hg,npz_file)
+        
+    hg = Homography()
+    with np.load(npz_file,allow_pickle = False) as data:
+        version = int(data["version"])
+        if version != HG_CACHE_VERSION:
+            raise ValueError("Homography cache {} has version {}, expected {}".format(npz_file,version,HG_CACHE_VERSION))
+        
+        all_names = [str(name) for name in data["names"]]
+        if names is None:
+            names = all_names
+        
+        keys = {}
+        for key in data.files:
+            if "/" in key:
+                name,entry = key.split("/",1)
+                keys.setdefault(name,[]).append(entry)
+        
+        for name in names:
+            if name not in all_names:
+                raise KeyError("No correspondence for {} in {}".format(name,npz_file))
+            hg.correspondence[name] = dict([(entry,data["{}/{}".format(name,entry)]) for entry in keys[name]])
+        hg.changed()
+        
+        default = str(data["default_correspondence"])
+        if default in hg.correspondence:
+            hg.default_correspondence = default
+        elif len(names) > 0:
+            hg.default_correspondence = names[0]
+            
+    return hg
+
+def get_homographies(save_file = "i24_all_homography.npz", directory = "/home/worklab/Documents/derek/i24-dataset-gen/DATA/tform2", direction = "EB",fit_Z = True):
     """
     Returns a Homography object with pre-loaded correspondences
-    save - (None or str) path to save_file - if file exists, it will be opened and returned
-            otherwise, it will be written
+    save - (None or str) path to save_file (.npz, see save_homography) - if file exists, 
+            it will be opened and returned otherwise, it will be written
     directory - (None or str) path to tform points - in None, default path used
     direction - "EB" or "WB" - specifies which transform should be preferentially loaded
     """
     
     try:
-        with open(save_file,"rb") as f:
-            hg = pickle.load(f)
+        hg = load_homography(save_file)
         
-    except FileNotFoundError:
+    except (FileNotFoundError,ValueError):
         print("Regenerating i24 homgraphy...")
         
         
         hg = Homography()
+        fit_boxes,fit_heights,fit_names = [],[],[]
         for camera_name in ["p1c1","p1c2","p1c3","p1c4","p1c5","p1c6","p2c1","p2c3","p2c5","p2c6","p3c1","p3c2","p3c3","p3c4","p3c5","p3c6"]:
             
             print("Adding camera {} to homography".format(camera_name))
@@ -65,15 +150,17 @@ def get_homographies(save_file = "i24_all_homography.cpkl", directory = "/home/w
                     boxes = torch.from_numpy(np.stack(boxes))
                     boxes = torch.stack((boxes[:,::2],boxes[:,1::2]),dim = -1)
                 
-                    # scale Z axis
-                    
-                    heights = hg.guess_heights(classes)
-                    hg.scale_Z(boxes,heights,name = camera_name)
+                    fit_boxes.append(boxes)
+                    fit_heights.append(hg.guess_heights(classes))
+                    fit_names.append(camera_name)
                 except:
                     pass
         
-        with open(save_file,"wb") as f:
-            pickle.dump(hg,f)
+        # scale Z axis, jointly for all cameras
+        if len(fit_names) > 0:
+            hg.scale_Z(fit_boxes,fit_heights,name = fit_names)
+        
+        save_homography(hg,save_file)
             
     return hg
 
@@ -81,77 +168,57 @@ def get_homographies(save_file = "i24_all_homography.cpkl", directory = "/home/w
 def line_to_point(line,point):
     """
     Given a line defined by two points, finds the distance from that line to the third point
-    line - (x0,y0,x1,y1) as floats
-    point - (x,y) as floats
+    line - (x0,y0,x1,y1) as floats, or [n,4] array of lines
+    point - (x,y) as floats, or [n,2] array of points
     Returns
     -------
-    distance - float >= 0
+    distance - float >= 0, or [n] array of distances
     """
+    line = np.asarray(line,dtype = float)
+    point = np.asarray(point,dtype = float)
     
-    numerator = np.abs((line[2]-line[0])*(line[1]-point[1]) - (line[3]-line[1])*(line[0]-point[0]))
-    denominator = np.sqrt((line[2]-line[0])**2 +(line[3]-line[1])**2)
+    numerator = np.abs((line[...,2]-line[...,0])*(line[...,1]-point[...,1]) - (line[...,3]-line[...,1])*(line[...,0]-point[...,0]))
+    denominator = np.sqrt((line[...,2]-line[...,0])**2 +(line[...,3]-line[...,1])**2)
     
     return numerator / (denominator + 1e-08)
 
-def find_vanishing_point(lines):
+def find_vanishing_point(lines,n_iterations = 20,huber_k = 1.345):
     """
-    Finds best (L2 norm) vanishing point given a list of lines
+    Finds best (L2 norm) vanishing point given a list of lines. Each line is written
+    in normal form n.p = c with unit normal n, so the point minimizing the sum of
+    squared distances to all lines is a 2-variable linear least squares problem. 
+    Outlier lines are down-weighted by iteratively reweighted least squares with 
+    Huber weights (scale estimated from the median absolute residual)
 
     Parameters
     ----------
-    lines : [(x0,y0,x1,y1), ...]
+    lines : [(x0,y0,x1,y1), ...] or [n,>=4] array (extra columns are ignored)
+    n_iterations : int, number of reweighting iterations
+    huber_k : float, residuals beyond huber_k * scale are down-weighted
 
     Returns
     -------
     vp - (x,y)
     """
+    lines = np.asarray(lines,dtype = float)[:,:4]
     
-    # mx+b form
-    #y0 = ax + c
-    #y1 = bx + d
-    
-    line0 = lines[0]
-    line1 = lines[1]
-    a = (line0[3] - line0[1])/line0[2] - line0[0]
-    b = (line1[3] - line1[1])/line1[2] - line1[0]
-    c = line0[1] - a*line0[0]
-    d = line1[1] - c*line1[0]
+    direction = lines[:,2:4] - lines[:,0:2]
+    normal = np.stack((-direction[:,1],direction[:,0]),axis = 1) / (np.linalg.norm(direction,axis = 1,keepdims = True) + 1e-08)
+    c = (normal * lines[:,0:2]).sum(axis = 1)
     
-    # intersection
-    px = (d-c)/(a-b)
-    py = a*(d-c)/(a-b) + c
-    best_dist = np.inf
-    
-    # using intersection as starting point, grid out a grid of 11 x 11 points with spacing g
-    g = 1e+16
-    n_pts = 31
-    
-    while g > 1:
-        #print("Gridding at g = {}".format(g))
-
-        # create grid centered around px,py with spacing g
-        
-        x_pts = np.arange(px-g*(n_pts//2),px+g*(n_pts//2),g)
-        y_pts = np.arange(py-g*(n_pts//2),py+g*(n_pts//2),g)
-        
-        for x in x_pts:
-            for y in y_pts:
-                # for each point in grid, compute average distance to vanishing point
-                dist = 0
-                for line in lines:
-                    dist += line_to_point(line,(x,y))**2
-                   
-                # keep best point in grid
-                if dist < best_dist:
-                    px = x 
-                    py = y
-                    best_dist = dist
-                    #print("Best vp so far: ({},{}), with average distance {}".format(px,py,np.sqrt(dist/len(lines))))
-    
-                # regrid
-        g = g / 10.0
-            
-    return [px,py]
+    weights = np.ones(len(lines))
+    for i in range(n_iterations):
+        sqrt_w = np.sqrt(weights)
+        vp = np.linalg.lstsq(normal * sqrt_w[:,None],c * sqrt_w,rcond = None)[0]
+        
+        residual = np.abs(normal.dot(vp) - c)
+        scale = 1.4826 * np.median(residual) + 1e-08
+        new_weights = np.minimum(1.0,huber_k * scale / np.maximum(residual,1e-12))
+        if np.allclose(new_weights,weights):
+            break
+        weights = new_weights
+        
+    return [vp[0],vp[1]]
 
 class Homography():
     """
@@ -187,6 +254,7 @@ class Homography():
         # each correspondence is: name: {H,H_inv,P,corr_pts,space_pts,vps} 
         # where H and H inv are 3x34 planar homography matrices and P is a 3x4 projection matrix
         self.correspondence = {}
+        self._version = 0 # incremented whenever a correspondence or class changes (see changed())
     
         self.class_heights = {
                 "sedan":4,
@@ -237,43 +305,24 @@ class Homography():
         self.default_correspondence = None
     
     def add_i24_camera(self,point_path,vp_path,camera_name):
-        # load points
-        corr_pts= []
-        space_pts = []
-        with open(point_path,"r") as f:
-            lines = f.readlines()
-            
-            for line in lines[1:-4]:
-                line = line.rstrip("\n").split(",")
-                corr_pts.append ([float(line[0]),float(line[1])])
-                space_pts.append([float(line[2]),float(line[3])])
-        
-        # load vps
-        lines1 = []
-        lines2 = []
-        lines3 = []
-        with open(vp_path,"r") as f:
-            read = csv.reader(f)
-            for item in read:
-                if item[4] == '0':
-                    lines1.append(np.array(item).astype(float))
-                elif item[4] == '1':
-                    lines2.append(np.array(item).astype(float))
-                elif item[4] == '2':
-                    lines3.append(np.array(item).astype(float))
+        # load points (first line is a header, last 4 lines are not correspondence points)
+        points = np.atleast_2d(np.genfromtxt(point_path,delimiter = ",",skip_header = 1,skip_footer = 4,usecols = (0,1,2,3)))
+        corr_pts = points[:,0:2]
+        space_pts = points[:,2:4]
+        
+        # load vps - each row is x0,y0,x1,y1,axis (non-numeric rows are read as nan and never match an axis)
+        vp_lines = np.atleast_2d(np.genfromtxt(vp_path,delimiter = ","))
         
         # get all axis labels for a particular axis orientation
-        vp1 = find_vanishing_point(lines1)
-        vp2 = find_vanishing_point(lines2)
-        vp3 = find_vanishing_point(lines3)
-        vps = [vp1,vp2,vp3]
+        vps = [find_vanishing_point(vp_lines[vp_lines[:,4] == axis]) for axis in [0,1,2]]
         
         self.add_correspondence(corr_pts,space_pts,vps,name = camera_name)
         
     
-    def i24_space_to_state(self,points):
+    def i24_space_to_state(self,points,curvature = None):
         """
         points - [d,8,3] array of x,y,z points for fbr,fbl,bbr,bbl,ftr,ftl,fbr,fbl
+        curvature - None or [1,3] or [d,3] tensor of curvature coefficients (see set_curvature())
         
         returns - [d,6] array of points in state formulation
         """
@@ -300,9 +349,16 @@ class Homography():
         # direction is +1 if vehicle is traveling along direction of increasing x, otherwise -1
         new_pts[:,5] = torch.sign( ((points[:,0,0] + points[:,1,0]) - (points[:,2,0] + points[:,3,0]))/2.0 ) 
                 
-        return new_pts
+        return self.curve_states(new_pts,curvature,sign = -1)
+        
+    def i24_state_to_space(self,points,curvature = None):
+        """
+        points - [d,6] array of points in state formulation
+        curvature - None or [1,3] or [d,3] tensor of curvature coefficients (see set_curvature())
         
-    def i24_state_to_space(self,points):
+        returns - [d,8,3] array of x,y,z points for fbr,fbl,bbr,bbl,ftr,ftl,fbr,fbl
+        """
+        points = self.curve_states(points,curvature)
         d = points.shape[0]
         new_pts = torch.zeros([d,8,3])
         
@@ -320,16 +376,24 @@ class Homography():
         return new_pts
     
     
-    def space_to_state(self,points):
+    def space_to_state(self,points,name = None):
         """
         points - [d,m,3] matrix of points in 3-space
+        name - str, or list of str or [d] long tensor of camera indices, selects the
+               curvature model (see set_curvature()) for the i24 state formulation
         """
+        if self.is_i24_state():
+            return self.f1(points,self.get_curvature(name,points.device))
         return self.f1(points)
     
-    def state_to_space(self,points):
+    def state_to_space(self,points,name = None):
         """
         points - [d,m,s] matrix of points in state formulation
+        name - str, or list of str or [d] long tensor of camera indices, selects the
+               curvature model (see set_curvature()) for the i24 state formulation
         """
+        if self.is_i24_state():
+            return self.f2(points,self.get_curvature(name,points.device))
         return self.f2(points)
     
 
@@ -371,6 +435,7 @@ class Homography():
         cor["P"] = P
         
         self.correspondence[name] = cor
+        self.changed()
         
         if self.default_correspondence is None:
             self.default_correspondence = name
@@ -379,17 +444,137 @@ class Homography():
     
     def remove_correspondence(self,name):        
         try:
-            del self.correspondences[name]
+            del self.correspondence[name]
+            self.changed()
             print("Deleted correspondence for {}".format(name))
         except KeyError:
             print("Tried to delete correspondence {}, but this does not exist".format(name))
     
+    def changed(self):
+        """
+        Marks the correspondences and classes as modified, so that stacked tensors and
+        the class table are rebuilt. Called by all methods that change a correspondence
+        or class - call it after editing self.correspondence (or any matrix in it), 
+        class_dict, class_heights or class_dims directly
+        """
+        self._version = getattr(self,"_version",0) + 1
+        self._class_table = None
+    
+    def stacked(self,device = torch.device("cpu")):
+        """
+        Returns stacked correspondence tensors on device, indexed by integer camera 
+        index (correspondence names in sorted order). Tensors are rebuilt only when 
+        the correspondences have changed (see changed())
+        
+        device - torch.device
+        
+        returns - dict with keys:
+            "H_T"   - [n_cams,3,3] tensor of transposed H matrices 
+            "P"     - [n_cams,3,4] tensor of P matrices
+            "curvature" - [n_cams,3] tensor of curvature coefficients (see set_curvature())
+            "curved" - True if any correspondence has a curvature model
+            "names" - list of correspondence names
+            "index" - dict of name: camera index
+        """
+        # Homography objects may have been pickled before stacked tensors existed
+        version = getattr(self,"_version",0)
+        cache = getattr(self,"_stacked_cache",None)
+        if cache is None or cache["version"] != version:
+            names = sorted(self.correspondence.keys())
+            cache = {"version":version,"devices":{}}
+            cache["names"] = names
+            cache["index"] = dict([(n,i) for i,n in enumerate(names)])
+            cache["H_T"] = torch.from_numpy(np.stack([self.correspondence[n]["H"].transpose(1,0) for n in names])).double()
+            cache["P"] = torch.from_numpy(np.stack([self.correspondence[n]["P"] for n in names])).double()
+            cache["curvature"] = torch.from_numpy(np.stack([self.correspondence[n].get("curvature",np.zeros(3)) for n in names])).double()
+            cache["curved"] = bool((cache["curvature"] != 0).any())
+            self._stacked_cache = cache
+        
+        if device not in cache["devices"]:
+            cache["devices"][device] = {"H_T":cache["H_T"].to(device),
+                                        "P":cache["P"].to(device),
+                                        "curvature":cache["curvature"].to(device),
+                                        "curved":cache["curved"],
+                                        "names":cache["names"],
+                                        "index":cache["index"]}
+        return cache["devices"][device]
+    
+    def cam_index(self,name):
+        """
+        Converts correspondence names into camera indices for the stacked tensors
+        
+        name - str or list of str correspondence names
+        
+        returns - int, or [d] long tensor of camera indices
+        """
+        index = self.stacked()["index"]
+        if type(name) == list:
+            return torch.tensor([index[sub_n] for sub_n in name],dtype = torch.long)
+        return index[name]
+    
+    
+    def set_curvature(self,name,coeffs):
+        """
+        Registers a road curvature model for a correspondence. State y is measured
+        relative to the curved roadway, so space y = state y + p2*x^2 + p1*x + p0 
+        where x is the rear x coordinate of each object. The offset is applied inside
+        the i24 state <-> space transforms, so every state transform uses the same model
+        
+        name - str correspondence name
+        coeffs - [p2,p1,p0] polynomial coefficients (as returned by np.polyfit), or None to
+                 remove the curvature model
+        """
+        if coeffs is None:
+            self.correspondence[name].pop("curvature",None)
+        else:
+            self.correspondence[name]["curvature"] = np.array(coeffs,dtype = float).reshape(3)
+        self.changed()
+    
+    def get_curvature(self,name,device):
+        """
+        name - str, or list of str or [d] long tensor of camera indices
+        
+        returns - None if no correspondence has a curvature model, otherwise [1,3] or [d,3] tensor of coefficients
+        """
+        if name is None:
+            name = self.default_correspondence
+        if name is None or not self.stacked(device)["curved"]:
+            return None
+        return self.get_matrix("curvature",name,device)
+    
+    @staticmethod
+    def curvature_offset(x,curvature):
+        """
+        x - [d] tensor of x coordinates
+        curvature - [1,3] or [d,3] tensor of p2,p1,p0 coefficients
+        
+        returns - [d] tensor of space y offsets
+        """
+        return (curvature[:,0]*x + curvature[:,1])*x + curvature[:,2]
+    
+    @staticmethod
+    def curve_states(points,curvature,sign = 1):
+        """
+        Shifts state y by the curvature offset at the state x, from road-relative to
+        space y (sign = 1) or back (sign = -1)
+        
+        points - [d,s] array of points in state formulation
+        curvature - None or [1,3] or [d,3] tensor of curvature coefficients
+        
+        returns - [d,s] shifted copy of points (points itself if curvature is None)
+        """
+        if curvature is None:
+            return points
+        points = points.clone()
+        points[:,1] += sign * Homography.curvature_offset(points[:,0].double(),curvature.to(points.device)).to(points.dtype)
+        return points
     
     def im_to_space(self,points, name = None,heights = None):
         """
         Converts points by means of ____________
         
         points - [d,m,2] array of points in image
+        name - str, or list of str or [d] long tensor of camera indices (see cam_index()) with one entry per object
         """
         if name is None:
             name = self.default_correspondence
@@ -403,12 +588,12 @@ class Homography():
         
         if heights is not None:
             
-            if type(name) == list:
-                H = torch.from_numpy(np.stack([self.correspondence[sub_n]["H"].transpose(1,0) for sub_n in name])) # note that must do transpose(1,0) because this is a numpy operation, not a torch operation ...
-                H = H.unsqueeze(1).repeat(1,8,1,1).reshape(-1,3,3)
-                points = points.unsqueeze(1)
-                new_pts = torch.bmm(points,H)
-                new_pts = new_pts.squeeze(1)
+            if type(name) == list or torch.is_tensor(name):
+                # one stacked H per object, shared by all of its points
+                if type(name) == list:
+                    name = self.cam_index(name)
+                H = self.stacked(points.device)["H_T"][name.to(points.device)]
+                new_pts = torch.bmm(points.reshape(d,-1,3),H).reshape(-1,3)
             else:
                 H = torch.from_numpy(self.correspondence[name]["H"]).transpose(0,1)
                 new_pts = torch.matmul(points,H)
@@ -442,6 +627,7 @@ class Homography():
         performed by flattening batch dimension d and object point dimension m together
         
         points - [d,m,3] array of points in 3-space
+        name - str, or list of str or [d] long tensor of camera indices (see cam_index()) with one entry per object
         """
         if name is None:
             name = self.default_correspondence
@@ -454,11 +640,12 @@ class Homography():
         
         
         # project into [dm,3]
-        if type(name) == list:
-                P = torch.from_numpy(np.stack([self.correspondence[sub_n]["P"] for sub_n in name]))
-                P = P.unsqueeze(1).repeat(1,8,1,1).reshape(-1,3,4)
-                points = points.unsqueeze(1).transpose(1,2)
-                new_pts = torch.bmm(P,points).squeeze(2)
+        if type(name) == list or torch.is_tensor(name):
+                # one stacked P per object, shared by all of its points
+                if type(name) == list:
+                    name = self.cam_index(name)
+                P = self.stacked(points.device)["P"][name.to(points.device)]
+                new_pts = torch.bmm(points.reshape(d,-1,4),P.transpose(1,2)).reshape(-1,3)
         else:
             points = torch.transpose(points,0,1).double()
             P = torch.from_numpy(self.correspondence[name]["P"]).double()
@@ -478,43 +665,213 @@ class Homography():
     
     def state_to_im(self,points,name = None):
         """
-        Calls state_to_space, then space_to_im
+        Calls state_to_space, then space_to_im (fused into one operation for the
+        default i24 state formulation)
         
         points - [d,s] matrix of points in state formulation
         """
         if name is None:
             name = self.default_correspondence
         
-        return self.space_to_im(self.state_to_space(points),name = name)
+        if self.is_i24_state():
+            points = self.curve_states(points,self.get_curvature(name,points.device))
+            return self.i24_state_to_im(points,self.get_matrix("P",name,points.device))
+        return self.space_to_im(self.state_to_space(points,name = name),name = name)
     
     
     def im_to_state(self,points,name = None, heights = None):
         """
-        Calls im_to_space, then space_to_state
+        Calls im_to_space, then space_to_state (fused into one operation for the
+        default i24 state formulation)
         
         points - [d,m,2] array of points in image
         """
         if name is None:
             name = self.default_correspondence
         
-        return self.space_to_state(self.im_to_space(points,heights = heights,name = name))
+        if self.is_i24_state() and heights is not None:
+            states = self.i24_im_to_state(points,self.get_matrix("H_T",name,points.device),heights)[0]
+            return self.curve_states(states,self.get_curvature(name,points.device),sign = -1)
+        return self.space_to_state(self.im_to_space(points,heights = heights,name = name),name = name)
     
-    def guess_heights(self,classes):
+    def is_i24_state(self):
+        """
+        True if f1 and f2 are the default i24 state formulation, so fused transforms can be used
+        """
+        return getattr(self.f1,"__func__",None) is Homography.i24_space_to_state and \
+               getattr(self.f2,"__func__",None) is Homography.i24_state_to_space
+    
+    def get_matrix(self,key,name,device):
+        """
+        key - "H_T" or "P"
+        name - str, or list of str or [d] long tensor of camera indices
+        
+        returns - [1,3,n] tensor for a single correspondence or [d,3,n] tensor with one matrix per object
+        """
+        stacked = self.stacked(device)
+        if type(name) == list:
+            name = self.cam_index(name)
+        elif not torch.is_tensor(name):
+            return stacked[key][stacked["index"][name]].unsqueeze(0)
+        return stacked[key][name.to(device)]
+    
+    # corner coefficients for the fused i24 state -> image projection. Corner k in space is
+    # (x + a_k*dir*l, y + b_k*dir*w/2, -c_k*h) for corners fbr,fbl,bbr,bbl,ftr,ftl,btr,btl
+    i24_corner_coeffs = torch.tensor([[1,-1,0],
+                                      [1, 1,0],
+                                      [0,-1,0],
+                                      [0, 1,0],
+                                      [1,-1,1],
+                                      [1, 1,1],
+                                      [0,-1,1],
+                                      [0, 1,1]]).double()
+    
+    def i24_state_to_im(self,points,P):
+        """
+        Fused i24_state_to_space + space_to_im. Since projection is linear before the 
+        final division, each projected corner is P applied to the rear bottom center 
+        plus a fixed combination of the projected length, width and height vectors.
+        Any curvature offset must already be applied to points (see curve_states())
+        
+        points - [d,6] array of points in state formulation
+        P - [1,3,4] or [d,3,4] tensor of projection matrices
+        
+        returns - [d,8,2] array of points in image
+        """
+        points = points.double()
+        direction = points[:,5:6]
+        
+        # projected rear bottom center - [d,3]
+        base = P[:,:,0]*points[:,0:1] + P[:,:,1]*points[:,1:2] + P[:,:,3]
+        
+        # projected length, half-width and height vectors - [d,3,3]
+        terms = torch.stack((P[:,:,0]*(direction*points[:,2:3]),
+                             P[:,:,1]*(direction*points[:,3:4]/2.0),
+                             P[:,:,2]*(-points[:,4:5])),dim = 1)
+        
+        # [d,8,3]
+        new_pts = base.unsqueeze(1) + torch.matmul(self.i24_corner_coeffs.to(points.device),terms)
+        
+        return new_pts[:,:,:2] / new_pts[:,:,2:3]
+    
+    def i24_im_to_state(self,points,H_T,heights):
         """
-        classes - [d] vector of string class names
+        Fused im_to_space + i24_space_to_state. Only the 4 bottom points determine
+        x, y, l, w and direction, and h is the given height, so only those are projected.
+        Returned states are not corrected for curvature (see curve_states())
         
-        returns - [d] vector of float object height guesses
+        points - [d,8,2] array of points in image
+        H_T - [1,3,3] or [d,3,3] tensor of transposed H matrices
+        heights - [d] tensor of object heights
+        
+        returns - [d,6] array of points in state formulation, [d,4,2] bottom points in space
+        """
+        d = points.shape[0]
+        bottom = points[:,:4,:].double()
+        bottom = torch.cat((bottom,torch.ones([d,4,1],dtype = torch.double,device = points.device)),2)
+        bottom = torch.matmul(bottom,H_T)
+        bottom = bottom[:,:,:2] / bottom[:,:,2:3]
+        
+        x_front = bottom[:,0,0] + bottom[:,1,0]
+        x_rear  = bottom[:,2,0] + bottom[:,3,0]
+        
+        new_pts = torch.zeros([d,6],device = points.device)
+        new_pts[:,0] = x_rear / 2.0
+        new_pts[:,1] = (bottom[:,0,1] + bottom[:,1,1] + bottom[:,2,1] + bottom[:,3,1]) / 4.0
+        new_pts[:,2] = torch.abs(x_front - x_rear) / 2.0
+        new_pts[:,3] = torch.abs(((bottom[:,0,1] + bottom[:,2,1]) - (bottom[:,1,1] + bottom[:,3,1]))/2.0)
+        new_pts[:,4] = torch.abs(heights.double())
+        new_pts[:,5] = torch.sign((x_front - x_rear)/2.0)
+        
+        return new_pts,bottom
+    
+    def class_table(self):
+        """
+        Returns per-class height and dimension tensors indexed by integer class id 
+        (as in class_dict), built from class_heights and class_dims on first use and
+        rebuilt after changed(). The last row holds the "other" values and is used 
+        for any unknown class
+        
+        returns - dict with keys:
+            "heights" - [n_classes+1] float tensor of object heights
+            "dims"    - [n_classes+1,3] float tensor of object l,w,h
+            "ids"     - dict of str class name: row index
         """
+        # Homography objects may have been pickled before class tables existed
+        table = getattr(self,"_class_table",None)
+        if table is None:
+            n_classes = max([key for key in self.class_dict.keys() if type(key) == int]) + 1
+            names = [self.class_dict.get(i,"other") for i in range(n_classes)] + ["other"]
+            
+            ids = dict([(key,val) for key,val in self.class_dict.items() if type(key) == str])
+            for name in list(self.class_heights.keys()) + list(self.class_dims.keys()):
+                if name not in ids:
+                    ids[name] = n_classes
+            
+            table = {
+                "heights": torch.tensor([self.class_heights.get(n,self.class_heights["other"]) for n in names],dtype = torch.float),
+                "dims":    torch.tensor([self.class_dims.get(n,self.class_dims["other"]) for n in names],dtype = torch.float),
+                "ids":     ids
+                }
+            self._class_table = table
+        return table
+    
+    def add_class(self,name,class_id,height = None,dims = None):
+        """
+        Registers a new object class (or updates an existing one)
         
-        heights = torch.zeros(len(classes))
+        name - str class name
+        class_id - int class id
+        height - float object height guess, or None to use the "other" height
+        dims - [l,w,h] object dimension guess, or None to use the "other" dimensions
+        """
+        self.class_dict[name] = class_id
+        self.class_dict[class_id] = name
+        if height is not None:
+            self.class_heights[name] = height
+        if dims is not None:
+            self.class_dims[name] = list(dims)
+        self.changed()
+    
+    def class_ids(self,classes):
+        """
+        Converts classes into row indices for class_table()
+        
+        classes - [d] long tensor or array of int class ids, or list of str class names or int ids
+        
+        returns - [d] long tensor of class ids, unknown classes are mapped to the "other" row
+        """
+        table = self.class_table()
+        other = len(table["heights"]) - 1
         
-        for i in range(len(classes)):
-            try:
-                heights[i] = self.class_heights[classes[i]]
-            except KeyError:
-                heights[i] = self.class_heights["other"]
+        if isinstance(classes,torch.Tensor):
+            ids = classes.reshape(-1).long()
+        elif isinstance(classes,np.ndarray) and classes.dtype.kind in "iu":
+            ids = torch.from_numpy(classes.reshape(-1).astype(np.int64))
+        else:
+            ids = torch.tensor([table["ids"].get(cls,other) if type(cls) == str else int(cls) for cls in classes],dtype = torch.long)
             
-        return heights
+        return torch.where((ids >= 0) & (ids < other),ids,torch.full_like(ids,other))
+    
+    def guess_heights(self,classes):
+        """
+        classes - [d] long tensor of class ids or list of string class names (see class_ids())
+        
+        returns - [d] vector of float object height guesses, on the same device as classes if a tensor
+        """
+        ids = self.class_ids(classes)
+        heights = self.class_table()["heights"].to(ids.device)
+        return heights[ids]
+    
+    def guess_dims(self,classes):
+        """
+        classes - [d] long tensor of class ids or list of string class names (see class_ids())
+        
+        returns - [d,3] tensor of float object l,w,h guesses
+        """
+        ids = self.class_ids(classes)
+        dims = self.class_table()["dims"].to(ids.device)
+        return dims[ids]
     
     def height_from_template(self,template_boxes,template_space_heights,boxes):
         """
@@ -610,11 +967,17 @@ class Homography():
         relative to the other columns. This function scales P optimally
         to minimize the reprojection errror of the given boxes with the given heights
         
+        The state of each box depends only on H, so it is computed once. The reprojection
+        of each point is then (P*x + C*P[:,2]*z), so the error for many values of the 
+        scale factor C can be evaluated in one batched op. A coarse grid brackets the 
+        minimum and a golden-section search refines it, for all correspondences at once
+        
         boxes - [d,8,2] array of image points corresponding to object bounding boxes
-                d indexes objects
-        heights - [d] array of object heights (in space coordinates e.g. feet)
-        name - str - correspondence 
-        granularity - float - controls the minimum step size for grid search 
+                d indexes objects, or list of such arrays (one per name)
+        heights - [d] array of object heights (in space coordinates e.g. feet), or list 
+                of such arrays (one per name)
+        name - str - correspondence, or list of str correspondences to fit together
+        granularity - float - controls the final width of the search bracket
         max_scale - float - roughly, a reasonable upper estimate for the space-unit change
                 corresponding to one pixel in the Z direction
                 
@@ -622,49 +985,66 @@ class Homography():
         """
         if name is None:
             name = self.default_correspondence
-        
-        P_orig = self.correspondence[name]["P"].copy()
-        
-        upper_bound = max_scale
-        lower_bound = granularity
-        
-        # create a grid of 10 evenly spaced entries between upper and lower bound
-        C_grid = np.linspace(lower_bound,upper_bound,num = 10)
-        step_size = C_grid[1] - C_grid[0]
-        iteration = 1
-        
-        while step_size > granularity:
+        if type(name) != list:
+            name,boxes,heights = [name],[boxes],[heights]
+        n_cams = len(name)
+        
+        # reprojected homogeneous points are base + C*slope
+        base,slope,target,cam = [],[],[],[]
+        for i,n in enumerate(name):
+            points = torch.as_tensor(boxes[i]).double()
+            state = self.im_to_state(points,heights = torch.as_tensor(heights[i]),name = n)
+            space = self.state_to_space(state,name = n).double()
+            P = torch.from_numpy(self.correspondence[n]["P"]).double()
             
-            best_error = np.inf
-            best_C = None
-            # for each value of P, get average reprojection error
-            for C in C_grid:
-                
-                # scale P
-                P = P_orig.copy()
-                P[:,2] *= C
-                self.correspondence[name]["P"] = P
-                
-                # test error
-                error = self.test_transformation(boxes,name = name, heights = heights,verbose = False)
-                
-                # if this is the best so far, store it
-                if error < best_error:
-                    best_error = error
-                    best_C = C
-                    
+            base.append(torch.matmul(space[:,:,:2],P[:,:2].transpose(0,1)) + P[:,3])
+            slope.append(space[:,:,2:] * P[:,2])
+            target.append(points)
+            cam.append(torch.full([len(points)],i,dtype = torch.long))
             
-            # define new upper, lower  with width 2*step_size centered on best value
-            #print("On loop {}: best C so far: {} avg error {}".format(iteration,best_C,best_error))
-            lower_bound = best_C - step_size
-            upper_bound = best_C + step_size
-            C_grid = np.linspace(lower_bound,upper_bound,num = 10)
-            step_size = C_grid[1] - C_grid[0]
-
-            #print("New C_grid: {}".format(C_grid.round(4)))
-            iteration += 1
-        print("Best Error: {}".format(best_error))
-        
+        base = torch.cat(base).unsqueeze(1)
+        slope = torch.cat(slope).unsqueeze(1)
+        target = torch.cat(target).unsqueeze(1)
+        cam = torch.cat(cam)
+        counts = torch.bincount(cam,minlength = n_cams).double().unsqueeze(1)
+        
+        def error(C):
+            """
+            C - [n_cams,k] candidate scale factors
+            returns - [n_cams,k] average top + bottom reprojection error (as in test_transformation)
+            """
+            repro = base + C[cam][:,:,None,None]*slope
+            repro = repro[:,:,:,:2] / repro[:,:,:,2:]
+            dist = torch.sqrt(torch.pow(repro - target,2).sum(dim = -1))
+            per_box = dist[:,:,:4].mean(dim = -1) + dist[:,:,4:].mean(dim = -1)
+            return torch.zeros(n_cams,C.shape[1],dtype = torch.double).index_add_(0,cam,per_box) / counts
+        
+        # bracket the minimum with a coarse grid
+        C_grid = torch.linspace(granularity,max_scale,100,dtype = torch.double).unsqueeze(0).expand(n_cams,-1)
+        best = torch.argmin(error(C_grid),dim = 1)
+        step_size = C_grid[0,1] - C_grid[0,0]
+        lower = torch.clamp(C_grid[0,best] - step_size,min = granularity)
+        upper = C_grid[0,best] + step_size
+        
+        # golden-section search within each bracket
+        inv_phi = (np.sqrt(5) - 1) / 2.0
+        while (upper - lower).max() > granularity:
+            c1 = upper - inv_phi * (upper - lower)
+            c2 = lower + inv_phi * (upper - lower)
+            err = error(torch.stack((c1,c2),dim = 1))
+            left = err[:,0] < err[:,1]
+            upper = torch.where(left,c2,upper)
+            lower = torch.where(left,lower,c1)
+        
+        best_C = (upper + lower) / 2.0
+        best_error = error(best_C.unsqueeze(1))[:,0]
+        
+        for i,n in enumerate(name):
+            P = self.correspondence[n]["P"].copy()
+            P[:,2] *= best_C[i].item()
+            self.correspondence[n]["P"] = P
+            print("Best Error for {}: {}".format(n,best_error[i].item()))
+        self.changed()
         
 
     def plot_boxes(self,im,boxes,color = (255,255,255),labels = None,thickness = 1):
@@ -800,12 +1180,13 @@ class Homography_Wrapper():
     Implemented functions:
         im_to_space
         im_to_state
-        state_to_space  (identical to Homgraphy, pass-through function)
+        state_to_space  (identical to Homgraphy except for the curvature model, see set_curvature())
         state_to_im
         space_to_im
-        space_to_state (identical to Homgraphy, pass-through function)
+        space_to_state (identical to Homgraphy except for the curvature model, see set_curvature())
         plot_boxes 
         guess_heights (identical to Homography, pass-through function)
+        guess_dims (identical to Homography, pass-through function)
         height_from_template (identical to Homography, pass-through function)
         
         
@@ -823,43 +1204,163 @@ class Homography_Wrapper():
         self.hg2 = hg2
         
         if hg1 is None and hg2 is None:
-            self.hg1 = get_homographies(save_file = "EB_homography2.cpkl",direction = "EB")
-            self.hg2 = get_homographies(save_file = "WB_homography2.cpkl",direction = "WB")
+            self.hg1 = get_homographies(save_file = "EB_homography2.npz",direction = "EB")
+            self.hg2 = get_homographies(save_file = "WB_homography2.npz",direction = "WB")
         
     ## Pass-through functions 
+    def cam_index(self,name):
+        # hg1 and hg2 have the same correspondence names, so camera indices are shared
+        return self.hg1.cam_index(name)
     def guess_heights(self,classes):
         return self.hg1.guess_heights(classes)
-    def state_to_space(self,points):
-        return self.hg1.state_to_space(points)
-    def space_to_state(self,points):
-        return self.hg1.space_to_state(points)
+    def guess_dims(self,classes):
+        return self.hg1.guess_dims(classes)
+    def state_to_space(self,points,name = None):
+        if not self.hg1.is_i24_state():
+            return self.hg1.state_to_space(points)
+        # curvature of hg1 or hg2 based on y coordinate of the first corner (as in state_to_im)
+        side = (points[:,1] - points[:,5]*points[:,3]/2.0) > 60
+        return self.hg1.i24_state_to_space(points,self.merged_curvature(name,side,points.device))
+    def space_to_state(self,points,name = None):
+        if not self.hg1.is_i24_state():
+            return self.hg1.space_to_state(points)
+        # curvature of hg1 or hg2 based on y coordinate of the first corner (as in space_to_im)
+        side = points[:,0,1] > 60
+        return self.hg1.i24_space_to_state(points,self.merged_curvature(name,side,points.device))
     def height_from_template(self,template_boxes,template_space_heights,boxes):
         return self.hg1.height_from_template(template_boxes,template_space_heights,boxes)
+    def set_curvature(self,name,coeffs,direction = 1):
+        # direction 1 (EB) curvature is stored in hg1, direction -1 (WB) in hg2
+        hg = self.hg1 if direction == 1 else self.hg2
+        hg.set_curvature(name,coeffs)
 
     ## Wrapper functions
+    def stacked(self,device = torch.device("cpu")):
+        """
+        Returns the stacked correspondence tensors of hg1 and hg2 merged into one table,
+        indexed by camera index*2 + side (0 for hg1, 1 for hg2, see merged_index()), 
+        so that a batch of objects on both sides can be projected with one call. 
+        Rebuilt whenever either Homography rebuilds its stacked tensors
+        
+        device - torch.device
+        
+        returns - dict with keys "H_T" [2*n_cams,3,3], "P" [2*n_cams,3,4], "curvature" [2*n_cams,3], 
+                  "curved", "names", "index"
+        """
+        stacked1 = self.hg1.stacked(device)
+        stacked2 = self.hg2.stacked(device)
+        
+        cache = getattr(self,"_merged_cache",None)
+        if cache is None:
+            cache = {}
+            self._merged_cache = cache
+        
+        merged = cache.get(device)
+        if merged is None or merged["hg1"] is not stacked1 or merged["hg2"] is not stacked2:
+            if stacked1["names"] != stacked2["names"]:
+                raise ValueError("hg1 and hg2 must have the same correspondence names")
+            merged = {"hg1":stacked1,
+                      "hg2":stacked2,
+                      "H_T":torch.stack((stacked1["H_T"],stacked2["H_T"]),dim = 1).reshape(-1,3,3),
+                      "P":torch.stack((stacked1["P"],stacked2["P"]),dim = 1).reshape(-1,3,4),
+                      "curvature":torch.stack((stacked1["curvature"],stacked2["curvature"]),dim = 1).reshape(-1,3),
+                      "curved":stacked1["curved"] or stacked2["curved"],
+                      "names":stacked1["names"],
+                      "index":stacked1["index"]}
+            cache[device] = merged
+        return merged
+    
+    def merged_index(self,name,side,device):
+        """
+        name - str, or list of str or [d] long tensor of camera indices (see cam_index())
+        side - [d] bool tensor, True where hg2 should be used
+        
+        returns - [d] long tensor of indices into the merged table (see stacked())
+        """
+        if name is None:
+            name = self.hg1.default_correspondence
+        if type(name) == list:
+            name = self.cam_index(name)
+        if torch.is_tensor(name):
+            cam = name.to(device).long()
+        else:
+            cam = self.stacked(device)["index"][name]
+        return cam*2 + side.long()
+    
+    def merged_curvature(self,name,side,device):
+        """
+        returns - None if no correspondence has a curvature model, otherwise [d,3] tensor 
+                  of curvature coefficients from hg1 or hg2 (where side is True)
+        """
+        merged = self.stacked(device)
+        if not merged["curved"]:
+            return None
+        return merged["curvature"][self.merged_index(name,side,device)]
+    
+    def hg2_side(self,points,name,device):
+        """
+        Selects hg2 for image points whose first point lies beyond the centerline (y > 60) 
+        when projected into space with hg1. Only that single point is projected
+        
+        points - [d,m,3] homogeneous image points 
+        
+        returns - [d] bool tensor, True where hg2 should be used
+        """
+        H_T = self.stacked(device)["H_T"][self.merged_index(name,torch.zeros(points.shape[0],dtype = torch.bool,device = device),device)]
+        first = torch.bmm(points[:,:1,:],H_T)
+        return (first[:,0,1] / first[:,0,2]) > 60
+    
     def im_to_space(self,points, name = None,heights = None):
-        boxes  = self.hg1.im_to_space(points,name = name, heights = heights)
-        boxes2 = self.hg2.im_to_space(points,name = name, heights = heights)
-
-        # get indices where to use boxes1 and where to use boxes2 based on centerline y
-        ind = torch.where(boxes[:,0,1] > 60)[0] 
-        boxes[ind,:,:] = boxes2[ind,:,:]
-        return boxes
+        if heights is None:
+            print("No heights were input")
+            return
+        
+        d = points.shape[0]
+        points = torch.cat((points.double(),torch.ones([d,points.shape[1],1],dtype = torch.double,device = points.device)),2)
+        
+        side = self.hg2_side(points,name,points.device)
+        H_T = self.stacked(points.device)["H_T"][self.merged_index(name,side,points.device)]
+        new_pts = torch.bmm(points,H_T)
+        new_pts = new_pts[:,:,:2] / new_pts[:,:,2:3]
+        
+        # add third column for height
+        new_pts = torch.cat((new_pts,torch.zeros([d,new_pts.shape[1],1],dtype = torch.double,device = points.device)),2)
+        new_pts[:,[4,5,6,7],2] = heights.unsqueeze(1).repeat(1,4).double().to(points.device)
+        return new_pts
     
     def space_to_im(self,points,name = None):
-        boxes  = self.hg1.space_to_im(points,name = name)
-        boxes2 = self.hg2.space_to_im(points,name = name)
+        d = points.shape[0]
         
-        # get indices where to use boxes1 and where to use boxes2 based on centerline y
-        ind = torch.where(points[:,0,1] > 60)[0]
-        boxes[ind,:] = boxes2[ind,:]        
-        return boxes
+        # use hg1 or hg2 based on centerline y
+        side = points[:,0,1] > 60
+        P = self.stacked(points.device)["P"][self.merged_index(name,side,points.device)]
+        
+        points = torch.cat((points.double(),torch.ones([d,points.shape[1],1],dtype = torch.double,device = points.device)),2)
+        new_pts = torch.bmm(points,P.transpose(1,2))
+        return new_pts[:,:,:2] / new_pts[:,:,2:3]
     
     def im_to_state(self,points,name = None, heights = None):
-        return self.space_to_state(self.im_to_space(points,name = name, heights = heights))
+        if heights is None or not (self.hg1.is_i24_state() and self.hg2.is_i24_state()):
+            return self.space_to_state(self.im_to_space(points,name = name, heights = heights),name = name)
+        
+        d = points.shape[0]
+        bottom = torch.cat((points[:,:1,:].double(),torch.ones([d,1,1],dtype = torch.double,device = points.device)),2)
+        side = self.hg2_side(bottom,name,points.device)
+        merged = self.stacked(points.device)
+        idx = self.merged_index(name,side,points.device)
+        states = self.hg1.i24_im_to_state(points,merged["H_T"][idx],heights)[0]
+        return self.hg1.curve_states(states,self.merged_curvature(name,side,points.device),sign = -1)
 
     def state_to_im(self,points,name = None):
-        return self.space_to_im(self.state_to_space(points),name = name)
+        if not (self.hg1.is_i24_state() and self.hg2.is_i24_state()):
+            return self.space_to_im(self.state_to_space(points,name = name),name = name)
+        
+        # use hg1 or hg2 based on y coordinate of the first corner (as in space_to_im)
+        side = (points[:,1] - points[:,5]*points[:,3]/2.0) > 60
+        merged = self.stacked(points.device)
+        idx = self.merged_index(name,side,points.device)
+        points = self.hg1.curve_states(points,self.merged_curvature(name,side,points.device))
+        return self.hg1.i24_state_to_im(points,merged["P"][idx])
     
     def plot_state_boxes(self,im,boxes,name = None, color = (255,255,255),secondary_color = None,labels = None,thickness = 1,jitter_px = 0):
         """
@@ -870,33 +1371,18 @@ class Homography_Wrapper():
         if secondary_color is None:
             secondary_color = color
             
-        # plot objects that are best fit by hg2
-        ind = torch.where(boxes[:,1] > 60)[0] 
-        
-        labels1 = None
-        if labels is not None:
-            labels1 = [labels[i] for i in ind]
-        boxes1 = boxes[ind,:]
-        if len(boxes1) > 0:
-            im_boxes1 = self.state_to_im(boxes1,name = name)
-            jitter = (torch.rand([im_boxes1.shape[0],1,1])*2 -1) * jitter_px
-            im_boxes1 += jitter.expand(im_boxes1.shape[0],8,2)
-            im = self.hg2.plot_boxes(im,im_boxes1,color = secondary_color,labels = labels1,thickness = thickness)
-        
-        # plot objects that are best fit by hg1
-        ind = torch.where(boxes[:,1] < 60)[0]
-        labels2 =  None
-        if labels is not None:
-            labels2 = [labels[i] for i in ind]
-            
-
-        boxes2 = boxes[ind,:]
-        if len(boxes2) > 0:
-            im_boxes2 = self.state_to_im(boxes2,name = name)
-            
-            jitter = (torch.rand([im_boxes2.shape[0],1,1])*2 -1) * jitter_px
-            im_boxes2 += jitter.expand(im_boxes2.shape[0],8,2)
-            im = self.hg1.plot_boxes(im,im_boxes2,color = color,labels = labels2,thickness = thickness)
+        # project all objects at once, then plot those best fit by hg2 and hg1 separately
+        im_boxes = self.state_to_im(boxes,name = name)
+        jitter = (torch.rand([im_boxes.shape[0],1,1])*2 -1) * jitter_px
+        im_boxes = im_boxes + jitter.expand(im_boxes.shape[0],8,2)
+        
+        for ind,hg,box_color in [(torch.where(boxes[:,1] > 60)[0],self.hg2,secondary_color),
+                                 (torch.where(boxes[:,1] < 60)[0],self.hg1,color)]:
+            if len(ind) > 0:
+                sub_labels = None
+                if labels is not None:
+                    sub_labels = [labels[i] for i in ind]
+                im = hg.plot_boxes(im,im_boxes[ind],color = box_color,labels = sub_labels,thickness = thickness)
 
         return im
     
@@ -951,8 +1437,8 @@ if True and __name__ == "__main__":
     
     # test Homography Wrapper
     directory = "/home/worklab/Documents/derek/i24-dataset-gen/DATA/tform5"
-    hg1 = get_homographies(save_file = "EB_homography5.cpkl",directory = directory,direction = "EB",fit_Z = False)
-    hg2 = get_homographies(save_file = "WB_homography5.cpkl",directory = directory,direction = "WB",fit_Z = False)
+    hg1 = get_homographies(save_file = "EB_homography5.npz",directory = directory,direction = "EB",fit_Z = False)
+    hg2 = get_homographies(save_file = "WB_homography5.npz",directory = directory,direction = "WB",fit_Z = False)
     
     hgw = Homography_Wrapper(hg1 = hg1,hg2 = hg2)
     
@@ -849,8 +849,10 @@ class Annotator():
         
         if direction == 1:
             self.hg.hg1.correspondence[self.clicked_camera]["P"][:,2] *= sign*delta
+            self.hg.hg1.changed()
         else:   
             self.hg.hg2.correspondence[self.clicked_camera]["P"][:,2] *= sign*delta
+            self.hg.hg2.changed()
         
     def correct_time_bias(self,box):
         
@@ -20,7 +20,7 @@ import time
 import random
 import argparse
 
-from homography import Homography,Homography_Wrapper
+from homography import Homography,Homography_Wrapper,load_homography
 from datareader import Data_Reader, Camera_Wrapper
 
 from scipy.signal import savgol_filter
@@ -92,10 +92,8 @@ class Annotator():
         
         # get homography
         hid = "" if homography_id == 1 else "2"
-        with open("EB_homography{}.cpkl".format(hid),"rb") as f:
-            hg1 = pickle.load(f) 
-        with open("WB_homography{}.cpkl".format(hid),"rb") as f:
-            hg2 = pickle.load(f) 
+        hg1 = load_homography("EB_homography{}.npz".format(hid))
+        hg2 = load_homography("WB_homography{}.npz".format(hid))
         self.hg  = Homography_Wrapper(hg1=hg1,hg2=hg2)
 
         
@@ -124,6 +122,7 @@ class Annotator():
             self.all_ts = []
             self.poly_params = dict([(camera.name+"_EB",[0,0,0]) for camera in self.cameras]+[(camera.name+"_WB",[0,0,0]) for camera in self.cameras])
             self.curve_points = dict([(camera.name+"_EB",[]) for camera in self.cameras]+[(camera.name+"_WB",[]) for camera in self.cameras])
+        self.set_all_curvature()
         
         # get length of cameras, and ensure data is long enough to hold all entries
         self.max_frames = max([len(camera) for camera in self.cameras])
@@ -327,8 +326,6 @@ class Annotator():
            
            #ts_data = list(filter(lambda x: x["id"] == self.get_unused_id() - 1,ts_data))
 
-           if True:
-                ts_data = [self.offset_box_y(copy.deepcopy(obj),reverse = True) for obj in ts_data]
            ids = [item["id"] for item in ts_data]
            if len(ts_data) > 0:
                boxes = torch.stack([torch.tensor([obj["x"],obj["y"],obj["l"],obj["w"],obj["h"],obj["direction"]]).float() for obj in ts_data])
@@ -354,10 +351,7 @@ class Annotator():
                plot_spline_boxes = []
                # get objects visible in adjacent cameras (2 in each direction)
                ts_data2 = list(self.data[self.frame_idx].values())
-               if True:
-                   ts_data2 = [self.offset_box_y(copy.deepcopy(obj),reverse = True) for obj in ts_data2]
-               else:
-                   ts_data2 = [copy.deepcopy(obj) for obj in ts_data2]
+               ts_data2 = [copy.deepcopy(obj) for obj in ts_data2]
                for obj in ts_data2:
                    id = obj["id"]
                    if id in ids:
@@ -384,8 +378,6 @@ class Annotator():
                # try:
                #     ts_data = list(self.spline_data[self.frame_idx].values())
                #     ts_data = list(filter(lambda x: x["camera"] == camera.name,ts_data))
-               #     if True:
-               #          ts_data = [self.offset_box_y(copy.deepcopy(obj),reverse = True) for obj in ts_data]
                #     if len(ts_data) > 0:
                #         boxes = torch.stack([torch.tensor([obj["x"],obj["y"],obj["l"],obj["w"],obj["h"],obj["direction"]]).float() for obj in ts_data])
                        
@@ -518,11 +510,12 @@ class Annotator():
         self.save2()
 
     
-    def box_to_state(self,point,direction = False):
+    def box_to_state(self,point,direction = False,space = False):
         """
         Input box is a 2D rectangle in image space. Returns the corresponding 
         start and end locations in space
         point - indexable data type with 4 values (start x/y, end x/y)
+        space - if True, return space rather than state coordinates (not corrected for curvature)
         state_point - 2x2 tensor of start and end point in space
         """
         point = point.copy()
@@ -538,6 +531,9 @@ class Annotator():
         point2 = torch.tensor([point[2],point[3]]).unsqueeze(0).unsqueeze(0).repeat(1,8,1)
         point = torch.cat((point1,point2),dim = 0)
         
+        if space:
+            return self.hg.im_to_space(point,name = cam, heights = torch.tensor([0]))[:,0,:2]
+        
         state_point = self.hg.im_to_state(point,name = cam, heights = torch.tensor([0]))
         
         return state_point[:,:2]
@@ -918,10 +914,9 @@ class Annotator():
         
         direction = 1 if self.box_to_state(box)[0,1] < 60 else -1
         
-        if direction == 1:
-            self.hg.hg1.correspondence[self.clicked_camera]["P"][:,2] *= sign*delta
-        else:   
-            self.hg.hg2.correspondence[self.clicked_camera]["P"][:,2] *= sign*delta
+        hg = self.hg.hg1 if direction == 1 else self.hg.hg2
+        hg.correspondence[self.clicked_camera]["P"][:,2] *= sign*delta
+        hg.changed()
         
     def correct_time_bias(self,box):
         
@@ -1802,11 +1797,10 @@ class Annotator():
         
         # get replacement homography
         hid = 5
-        with open("EB_homography{}.cpkl".format(hid),"rb") as f:
-            hg1 = pickle.load(f) 
-        with open("WB_homography{}.cpkl".format(hid),"rb") as f:
-            hg2 = pickle.load(f) 
+        hg1 = load_homography("EB_homography{}.npz".format(hid))
+        hg2 = load_homography("WB_homography{}.npz".format(hid))
         hg_new  = Homography_Wrapper(hg1=hg1,hg2=hg2)    
+        self.set_all_curvature(hg = hg_new)
     
         # # copy height scale values from old homography to new homography
         # for corr in hg_new.hg1.correspondence.keys():
@@ -1902,87 +1896,14 @@ class Annotator():
         self.plot_all_trajectories()
 
             
-    def replace_y(self,reverse  = False):
-            
-        # create new copy of data
-        new_data = []
-        
-        # for each frame in data
-        for f_idx,frame_data in enumerate(self.data):
-            
-            if f_idx > self.last_frame and len(self.data[f_idx]) == 0:
-                break
-            
-            new_data.append({})
-            if f_idx % 100 == 0:
-                print("On frame {}.".format(f_idx))
-            
-            # for each camera in frame data
-            for camera in self.cameras:
-                cam = camera.name
-                
-                # for each box in camera 
-                for obj_idx in range(self.get_unused_id()):
-                   key = "{}_{}".format(cam,obj_idx)
-                   if frame_data.get(key): 
-                       obj = frame_data.get(key)
-                       
-                       # if box was manually drawn
-                       
-                       if "gen" not in obj.keys() or obj["gen"] == "Manual":
-                           
-                           base = copy.deepcopy(obj)
-                           new_box = self.offset_box_y(base,reverse = reverse)
-                           
-                           new_data[f_idx][key] = new_box
-                           
-        # overwrite self.data with new_data
-        self.data = new_data
-        
-        # reinterpolate rest of data
-        for i in range(self.get_unused_id()):
-            self.interpolate(i,verbose = False) 
-            
-
-        
-        self.plot_all_trajectories()
-
-            
-    def offset_box_y(self,box,reverse = False):
-        
-        camera = box["camera"]
-        direction = box["direction"]
-        
-        x = box["x"]
-        
-        
-        direct =  "_EB" if direction == 1 else"_WB"
-        key = camera + direct
-        
-        p2,p1,p0 = self.poly_params[key]
-        
-        y_offset = x**2*p2 + x*p1 + p0
-        
-        # if on the WB side, we need to account for the non-zero location of the leftmost line so we don't shift all the way back to near 0
-        if direction == -1:
-            y_straight_offset = self.hg.hg2.correspondence[camera]["space_pts"][0][1]
-            y_offset -= y_straight_offset
-            
-        if not reverse:
-            box["y"] -= y_offset
-        else:
-            box["y"] += y_offset
-
-        
-        return box
-            
-        
     def fit_curvature(self,box,min_pts = 4):   
         """
         Stores clicked points in array for each camera. If >= min_pts points have been clicked, after each subsequent clicked point the curvature lines are refit
+        and registered with the homography
         """
         
-        point = self.box_to_state(box)[0]
+        # fit in space, since states are already corrected for any existing curvature
+        point = self.box_to_state(box,space = True)[0]
         direction = "_EB" if point[1] < 60 else "_WB"
 
         # store point in curvature_points[cam_idx]
@@ -1995,6 +1916,7 @@ class Annotator():
             pparams = np.polyfit(x_curve,y_curve,2)
             print("Fit {} poly params for camera {}".format(self.clicked_camera,direction))
             self.poly_params[self.clicked_camera+direction] = pparams
+            self.set_curvature(self.clicked_camera,direction)
             
             self.plot()
 
@@ -2003,7 +1925,7 @@ class Annotator():
         """
         Removes all clicked curvature points for selected camera
         """
-        point = self.box_to_state(box)[0]
+        point = self.box_to_state(box,space = True)[0]
         
         direction = "_EB" if point[1] < 60 else "_WB"
         # erase all points
@@ -2011,9 +1933,42 @@ class Annotator():
 
         # reset curvature polynomial coefficients to 0
         self.poly_params[self.clicked_camera+direction] = [0,0,0]
+        self.set_curvature(self.clicked_camera,direction)
         
         self.plot()
     
+    def set_curvature(self,camera,direction,hg = None):
+        """
+        Registers the curvature polynomial poly_params[camera+direction] with the homography 
+        (self.hg by default), which applies it in every state transform. States are 
+        measured relative to the curved roadway
+        """
+        if hg is None:
+            hg = self.hg
+        
+        p2,p1,p0 = self.poly_params[camera+direction]
+        if p2 == 0 and p1 == 0 and p0 == 0:
+            coeffs = None
+        elif direction == "_EB":
+            coeffs = [p2,p1,p0]
+        else:
+            # on the WB side, we need to account for the non-zero location of the leftmost line so we don't shift all the way back to near 0
+            coeffs = [p2,p1,p0 - hg.hg2.correspondence[camera]["space_pts"][0][1]]
+        
+        hg.set_curvature(camera,coeffs,direction = 1 if direction == "_EB" else -1)
+    
+    def set_all_curvature(self,hg = None):
+        """
+        Registers all curvature polynomials with the homography (self.hg by default)
+        """
+        if hg is None:
+            hg = self.hg
+        
+        for camera in self.cameras:
+            if camera.name in hg.hg1.correspondence and camera.name in hg.hg2.correspondence:
+                for direction in ["_EB","_WB"]:
+                    self.set_curvature(camera.name,direction,hg = hg)
+    
     def estimate_ts_bias(self):
         """
         Moving sequentially through the cameras, estimate ts_bias of camera n
@@ -2505,22 +2460,10 @@ class Annotator():
                             if cur_x and prev_x:
                                 
                                 if reverse_curve_offset:
-                                    direction = "EB" if cur_y < 60 else "WB"
-                                    try:
-                                        key = "{}_{}".format(cam,direction)
-                                        p2,p1,p0 = self.poly_params[key]
-                                        cur_y -= p0 +p1*cur_x + p2*cur_x**2
-                                    except:
-                                        pass
-                                        print("Error 1458 search for it")
-
-                                    try:
-                                        key = "{}_{}".format(prev_cam,direction)
-                                        p2,p1,p0 = self.poly_params[key]
-                                        prev_y -= p0 +p1*prev_x + p2*prev_x**2
-                                    except:
-                                        pass
-                                        print("Error 1458 search for it")
+                                    # move both points from road-relative states into space with the curvature model of each camera
+                                    direction = 1 if cur_y < 60 else -1
+                                    cur_x,cur_y = self.hg.state_to_space(torch.tensor([[cur_x,cur_y,0,0,0,direction]]),name = cam)[0,0,:2].tolist()
+                                    prev_x,prev_y = self.hg.state_to_space(torch.tensor([[prev_x,prev_y,0,0,0,direction]]),name = prev_cam)[0,0,:2].tolist()
                                     
                                 x_errors.append(np.abs(cur_x - prev_x))
                                 y_errors.append(np.abs(cur_y - prev_y))
@@ -2550,7 +2493,6 @@ class Annotator():
         y_errors = []
 
         # for each point in each hg transform
-        direction = "EB"
         for corr in self.hg.hg1.correspondence:
             im_pts = self.hg.hg1.correspondence[corr]["corr_pts"]
             space_pts = self.hg.hg1.correspondence[corr]["space_pts"]
@@ -2559,17 +2501,11 @@ class Annotator():
             # convert the pixel coordinate into space
             im_pts = torch.tensor(im_pts).unsqueeze(1).repeat(1,8,1)
             heights = torch.zeros(im_pts.shape[0])
-            im_proj = self.hg.hg1.im_to_space(im_pts,name = corr,heights = heights)[:,0,:]
-            
             # apply curvature correction if necessary
             if use_curvature:
-                try:
-                    key = "{}_{}".format(corr,direction)
-                    p2,p1,p0 = self.poly_params[key]
-                    im_proj[:,1] += im_proj[:,0].pow(2)*p2 + im_proj[:,0]*p1 + p0
-                
-                except:
-                    pass
+                im_proj = self.hg.hg1.im_to_state(im_pts,name = corr,heights = heights)[:,:2]
+            else:
+                im_proj = self.hg.hg1.im_to_space(im_pts,name = corr,heights = heights)[:,0,:]
                 
             # get difference from supposed coordinate        
             space_pts = torch.tensor(space_pts)
@@ -2587,7 +2523,6 @@ class Annotator():
             y_errors += y_diff
             
             
-        direction = "WB"
         for corr in self.hg.hg2.correspondence:
             im_pts = self.hg.hg2.correspondence[corr]["corr_pts"]
             space_pts = self.hg.hg2.correspondence[corr]["space_pts"]
@@ -2596,17 +2531,11 @@ class Annotator():
             # convert the pixel coordinate into space
             im_pts = torch.tensor(im_pts).unsqueeze(1).repeat(1,8,1)
             heights = torch.zeros(im_pts.shape[0])
-            im_proj = self.hg.hg2.im_to_space(im_pts,name = corr,heights = heights).squeeze(1)[:,0,:]
-            
             # apply curvature correction if necessary
             if use_curvature:
-                try:
-                    key = "{}_{}".format(corr,direction)
-                    p2,p1,p0 = self.poly_params[key]
-                    im_proj[:,1] += im_proj[:,0].pow(2)*p2 + im_proj[:,0]*p1 + p0  - space_pts[0][1]
-                
-                except:
-                    pass
+                im_proj = self.hg.hg2.im_to_state(im_pts,name = corr,heights = heights)[:,:2]
+            else:
+                im_proj = self.hg.hg2.im_to_space(im_pts,name = corr,heights = heights).squeeze(1)[:,0,:]
                 
             # get difference from supposed coordinate        
             space_pts = torch.tensor(space_pts)
@@ -2633,7 +2562,6 @@ class Annotator():
         p_errors = []
 
         # for each point in each hg transform
-        direction = "EB"
         for i in range(len(self.hg.hg1.correspondence)):
             for j in range(i+1,len(self.hg.hg1.correspondence)):
                 corr1 = list(self.hg.hg1.correspondence.keys())[i]
@@ -2645,17 +2573,11 @@ class Annotator():
                 # convert the pixel coordinate into space
                 im_pts = torch.tensor(im_pts).unsqueeze(1).repeat(1,8,1)
                 heights = torch.zeros(im_pts.shape[0])
-                im_proj = self.hg.hg1.im_to_space(im_pts,name = corr1,heights = heights)[:,0,:]
-            
                 # apply curvature correction if necessary
                 if use_curvature:
-                    try:
-                        key = "{}_{}".format(corr1,direction)
-                        p2,p1,p0 = self.poly_params[key]
-                        im_proj[:,1] += im_proj[:,0].pow(2)*p2 + im_proj[:,0]*p1 + p0
-                    
-                    except:
-                        pass
+                    im_proj = self.hg.hg1.im_to_state(im_pts,name = corr1,heights = heights)[:,:2]
+                else:
+                    im_proj = self.hg.hg1.im_to_space(im_pts,name = corr1,heights = heights)[:,0,:]
                     
                 # repeat for corr2 
                 im_pts2 = self.hg.hg1.correspondence[corr2]["corr_pts"]
@@ -2664,17 +2586,11 @@ class Annotator():
                 # convert the pixel coordinate into space
                 im_pts2 = torch.tensor(im_pts2).unsqueeze(1).repeat(1,8,1)
                 heights = torch.zeros(im_pts2.shape[0])
-                im_proj2 = self.hg.hg1.im_to_space(im_pts2,name = corr2,heights = heights)[:,0,:]
-            
                 # apply curvature correction if necessary
                 if use_curvature:
-                    try:
-                        key = "{}_{}".format(corr2,direction)
-                        p2,p1,p0 = self.poly_params[key]
-                        im_proj2[:,1] += im_proj2[:,0].pow(2)*p2 + im_proj2[:,0]*p1 + p0
-                    
-                    except:
-                        pass
+                    im_proj2 = self.hg.hg1.im_to_state(im_pts2,name = corr2,heights = heights)[:,:2]
+                else:
+                    im_proj2 = self.hg.hg1.im_to_space(im_pts2,name = corr2,heights = heights)[:,0,:]
               
                 # get difference from supposed coordinate        
                 for i2 in range(len(space_pts)):
@@ -2703,7 +2619,6 @@ class Annotator():
             
             
         # for each point in each hg transform
-        direction = "WB"
         for i in range(len(self.hg.hg2.correspondence)):
             for j in range(i+1,len(self.hg.hg2.correspondence)):
                 corr1 = list(self.hg.hg1.correspondence.keys())[i]
@@ -2715,17 +2630,11 @@ class Annotator():
                 # convert the pixel coordinate into space
                 im_pts = torch.tensor(im_pts).unsqueeze(1).repeat(1,8,1)
                 heights = torch.zeros(im_pts.shape[0])
-                im_proj = self.hg.hg2.im_to_space(im_pts,name = corr1,heights = heights)[:,0,:]
-            
                 # apply curvature correction if necessary
                 if use_curvature:
-                    try:
-                        key = "{}_{}".format(corr1,direction)
-                        p2,p1,p0 = self.poly_params[key]
-                        im_proj[:,1] += im_proj[:,0].pow(2)*p2 + im_proj[:,0]*p1 + p0
-                    
-                    except:
-                        pass
+                    im_proj = self.hg.hg2.im_to_state(im_pts,name = corr1,heights = heights)[:,:2]
+                else:
+                    im_proj = self.hg.hg2.im_to_space(im_pts,name = corr1,heights = heights)[:,0,:]
                     
                 # repeat for corr2 
                 im_pts2 = self.hg.hg2.correspondence[corr2]["corr_pts"]
@@ -2734,17 +2643,11 @@ class Annotator():
                 # convert the pixel coordinate into space
                 im_pts2 = torch.tensor(im_pts2).unsqueeze(1).repeat(1,8,1)
                 heights = torch.zeros(im_pts2.shape[0])
-                im_proj2 = self.hg.hg2.im_to_space(im_pts2,name = corr2,heights = heights)[:,0,:]
-            
                 # apply curvature correction if necessary
                 if use_curvature:
-                    try:
-                        key = "{}_{}".format(corr2,direction)
-                        p2,p1,p0 = self.poly_params[key]
-                        im_proj2[:,1] += im_proj2[:,0].pow(2)*p2 + im_proj2[:,0]*p1 + p0
-                    
-                    except:
-                        pass
+                    im_proj2 = self.hg.hg2.im_to_state(im_pts2,name = corr2,heights = heights)[:,:2]
+                else:
+                    im_proj2 = self.hg.hg2.im_to_space(im_pts2,name = corr2,heights = heights)[:,0,:]
               
                 # get difference from supposed coordinate        
                 for i2 in range(len(space_pts)):
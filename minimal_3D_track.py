@@ -23,6 +23,7 @@ from pytorch_retinanet_detector_directional.retinanet.model import resnet50
 from util_track.mp_loader import FrameLoader
 from util_track.kf import Torch_KF
 from util_track.mp_writer import OutputWriter
+from util_track.metadata import TrackMetadata
 from homography import Homography, load_i24_csv
 from mot_evaluator import MOT_Evaluator
 
@@ -104,11 +105,10 @@ class KIOU_Tracker():
         self.n_frames = len(self.loader)
     
         self.next_obj_id = 0             # next id for a new object (incremented during tracking)
-        self.fsld = {}                   # fsld[id] stores frames since last detected for object id
+        n_classes = max([key for key in class_dict.keys() if isinstance(key,int)]) + 1
+        self.meta = TrackMetadata(n_classes = n_classes)  # stores fsld, class evidence and confidences for each object
     
         self.all_tracks = {}             # stores states for each object
-        self.all_classes = {}            # stores class evidence for each object
-        self.all_confs = {}
     
         self.class_dict = class_dict
     
@@ -138,31 +138,17 @@ class KIOU_Tracker():
         to any detection
         """
         start = time.time()
+        matchings = torch.from_numpy(np.array(matchings,dtype = np.int64).reshape(-1,2))
 
         # 1. Update tracked and matched objects
-        update_array = np.zeros([len(matchings),5])
-        update_ids = []
-        update_classes = []
-        update_confs = []
-        
-        for i in range(len(matchings)):
-            a = matchings[i,0] # index of pre_loc
-            b = matchings[i,1] # index of detections
-           
-            update_array[i,:] = detections[b,:5]
-            update_ids.append(pre_ids[a])
-            update_classes.append(labels[b])
-            update_confs.append(scores[b])
-            
-            self.fsld[pre_ids[a]] = 0 # fsld = 0 since this id was detected this frame
-        
-        if len(update_array) > 0:    
+        update_ids = [pre_ids[a] for a in matchings[:,0].tolist()]
+        if len(update_ids) > 0:    
+            b = matchings[:,1] # index of detections
+            update_array = detections[b,:5].double().numpy()
             self.filter.update(update_array,update_ids)
             
-            # store class and confidence (used to parse good objects)
-            for i in range(len(update_ids)):
-                self.all_classes[update_ids[i]][int(update_classes[i])] += 1
-                self.all_confs[update_ids[i]].append(update_confs[i])
+            # store class and confidence (used to parse good objects), fsld = 0 since these ids were detected this frame
+            self.meta.update(update_ids,labels[b],scores[b])
                 
             self.time_metrics['update'] += time.time() - start
               
@@ -170,56 +156,46 @@ class KIOU_Tracker():
         # 2. For each detection not in matchings, add a new object
         start = time.time()
         
-        new_array = np.zeros([len(detections) - len(matchings),5])
-        new_directions = np.zeros([len(detections) - len(matchings)])
-        new_ids = []
-        new_classes = []
-        cur_row = 0
-        for i in range(len(detections)):
-            if len(matchings) == 0 or i not in matchings[:,1]:
-                
-                new_ids.append(self.next_obj_id)
-                new_array[cur_row,:] = detections[i,:5]
-                new_directions[cur_row] = detections[i,5]
-
-                self.fsld[self.next_obj_id] = 0
-                self.all_tracks[self.next_obj_id] = np.zeros([self.n_frames,self.state_size])
-                self.all_classes[self.next_obj_id] = np.zeros(8)
-                self.all_confs[self.next_obj_id] = []
-                
-                cls = int(labels[i])
-                self.all_classes[self.next_obj_id][cls] += 1
-                self.all_confs[self.next_obj_id].append(scores[i])
-                new_classes.append(self.class_dict[cls])                    
-                
-                self.next_obj_id += 1
-                cur_row += 1
-        if len(new_array) > 0:     
+        unmatched = torch.ones(len(detections),dtype = torch.bool)
+        unmatched[matchings[:,1]] = False
+        new_idxs = torch.nonzero(unmatched).view(-1)
+        
+        if len(new_idxs) > 0:     
+            new_array = detections[new_idxs,:5].double().numpy()
+            new_directions = detections[new_idxs,5].double().numpy()
+            new_ids = list(range(self.next_obj_id,self.next_obj_id + len(new_idxs)))
+            self.next_obj_id += len(new_idxs)
+            
+            self.meta.add(new_ids,labels[new_idxs],scores[new_idxs])
+            for id in new_ids:
+                self.all_tracks[id] = np.zeros([self.n_frames,self.state_size])
+            
             times = np.ones(len(new_directions)) * self.frame_num / 30.0
             if mean_object_sizes:
+                new_classes = [self.class_dict[int(cls)] for cls in labels[new_idxs].tolist()]
                 self.filter.add(new_array,new_ids,new_directions,times,init_speed = True,classes = new_classes)
             else:
                 self.filter.add(new_array,new_ids,new_directions,times,init_speed = True)
         
         # 3. For each untracked object, increment fsld        
-        for i in range(len(pre_ids)):
-            try:
-                if i not in matchings[:,0]:
-                    self.fsld[pre_ids[i]] += 1
-            except:
-                self.fsld[pre_ids[i]] += 1
-        
+        undetected = torch.ones(len(pre_ids),dtype = torch.bool)
+        undetected[matchings[:,0]] = False
+        undetected = [pre_ids[i] for i in torch.nonzero(undetected).view(-1).tolist()]
+        self.meta.missed(undetected)
         
         # 4. Remove lost objects
-        removals = []
-        for id in pre_ids:
-            if self.fsld[id] >= self.fsld_max and len(self.all_classes[id] < self.fsld_max + 2):  # after a burn-in period, objects are no longer removed unless they leave frame
-                removals.append(id)
-                self.fsld.pop(id,None) # remove key from fsld
-        if len(removals) > 0:
-            self.filter.remove(removals)    
+        removals = self.meta.lost(undetected,self.fsld_max)
+        self.remove(removals)
     
         self.time_metrics['add and remove'] += time.time() - start
+    
+    def remove(self,ids):
+        """
+        Removes objects from the filter and metadata store
+        """
+        if len(ids) > 0:
+            self.filter.remove(ids)
+            self.meta.remove(ids)
         
     
     
@@ -246,19 +222,20 @@ class KIOU_Tracker():
             boxes_new[:,1] = torch.min(boxes[:,0:4,1],dim = 1)[0]
             boxes_new[:,3] = torch.max(boxes[:,0:4,1],dim = 1)[0]
             
+            n_detections = self.meta.n_detections(ids)
             for i in range(len(ids)):
                 for j in range(len(ids)):
                     if i != j:
                         iou_metric = self.iou(boxes_new[i],boxes_new[j])
                         if iou_metric > self.iou_cutoff:
                             # determine which object has been around longer
-                            if len(self.all_classes[i]) > len(self.all_classes[j]):
+                            if n_detections[i] > n_detections[j]:
                                 removals.append(ids[j])
                             else:
                                 removals.append(ids[i])
             if len(removals) > 0:
                 removals = list(set(removals))
-                self.filter.remove(removals)
+                self.remove(removals)
                 #print("Removed overlapping object")
    
     def remove_anomalies(self,max_sizes = [75,16,20]):
@@ -287,7 +264,7 @@ class KIOU_Tracker():
                 removals.append(keys[i])
                 
         removals = list(set(removals))
-        self.filter.remove(removals)         
+        self.remove(removals)         
     
     
     # TODO - rewrite for new state formulation
@@ -340,10 +317,9 @@ class KIOU_Tracker():
             Detections output by either localizer or detector (xysr form)
         post_locations : tensor [m,4] 
             Estimated object locations after update step (xysr form)
-        all_classes : dict
-            indexed by object id, where each entry is a list of the predicted class (int)
-            for that object at every frame in which is was detected. The most common
-            class is assumed to be the correct class        
+        all_classes : TrackMetadata
+            class evidence for each object id. The most common class is assumed
+            to be the correct class        
         class_dict : dict
             indexed by class int, the string class names for each class
         frame : int, optional
@@ -369,7 +345,7 @@ class KIOU_Tracker():
             ids.append(id)
             boxes.append(post_locations[id][0:6])
             speeds.append(((np.abs(post_locations[id][6]) * 3600/5280 * 10).round())/10) # in mph
-            classes.append(np.argmax(self.all_classes[id]))            
+            classes.append(int(all_classes.best_class([id])[0]))            
             directions.append("WB" if post_locations[id][5] == -1 else "EB")
             dims.append((post_locations[id][2:5]*10).round(0)/10)
             
@@ -630,7 +606,7 @@ class KIOU_Tracker():
         
         # get classes for each object
         ids,_ = self.filter.objs()
-        classes = [np.argmax(self.all_classes[id]) for id in ids]
+        classes = self.meta.best_class(ids).tolist()
         
         # get expected dimensions for each object
         if len(classes) > 0:
@@ -732,7 +708,7 @@ class KIOU_Tracker():
             # Plot
             start = time.time()
             if self.PLOT:
-                self.plot(original_im,detections,post_locations,self.all_classes,frame = frame_num,pre_locations = pre_loc,label_len = 5)
+                self.plot(original_im,detections,post_locations,self.meta,frame = frame_num,pre_locations = pre_loc,label_len = 5)
             self.time_metrics['plot'] += time.time() - start
        
             # load next frame  
@@ -841,6 +817,11 @@ class KIOU_Tracker():
             out.writerow(data_header)
             print("\n")
             
+            # number of detections and class of each object, used to remove short anomalous tracks
+            track_ids = list(self.all_tracks.keys())
+            n_detections = self.meta.n_detections(track_ids)
+            best_classes = self.meta.best_class(track_ids)
+            
             for frame in range(self.n_frames):
                 if frame > self.cutoff_frame:
                     break
@@ -859,8 +840,8 @@ class KIOU_Tracker():
                 #     gen = "Filter prediction"
                 gen = "3D Detector"
                 
-                for id in self.all_tracks:
-                    if len(self.all_classes[id]) > self.fsld_max + 2: # remove short anomalous tracks
+                for id,n_dets,cls in zip(track_ids,n_detections,best_classes):
+                    if n_dets > self.fsld_max + 2: # remove short anomalous tracks
                         
                         state = self.all_tracks[id][frame]
                         state = torch.from_numpy(state).float()
@@ -888,7 +869,7 @@ class KIOU_Tracker():
                             obj_line.append(frame)
                             obj_line.append(timestamp)
                             obj_line.append(id)
-                            obj_line.append(self.class_dict[np.argmax(self.all_classes[id])])
+                            obj_line.append(self.class_dict[int(cls)])
                             obj_line.append(minx)
                             obj_line.append(miny)
                             obj_line.append(maxx)
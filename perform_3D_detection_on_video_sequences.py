@@ -6,6 +6,9 @@ import random
 import cv2
 import time
 import csv
+import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 random.seed(0)
 import torch
@@ -21,7 +24,8 @@ detector_path = os.path.join(os.getcwd(),"pytorch_retinanet_detector_directional
 sys.path.insert(0,detector_path)
 from pytorch_retinanet_detector_directional.retinanet.model import resnet50 
 
-from timestamp_utilities import parse_frame_timestamp,get_precomputed_checksums,get_timestamp_geometry
+from timestamp_utilities import parse_frame_timestamp,parse_frame_timestamps,get_precomputed_checksums,get_timestamp_geometry,get_checksum_table,TimestampIndex
+from util_track.preprocess import FramePreprocessor
 
 
 
@@ -33,10 +37,17 @@ def detect_video_sequence(sequence,retinanet,frame_cutoff = 1800,SHOW = True):
     
     checksum_path="/home/worklab/Documents/derek/I24-video-processing/I24-video-ingest/resources/timestamp_pixel_checksum_6.pkl"
     geom_path="/home/worklab/Documents/derek/I24-video-processing/I24-video-ingest/resources/timestamp_geometry_4K.pkl"
-    checksums = get_precomputed_checksums(checksum_path)
+    checksums = get_checksum_table(get_precomputed_checksums(checksum_path))
     geom = get_timestamp_geometry(geom_path)
     
-    data_list = []
+    # use cached timestamps if available, otherwise cache them once the whole video has been parsed
+    ts_parser = TimestampIndex.parser_signature(geom,checksums)
+    ts_index = TimestampIndex.load(sequence,ts_parser)
+    parsed = []
+    
+    preprocessor = FramePreprocessor(device,size = (1920,1080),to_rgb = True)
+    
+    writer = DetectionCSVWriter(sequence)
     det_time = 0
 
     # each loop performs detection on one frame
@@ -44,36 +55,29 @@ def detect_video_sequence(sequence,retinanet,frame_cutoff = 1800,SHOW = True):
         
         ret,frame = cap.read()
         if not ret:
+            if ts_index is None:
+                TimestampIndex.write(sequence,parsed,ts_parser)
             break
         
-        timestamp = parse_frame_timestamp(frame_pixels = frame, timestamp_geometry = geom, precomputed_checksums = checksums)[0]
+        if ts_index is not None:
+            timestamp = ts_index[frame_idx] if frame_idx < len(ts_index) else None
+        else:
+            timestamp = parse_frame_timestamp(frame_pixels = frame, timestamp_geometry = geom, precomputed_checksums = checksums)[0]
+            parsed.append(timestamp)
 
         
-        frame = cv2.resize(frame,(1920,1080))
-        frame = cv2.cvtColor(frame,cv2.COLOR_BGR2RGB)
-
-        frame = F.to_tensor(frame)
-        #frame = frame.permute((2,0,1))
-        
-        frame = F.normalize(frame,mean=[0.485, 0.456, 0.406],
-                             std=[0.229, 0.224, 0.225])
-
-        im = frame.to(device).unsqueeze(0).float()
+        # upload raw frame, then convert to RGB, resize and normalize on device
+        im = preprocessor(frame)
         
         start = time.time()
         with torch.no_grad():
             scores,labels,boxes = retinanet(im)
        
         # decide which boxes to keep, probably with NMS
-        if len(boxes) > 0:
-            keep = []    
-            for i in range(len(scores)):
-                if scores[i] > 0.3:
-                    keep.append(i)
-                    
-            boxes = boxes[keep,:]
-            scores = scores[keep]
-            labels = labels[keep]
+        keep = scores > 0.3
+        boxes = boxes[keep]
+        scores = scores[keep]
+        labels = labels[keep]
         
         output = nms(boxes[:,16:20],scores,0.5)
         boxes = boxes[output]
@@ -124,47 +128,172 @@ def detect_video_sequence(sequence,retinanet,frame_cutoff = 1800,SHOW = True):
         print("\rDetected frame {} of {} for sequence {} ({} fps)".format(frame_idx,frame_cutoff,sequence.split("/")[-1],np.round(frame_idx/det_time,1)), end = '\r', flush = True)
 
         
-        # for each box, append one datum to data list    
+        # write detections for this frame
         boxes = boxes.data.cpu().numpy()
         scores = scores.data.cpu().numpy()
         labels = labels.data.cpu().numpy()
-        
-        for j in range(len(boxes)):
-            data_list.append([frame_idx,timestamp,sequence,boxes[j],scores[j],labels[j]])
+        writer.write(frame_idx,timestamp,boxes,scores,labels)
         
     cv2.destroyAllWindows()
     cap.release()
     
     fps = frame_cutoff/ det_time
 
-    write_detections_csv(data_list,sequence,fps)
+    writer.close(fps)
+
+def detect_video_sequence_batched(sequence,retinanet,frame_cutoff = 1800,batch_size = 8):
+    """
+    Offline version of detect_video_sequence. The next batch of frames is decoded 
+    (and timestamps parsed) in a background thread while the detector runs on the 
+    current [B,3,H,W] batch. The MULTI_FRAME detector output is already NMS-ed per 
+    frame, so only a vectorized score filter remains, and results are written 
+    incrementally
+    
+    sequence - path to video sequence
+    retinanet - detector
+    frame_cutoff - max number of frames to process
+    batch_size - number of frames per detector call
+    """
+    retinanet.training = False
+    retinanet.eval()
+    cap = cv2.VideoCapture(sequence)
+    
+    checksum_path="/home/worklab/Documents/derek/I24-video-processing/I24-video-ingest/resources/timestamp_pixel_checksum_6.pkl"
+    geom_path="/home/worklab/Documents/derek/I24-video-processing/I24-video-ingest/resources/timestamp_geometry_4K.pkl"
+    checksums = get_checksum_table(get_precomputed_checksums(checksum_path))
+    geom = get_timestamp_geometry(geom_path)
+    
+    # use cached timestamps if available, otherwise cache them once the whole video has been parsed
+    ts_parser = TimestampIndex.parser_signature(geom,checksums)
+    ts_index = TimestampIndex.load(sequence,ts_parser)
+    parsed = []
+    
+    preprocessor = FramePreprocessor(device,size = (1920,1080),to_rgb = True)
+    writer = DetectionCSVWriter(sequence)
+    
+    def read_batch(start_idx):
+        frames = []
+        at_end = False
+        while len(frames) < batch_size and start_idx + len(frames) < frame_cutoff:
+            ret,frame = cap.read()
+            if not ret:
+                at_end = True
+                break
+            frames.append(frame)
+        
+        if ts_index is not None:
+            timestamps = [ts_index[i] if i < len(ts_index) else None for i in range(start_idx,start_idx + len(frames))]
+        else:
+            timestamps = parse_frame_timestamps(geom,checksums,frames = frames)[0] if len(frames) > 0 else []
+            parsed.extend(timestamps)
+            if at_end:
+                TimestampIndex.write(sequence,parsed,ts_parser)
+        return frames,timestamps
+    
+    pool = ThreadPoolExecutor(max_workers = 1)
+    frame_idx = 0
+    det_time = 0
+    next_batch = pool.submit(read_batch,frame_idx)
+    
+    while True:
+        frames,timestamps = next_batch.result()
+        if len(frames) == 0:
+            break
+        next_batch = pool.submit(read_batch,frame_idx + len(frames))
+        
+        start = time.time()
+        ims = preprocessor(frames)
+        with torch.no_grad():
+            scores,labels,boxes,im_idxs = retinanet(ims,MULTI_FRAME = True)
+        
+        keep = scores > 0.3
+        scores = scores[keep].cpu().numpy()
+        labels = labels[keep].cpu().numpy()
+        boxes = boxes[keep].cpu().numpy()
+        im_idxs = im_idxs[keep].cpu().numpy()
+        det_time += time.time() - start
+        
+        # outputs are grouped by frame for writing
+        order = np.argsort(im_idxs,kind = "stable")
+        splits = np.searchsorted(im_idxs[order],np.arange(1,len(frames)))
+        for b,frame_order in enumerate(np.split(order,splits)):
+            writer.write(frame_idx + b,timestamps[b],boxes[frame_order],scores[frame_order],labels[frame_order])
+        
+        frame_idx += len(frames)
+        print("\rDetected frame {} of {} for sequence {} ({} fps)".format(frame_idx,frame_cutoff,sequence.split("/")[-1],np.round(frame_idx/det_time,1)), end = '\r', flush = True)
+    
+    pool.shutdown()
+    cap.release()
+    
+    fps = frame_idx / det_time
+    writer.close(fps)
 
-def write_detections_csv(data_list,sequence,fps):
+class DetectionCSVWriter():
+    """
+    Writes 3D detections for one sequence to .csv incrementally. Detection rows are
+    streamed to a temporary file as they are produced, and the summary headers (which
+    depend on the first and last timestamps and on fps) are prepended on close()
+    """
+    
+    classes = { "sedan":0,
+                "midsize":1,
+                "van":2,
+                "pickup":3,
+                "semi":4,
+                "truck (other)":5,
+                "truck": 5,
+                "motorcycle":6,
+                "trailer":7,
+                0:"sedan",
+                1:"midsize",
+                2:"van",
+                3:"pickup",
+                4:"semi",
+                5:"truck (other)",
+                6:"motorcycle",
+                7:"trailer",
+                }
+    
+    # box columns in output order - 2D bbox, then 3D box (fbr,fbl,bbr,bbl,ftr,ftl,btr,btl)
+    box_columns = [16,17,18,19,2,3,0,1,6,7,4,5,10,11,8,9,14,15,12,13]
+    
+    def __init__(self,sequence):
+        self.sequence = sequence
+        self.outfile = "_outputs/" + sequence.split("/")[-1].split(".")[0] + "_3D_detections.csv"
+        self.tmpfile = self.outfile + ".tmp"
+        
+        self.f = open(self.tmpfile, mode = 'w', newline = '')
+        self.out = csv.writer(self.f, delimiter=',')
+        self.first_ts = None
+        self.last_ts = None
+        self.n_rows = 0
+        
+    def write(self,frame_idx,timestamp,boxes,scores,labels):
         """
-        Call after tracking to summarize results in .csv file
+        frame_idx - int
+        timestamp - float or None
+        boxes - [d,20] np.array of 3D and 2D box coordinates
+        scores - [d] np.array of confidences
+        labels - [d] np.array of class indices
         """
+        if len(boxes) == 0:
+            return
+        if self.n_rows == 0:
+            self.first_ts = timestamp
+        self.last_ts = timestamp
+        self.n_rows += len(boxes)
         
-        classes = { "sedan":0,
-                    "midsize":1,
-                    "van":2,
-                    "pickup":3,
-                    "semi":4,
-                    "truck (other)":5,
-                    "truck": 5,
-                    "motorcycle":6,
-                    "trailer":7,
-                    0:"sedan",
-                    1:"midsize",
-                    2:"van",
-                    3:"pickup",
-                    4:"semi",
-                    5:"truck (other)",
-                    6:"motorcycle",
-                    7:"trailer",
-                    }
+        # convert all values to strings at once
+        boxes = boxes[:,self.box_columns].astype(str)
+        scores = scores.astype(str)
+        labels = [self.classes[int(label)] for label in labels]
         
-        outfile = "_outputs/" + sequence.split("/")[-1].split(".")[0] + "_3D_detections.csv"
-
+        rows = [[frame_idx,timestamp,scores[j],labels[j]] + list(boxes[j,:4]) + ["---","---","3D Detector","---","---"] + list(boxes[j,4:]) 
+                for j in range(len(boxes))]
+        self.out.writerows(rows)
+    
+    def close(self,fps):
+        self.f.close()
         
         # create summary headers
         summary_header = [
@@ -179,20 +308,17 @@ def write_detections_csv(data_list,sequence,fps):
         
         # create summary data
         summary = []
-        summary.append(sequence)
+        summary.append(self.sequence)
         summary.append("---")
         summary.append("---")    
-        summary.append(data_list[0][1])
-        summary.append(data_list[-1][1])
+        summary.append(self.first_ts)
+        summary.append(self.last_ts)
         summary.append("---")
         summary.append("---") 
         
-        
-        
         # create time header and data
         time_header = ["Processing fps"]
         time_data = [fps]
-                
         
         # create parameter header and data
         parameter_header = [
@@ -203,8 +329,6 @@ def write_detections_csv(data_list,sequence,fps):
         parameter_data = []
         parameter_data.append(0.3)
         parameter_data.append(0.5)
-
-        
         
         # create main data header
         data_header = [
@@ -240,10 +364,7 @@ def write_detections_csv(data_list,sequence,fps):
             "btly"
             ]
         
-        
-        
-        
-        with open(outfile, mode='w') as f:
+        with open(self.outfile, mode='w', newline = '') as f:
             out = csv.writer(f, delimiter=',')
             
             # write first chunk
@@ -263,53 +384,20 @@ def write_detections_csv(data_list,sequence,fps):
             
             # write main chunk
             out.writerow(data_header)
-            
-            for item in data_list:
-                [frame_idx,timestamp,_,bbox,conf,class_idx] = item
-                        
-                obj_line = []
-                obj_line.append(frame_idx)
-                obj_line.append(timestamp)
-                obj_line.append(conf)
-                obj_line.append(classes[class_idx.item()])
-                obj_line.append(bbox[16])
-                obj_line.append(bbox[17])
-                obj_line.append(bbox[18])
-                obj_line.append(bbox[19])
-                obj_line.append("---")
-                obj_line.append("---")
-                obj_line.append("3D Detector")
-                obj_line.append("---")
-                obj_line.append("---")
-                
-                # 3D box
-                obj_line.append(bbox[2])
-                obj_line.append(bbox[3])
-                obj_line.append(bbox[0])
-                obj_line.append(bbox[1])
-                
-                obj_line.append(bbox[6])
-                obj_line.append(bbox[7])
-                obj_line.append(bbox[4])
-                obj_line.append(bbox[5])
-
-                obj_line.append(bbox[10])
-                obj_line.append(bbox[11])
-                obj_line.append(bbox[8])
-                obj_line.append(bbox[9])
-                
-                obj_line.append(bbox[14])
-                obj_line.append(bbox[15])
-                obj_line.append(bbox[12])
-                obj_line.append(bbox[13])
-                
-                out.writerow(obj_line)
-                print("\rWriting results for frame {} for sequence {} ".format(frame_idx,sequence.split("/")[-1]), end = '\r', flush = True)
+            with open(self.tmpfile, mode='r', newline = '') as rows:
+                shutil.copyfileobj(rows,f)
         
+        os.remove(self.tmpfile)
 
 
 if __name__ == "__main__":
     
+    # -batch_size > 1 runs the offline batched mode (no plotting)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-batch_size', type = int, default = 1)
+    args = parser.parse_args()
+    batch_size = args.batch_size
+    
     checkpoint_file = "cpu_directional_v3_e15.pt"
     retinanet = resnet50(num_classes=8, pretrained=True)
 
@@ -342,5 +430,8 @@ if __name__ == "__main__":
     
     
     for sequence in file_list:
-        detect_video_sequence(sequence,retinanet,frame_cutoff = 1800,SHOW = True)
+        if batch_size > 1:
+            detect_video_sequence_batched(sequence,retinanet,frame_cutoff = 1800,batch_size = batch_size)
+        else:
+            detect_video_sequence(sequence,retinanet,frame_cutoff = 1800,SHOW = True)
         
\ No newline at end of file
@@ -1,10 +1,11 @@
 import numpy as np
 import torch
 import torch.nn as nn
+from collections import OrderedDict
 
 
 class Anchors(nn.Module):
-    def __init__(self, pyramid_levels=None, strides=None, sizes=None, ratios=None, scales=None):
+    def __init__(self, pyramid_levels=None, strides=None, sizes=None, ratios=None, scales=None, cache_size=8):
         super(Anchors, self).__init__()
 
         if pyramid_levels is None:
@@ -18,8 +19,17 @@ class Anchors(nn.Module):
         if scales is None:
             self.scales = np.array([2 ** 0, 2 ** (1.0 / 3.0), 2 ** (2.0 / 3.0)])
 
+        # anchors depend only on image size, so they are memoized per (H,W,device) in a small LRU
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
     def forward(self, image):
         
+        key = (image.shape[2], image.shape[3], image.device)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        
         image_shape = image.shape[2:]
         image_shape = np.array(image_shape)
         image_shapes = [(image_shape + 2 ** x - 1) // (2 ** x) for x in self.pyramid_levels]
@@ -33,11 +43,12 @@ class Anchors(nn.Module):
             all_anchors     = np.append(all_anchors, shifted_anchors, axis=0)
 
         all_anchors = np.expand_dims(all_anchors, axis=0)
+        all_anchors = torch.from_numpy(all_anchors.astype(np.float32)).to(image.device)
 
-        if torch.cuda.is_available():
-            return torch.from_numpy(all_anchors.astype(np.float32)).cuda()
-        else:
-            return torch.from_numpy(all_anchors.astype(np.float32))
+        self.cache[key] = all_anchors
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return all_anchors
 
 def generate_anchors(base_size=128, ratios=None, scales=None):
     """
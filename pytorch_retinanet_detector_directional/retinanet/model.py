@@ -310,28 +310,25 @@ class ResNet(nn.Module):
         
         elif MULTI_FRAME:
             transformed_anchors = self.regressBoxes(anchors, regression)
-
-            imIndexes = torch.tensor([i for i in range(len(transformed_anchors))]).unsqueeze(1).repeat(1,transformed_anchors.shape[1])
-            
-            # flatten transformed anchors and classifications and imIndexes
-            imIndexes = imIndexes.reshape(-1)
-            transformed_anchors = transformed_anchors.reshape(1,-1,transformed_anchors.shape[2]).squeeze()
-            classification = classification.reshape(1,-1,classification.shape[2]).squeeze()
-            scores,classes = torch.max(classification,dim = 1)
+            scores,classes = torch.max(classification,dim = 2)
             
+            # select at most keep candidates in a single pass, split evenly across images
             keep = 10000
-            keep_count = 1000000
-            threshold = 1e-7
-            while keep_count > keep: 
-                scores_over_thresh = (scores > threshold)
-                keep_count = scores_over_thresh.sum()
-                threshold *= (10**.2)
+            batch_size = scores.shape[0]
+            k = min(math.ceil(keep/batch_size),scores.shape[1])
+            scores,top_idxs = torch.topk(scores,k,dim = 1)
+            classes = torch.gather(classes,1,top_idxs)
+            anchorBoxes = torch.gather(transformed_anchors,1,top_idxs.unsqueeze(2).expand(-1,-1,transformed_anchors.shape[2]))
+            classification = torch.gather(classification,1,top_idxs.unsqueeze(2).expand(-1,-1,classification.shape[2]))
+            imIndexes = torch.arange(batch_size,device = scores.device).unsqueeze(1).expand(-1,k)
             
-            scores = scores[scores_over_thresh]
-            classes = classes[scores_over_thresh]
-            anchorBoxes = transformed_anchors[scores_over_thresh]
-            classification = classification[scores_over_thresh]
-            imIndexes = imIndexes[scores_over_thresh]
+            # flatten candidates, discarding negligible scores
+            scores_over_thresh = (scores > 1e-7).reshape(-1)
+            scores = scores.reshape(-1)[scores_over_thresh]
+            classes = classes.reshape(-1)[scores_over_thresh]
+            anchorBoxes = anchorBoxes.reshape(-1,anchorBoxes.shape[2])[scores_over_thresh]
+            classification = classification.reshape(-1,classification.shape[2])[scores_over_thresh]
+            imIndexes = imIndexes.reshape(-1)[scores_over_thresh]
             
             anchors_nms_idx = batched_nms(anchorBoxes[:,16:20], scores, imIndexes,0.5) # change back to 0.5
             
@@ -347,52 +344,32 @@ class ResNet(nn.Module):
             transformed_anchors = self.regressBoxes(anchors, regression)
             #transformed_anchors = self.clipBoxes(transformed_anchors, img_batch)
 
-            # finalResult = [[], [], []]
-
-            finalScores = torch.Tensor([])
-            finalAnchorBoxesIndexes = torch.Tensor([]).long()
-            finalAnchorBoxesCoordinates = torch.Tensor([])
-            finalImIndexes = torch.Tensor([]).long()
-            
-            if torch.cuda.is_available():
-                finalScores = finalScores.cuda()
-                finalAnchorBoxesIndexes = finalAnchorBoxesIndexes.cuda()
-                finalAnchorBoxesCoordinates = finalAnchorBoxesCoordinates.cuda()
-
             if LOCALIZE:
                 return transformed_anchors, classification
 
-            for i in range(classification.shape[2]):
-                scores = torch.squeeze(classification[:, :, i])
-                
-                keep = 10000
-                keep_count = 1000000
-                threshold = 1e-25
-                while keep_count > keep: 
-                    scores_over_thresh = (scores > threshold)
-                    keep_count = scores_over_thresh.sum()
-                    threshold *= (10**.2)
-                
-                if scores_over_thresh.sum() == 0:
-                    # no boxes to NMS, just continue
-                    continue
-
-                scores = scores[scores_over_thresh]
-                anchorBoxes = torch.squeeze(transformed_anchors)
-                anchorBoxes = anchorBoxes[scores_over_thresh]
-                anchors_nms_idx = nms(anchorBoxes[:,16:20], scores, 0.5) # change back to 0.5
-
-                # finalResult[0].extend(scores[anchors_nms_idx])
-                # finalResult[1].extend(torch.tensor([i] * anchors_nms_idx.shape[0]))
-                # finalResult[2].extend(anchorBoxes[anchors_nms_idx])
-
-                finalScores = torch.cat((finalScores, scores[anchors_nms_idx]))
-                finalAnchorBoxesIndexesValue = torch.tensor([i] * anchors_nms_idx.shape[0])
-                if torch.cuda.is_available():
-                    finalAnchorBoxesIndexesValue = finalAnchorBoxesIndexesValue.cuda()
-
-                finalAnchorBoxesIndexes = torch.cat((finalAnchorBoxesIndexes, finalAnchorBoxesIndexesValue))
-                finalAnchorBoxesCoordinates = torch.cat((finalAnchorBoxesCoordinates, anchorBoxes[anchors_nms_idx]))
+            # candidates from all images are decoded together, as one set
+            anchorBoxes = transformed_anchors.reshape(-1,transformed_anchors.shape[2])
+            scores = classification.reshape(-1,classification.shape[2])
+            
+            # keep at most keep candidates per class, selected for all classes in a single pass
+            keep = 10000
+            k = min(keep,scores.shape[0])
+            scores,anchor_idxs = torch.topk(scores,k,dim = 0)
+            classes = torch.arange(scores.shape[1],device = scores.device).unsqueeze(0).expand(k,-1)
+            
+            scores_over_thresh = (scores > 1e-25)
+            scores = scores[scores_over_thresh]
+            classes = classes[scores_over_thresh]
+            anchorBoxes = anchorBoxes[anchor_idxs[scores_over_thresh]]
+            
+            # one NMS pass for all classes, then order outputs by class (and by score within each class)
+            anchors_nms_idx = batched_nms(anchorBoxes[:,16:20], scores, classes, 0.5) # change back to 0.5
+            _,class_order = torch.sort(classes[anchors_nms_idx],stable = True)
+            anchors_nms_idx = anchors_nms_idx[class_order]
+            
+            finalScores = scores[anchors_nms_idx]
+            finalAnchorBoxesIndexes = classes[anchors_nms_idx]
+            finalAnchorBoxesCoordinates = anchorBoxes[anchors_nms_idx]
 
             return [finalScores, finalAnchorBoxesIndexes, finalAnchorBoxesCoordinates]
 
@@ -3,6 +3,9 @@ import re
 import pickle
 import cv2
 import ast
+import json
+import hashlib
+import numpy as np
 from numpy import array
 #from parameters import *
     
@@ -43,32 +46,106 @@ def get_timestamp_pixel_limits():
     return y0, y0+h, x0, x0+(n*w)
 
 
+def get_checksum_table(precomputed_checksums):
+    """
+    Converts a dictionary of digit:checksum pairs into arrays for vectorized lookup.
+    :param precomputed_checksums: dictionary of digit:checksum pairs (load using utilities.get_precomputed_checksums())
+    :return: tuple of (array of digits [k], array of checksums [k,3,2])
+    """
+    digits = array(list(precomputed_checksums.keys()))
+    table = np.stack([np.asarray(cs_ref, dtype=np.int64) for cs_ref in precomputed_checksums.values()])
+    return digits, table
+
+
+def parse_frame_timestamps(timestamp_geometry, precomputed_checksums, frames=None, timestamp_pixels=None):
+    """
+    Vectorized version of parse_frame_timestamp for a stack of frames. The binary masks of all digits of all frames
+        are reduced to [n_frames, n_digits, 3, 2] block sums in one call, and all block sums are compared against the
+        checksum table at once.
+    :param timestamp_geometry: dictionary of parameters used for determining area of each digit in checksum
+        (load using utilities.get_timestamp_geometry)
+    :param precomputed_checksums: checksum table (from get_checksum_table()) or dictionary of digit:checksum pairs
+    :param frames: numpy array (or list of arrays) of full (4K) color video frames; dimensions should be Nx2160x3840x3
+    :param timestamp_pixels: numpy array of timestamp areas, defined by `get_timestamp_pixel_limits()`; Nxhx(n*w)x3
+    :return: list of timestamps (None if checksum error for that frame), array of error digit index per frame (-1 if none)
+    """
+    g = timestamp_geometry
+    w = g['w']
+    h = g['h']
+    x0 = g['x0']
+    y0 = g['y0']
+    n = g['n']
+    h13 = g['h13']
+    h23 = g['h23']
+    w12 = g['w12']
+
+    if isinstance(precomputed_checksums, dict):
+        precomputed_checksums = get_checksum_table(precomputed_checksums)
+    digits, table = precomputed_checksums
+
+    if frames is not None:
+        if isinstance(frames, np.ndarray):
+            tsimg = frames[:, y0:(y0+h), x0:(x0+(n*w)), :]
+        else:
+            tsimg = np.stack([frame[y0:(y0+h), x0:(x0+(n*w)), :] for frame in frames])
+    elif timestamp_pixels is not None:
+        tsimg = np.asarray(timestamp_pixels)
+    else:
+        raise ValueError("One of `frames` or `timestamp_pixels` must be specified.")
+    n_frames = tsimg.shape[0]
+
+    # convert color to gray-scale with all frames stacked vertically, then to binary mask (1/2 intensity)
+    tsgray = cv2.cvtColor(np.ascontiguousarray(tsimg).reshape(n_frames*h, n*w, 3), cv2.COLOR_BGR2GRAY)
+    tsmask = (tsgray > 127).reshape(n_frames, h, n, w).astype(np.int64)
+
+    # 6-area checksums for every digit: [n_frames, 3, n, w] -> [n_frames, 3, n, 2] -> [n_frames, n, 3, 2]
+    cs = np.add.reduceat(tsmask, [0, h13, h23], axis=1)
+    cs = np.add.reduceat(cs, [0, w12], axis=3)
+    cs = cs.transpose(0, 2, 1, 3)
+
+    # absolute difference between each digit and each candidate: [n_frames, n, k]
+    cs_diff = np.abs(cs[:, :, None] - table[None, None]).sum(axis=(3, 4))
+    best = cs_diff.argmin(axis=2)
+    pred_err = np.take_along_axis(cs_diff, best[:, :, None], axis=2)[:, :, 0]
+    pred_dig = digits[best]
+
+    # disregard the decimal point in the UNIX time (always reported in .00 precision)
+    dig_idx = [j for j in range(n) if j != 10]
+    # looking for a perfect checksum match; testing showed this was reliable
+    bad = pred_err[:, dig_idx] > 0
+    error_digit = np.where(bad.any(axis=1), np.array(dig_idx)[bad.argmax(axis=1)], -1)
+
+    timestamps = []
+    for i in range(n_frames):
+        if error_digit[i] != -1:
+            timestamps.append(None)
+        else:
+            ts_dig = [str(pred_dig[i, j]) if j != 10 else '.' for j in range(n)]
+            timestamps.append(ast.literal_eval(''.join(ts_dig)))
+    return timestamps, error_digit
+
+
 def parse_frame_timestamp(timestamp_geometry, precomputed_checksums, frame_pixels=None, timestamp_pixels=None):
     """
     Use pixel checksum method to parse timestamp from video frame. First extracts timestamp area from frame
         array. Then converts to gray-scale, then converts to binary (black/white) mask. Each digit
         (monospaced) is then compared against the pre-computed pixel checksum values for an exact match.
+        Single-frame wrapper around parse_frame_timestamps().
     :param timestamp_geometry: dictionary of parameters used for determining area of each digit in checksum
         (load using utilities.get_timestamp_geometry)
-    :param precomputed_checksums: dictionary of checksum:digit pairs (load using utilities.get_precomputed_checksums())
+    :param precomputed_checksums: checksum table (from get_checksum_table()) or dictionary of digit:checksum pairs
+        (load using utilities.get_precomputed_checksums())
     :param frame_pixels: numpy array of full (4K) color video frame; dimensions should be 2160x3840x3
     :param timestamp_pixels: numpy array of timestamp area, defined by `get_timestamp_pixel_limits()`
     :return: timestamp (None if checksum error), pixels from error digit (if no exact checksum match)
     """
-    # extract geometry values from timestamp_geometry dictionary
     g = timestamp_geometry
     w = g['w']
     h = g['h']
     x0 = g['x0']
     y0 = g['y0']
     n = g['n']
-    h13 = g['h13']
-    h23 = g['h23']
-    h12 = g['h12']
-    w12 = g['w12']
-        
-    dig_cs6 = precomputed_checksums
-    
+
     if frame_pixels is not None:
         # extract the timestamp in the x/y directions
         tsimg = frame_pixels[y0:(y0+h), x0:(x0+(n*w)), :]
@@ -76,43 +153,192 @@ def parse_frame_timestamp(timestamp_geometry, precomputed_checksums, frame_pixel
         tsimg = timestamp_pixels
     else:
         raise ValueError("One of `frame_pixels` or `timestamp_pixels` must be specified.")
-    # convert color to gray-scale
-    tsgray = cv2.cvtColor(tsimg, cv2.COLOR_BGR2GRAY)
-    # convert to black/white binary mask using fixed threshold (1/2 intensity)
-    # observed gray values on the edges of some digits in some frames were well below this threshold
-    ret, tsmask = cv2.threshold(tsgray, 127, 255, cv2.THRESH_BINARY)
-
-    # parse each of the `n` digits
-    ts_dig = []
-    for j in range(n):
-        # disregard the decimal point in the UNIX time (always reported in .00 precision)
-        if j == 10:
-            ts_dig.append('.')
-            continue
-
-        # extract the digit for this index, was already cropped x0:x0+n*w, y0:y0+h
-        pixels = tsmask[:, j*w:(j+1)*w]
-        
-        # cv2.imshow("pixels",pixels)
-        # cv2.waitKey(0)
-        
-        # compute the 6-area checksum and convert it to an array
-        cs = [[int(pixels[:h13, :w12].sum() / 255), int(pixels[:h13, w12:].sum() / 255)],
-              [int(pixels[h13:h23, :w12].sum() / 255), int(pixels[h13:h23, w12:].sum() / 255)],
-              [int(pixels[h23:, :w12].sum() / 255), int(pixels[h23:, w12:].sum() / 255)]
-              ]
-        cs = array(cs)
-        # compute the absolute difference between this digit and each candidate
-        cs_diff = [(dig, abs(cs - cs_ref).sum()) for dig, cs_ref in dig_cs6.items()]
-        pred_dig, pred_err = min(cs_diff, key=lambda x: x[1])
-        # looking for a perfect checksum match; testing showed this was reliable
-        if pred_err > 0:
-            # if no exact match, return no timestamp and the pixel values that resulted in the error
-            return None, pixels
-        else:
-            ts_dig.append(pred_dig)
-    # convert the list of strings into a number and return successful timestamp
-    return ast.literal_eval(''.join(map(str, ts_dig))), None
+
+    timestamps, error_digit = parse_frame_timestamps(timestamp_geometry, precomputed_checksums,
+                                                     timestamp_pixels=tsimg[None])
+    if timestamps[0] is None:
+        # return no timestamp and the pixel values that resulted in the error
+        j = error_digit[0]
+        tsgray = cv2.cvtColor(tsimg, cv2.COLOR_BGR2GRAY)
+        ret, tsmask = cv2.threshold(tsgray, 127, 255, cv2.THRESH_BINARY)
+        return None, tsmask[:, j*w:(j+1)*w]
+    return timestamps[0], None
+
+
+class TimestampIndex:
+    """
+    Persistent per-video timestamp index (frame index -> parsed timestamp, plus a parse-failure flag). The index is
+        stored next to the video as `<video>.ts.npy` (structured array with fields `ts` and `valid`) and
+        `<video>.ts.json` (video file size and mtime, plus a signature of the timestamp geometry and checksum tables the
+        index was parsed with, used to validate the index). Indexes are memory-mapped on load.
+    """
+    dtype = np.dtype([('ts', np.float64), ('valid', np.bool_)])
+
+    def __init__(self, sequence, records):
+        self.sequence = sequence
+        self.records = records
+        self.ts = records['ts']
+        self.valid = records['valid']
+        self._filled = None
+
+    @staticmethod
+    def paths(sequence):
+        return sequence + '.ts.npy', sequence + '.ts.json'
+
+    @staticmethod
+    def file_signature(sequence):
+        stat = os.stat(sequence)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    @staticmethod
+    def parser_signature(timestamp_geometry, precomputed_checksums):
+        """
+        Hashes the timestamp geometry(s) and checksum table(s) used to parse an index, so that an index is only reused
+            by readers that parse timestamps the same way.
+        :param timestamp_geometry: timestamp geometry, or list of geometries tried in order for each frame
+        :param precomputed_checksums: checksum table or dictionary, or list thereof (one per geometry)
+        :return: hex digest string
+        """
+        if not isinstance(timestamp_geometry, list):
+            timestamp_geometry = [timestamp_geometry]
+            precomputed_checksums = [precomputed_checksums]
+
+        h = hashlib.sha1()
+        for geom, checksums in zip(timestamp_geometry, precomputed_checksums):
+            items = sorted((str(key), np.asarray(val).tolist()) for key, val in geom.items())
+            h.update(repr(items).encode())
+            if isinstance(checksums, dict):
+                checksums = get_checksum_table(checksums)
+            for arr in checksums:
+                arr = np.ascontiguousarray(arr, dtype=np.int64)
+                h.update(repr(arr.shape).encode())
+                h.update(arr.tobytes())
+        return h.hexdigest()
+
+    @classmethod
+    def load(cls, sequence, parser):
+        """
+        Memory-maps the index for a video if one exists and matches the video's current size/mtime and the parser.
+        :param sequence: path to video file
+        :param parser: parser signature of the reader (see TimestampIndex.parser_signature)
+        :return: TimestampIndex, or None if there is no valid index
+        """
+        npy_path, json_path = cls.paths(sequence)
+        try:
+            with open(json_path, 'r') as f:
+                meta = json.load(f)
+            if meta != dict(cls.file_signature(sequence), parser=parser):
+                return None
+            records = np.load(npy_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        return cls(sequence, records)
+
+    @classmethod
+    def write(cls, sequence, timestamps, parser):
+        """
+        Writes the index for a video.
+        :param sequence: path to video file
+        :param timestamps: parsed timestamp for every frame of the video (None for parse failures)
+        :param parser: parser signature of the timestamps (see TimestampIndex.parser_signature)
+        :return: TimestampIndex
+        """
+        records = np.zeros(len(timestamps), dtype=cls.dtype)
+        records['valid'] = [ts is not None for ts in timestamps]
+        records['ts'] = [np.nan if ts is None else ts for ts in timestamps]
+
+        npy_path, json_path = cls.paths(sequence)
+        np.save(npy_path, records)
+        with open(json_path, 'w') as f:
+            json.dump(dict(cls.file_signature(sequence), parser=parser), f)
+        return cls.load(sequence, parser)
+
+    @classmethod
+    def build(cls, sequence, timestamp_geometry, precomputed_checksums, batch_size=32):
+        """
+        Decodes an entire video, parses the timestamp of each frame and writes the index.
+        :param sequence: path to video file
+        :param timestamp_geometry: timestamp geometry, or list of geometries tried in order for each frame
+        :param precomputed_checksums: checksum table or dictionary, or list thereof (one per geometry)
+        :param batch_size: number of frames parsed at once
+        :return: TimestampIndex
+        """
+        if not isinstance(timestamp_geometry, list):
+            timestamp_geometry = [timestamp_geometry]
+            precomputed_checksums = [precomputed_checksums]
+
+        cap = cv2.VideoCapture(sequence)
+        timestamps = []
+        ret = True
+        while ret:
+            frames = []
+            while len(frames) < batch_size:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frames.append(frame)
+            if len(frames) == 0:
+                break
+
+            batch_ts = [None for frame in frames]
+            for geom, checksums in zip(timestamp_geometry, precomputed_checksums):
+                missing = [i for i, ts in enumerate(batch_ts) if ts is None]
+                if len(missing) == 0:
+                    break
+                parsed, _ = parse_frame_timestamps(geom, checksums, frames=[frames[i] for i in missing])
+                for i, ts in zip(missing, parsed):
+                    batch_ts[i] = ts
+            timestamps += batch_ts
+        cap.release()
+
+        return cls.write(sequence, timestamps, cls.parser_signature(timestamp_geometry, precomputed_checksums))
+
+    @classmethod
+    def get(cls, sequence, timestamp_geometry, precomputed_checksums):
+        """
+        Loads the index for a video, building it first if there is no valid index.
+        """
+        index = cls.load(sequence, cls.parser_signature(timestamp_geometry, precomputed_checksums))
+        if index is None:
+            index = cls.build(sequence, timestamp_geometry, precomputed_checksums)
+        return index
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, frame_idx):
+        """
+        :return: parsed timestamp for frame_idx (None if parse failure)
+        """
+        if not self.valid[frame_idx]:
+            return None
+        return float(self.ts[frame_idx])
+
+    def filled(self, fps=30.0):
+        """
+        :return: array of timestamps for all frames, where parse failures are replaced by the previous timestamp plus
+            1/fps (frames before the first valid timestamp are extrapolated backwards)
+        """
+        if self._filled is None:
+            idx = np.arange(len(self))
+            valid = np.flatnonzero(self.valid)
+            if len(valid) == 0:
+                self._filled = idx / fps
+            else:
+                prev = np.maximum.accumulate(np.where(self.valid, idx, -1))
+                prev = np.where(prev == -1, valid[0], prev)
+                self._filled = self.ts[prev] + (idx - prev) / fps
+        return self._filled
+
+    def seek(self, target_time, side='left'):
+        """
+        Finds a frame by wall-clock time with a binary search (timestamps are assumed nondecreasing).
+        :param target_time: clock time (s)
+        :param side: 'left' for the first frame with timestamp >= target_time, 'right' for the first frame with
+            timestamp > target_time
+        :return: frame index (len(self) if no such frame)
+        """
+        return int(np.searchsorted(self.filled(), target_time, side=side))
 
 
 def parse_config_file(config_file):
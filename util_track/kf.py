@@ -15,9 +15,24 @@ class Torch_KF(object):
     """
     A tensor-based Kalman Filter that evaluates many KF-tracked objects in parallel
     using tensor operations
+    
+    Object states are stored in a preallocated pool of slots (rows of X, P, D and T).
+    Free slots are kept in a free list and reused by add(), and the pool doubles in 
+    capacity when it runs out, so adding or removing k objects costs O(k) and does not
+    reallocate the state of every other object. All per-object outputs and inputs 
+    (view(), get_dt(), predict()) are ordered by slot among active objects only
+    
+    In interacting multiple model (IMM) mode, each object carries K model states Xm [n,K,s]
+    and covariances Pm [n,K,s,s] (e.g. cruising and maneuvering models that differ in Q) 
+    along with model probabilities mu [n,K]. Each predict first mixes the model estimates
+    and propagates mu through the model transition matrix (so objects that are predicted
+    without being detected still switch models), then predicts all K models as one batch.
+    Each update updates all K models as one batch and reweights mu by the measurement 
+    likelihoods. X and P hold the combined estimate, so view() and all other outputs are 
+    unchanged
     """
     
-    def __init__(self,device,state_err = 10000, meas_err = 1, mod_err = 1, INIT = None, ADD_MEAN_Q = False, ADD_MEAN_R = False):
+    def __init__(self,device,state_err = 10000, meas_err = 1, mod_err = 1, INIT = None, ADD_MEAN_Q = False, ADD_MEAN_R = False, capacity = 64, IMM = None):
         """
         Parameters
         ----------
@@ -32,6 +47,15 @@ class Torch_KF(object):
         INIT : dictionary, optional
             A dictionary containing initialization matrices for P0, H, mu_H, Q, and mu_Q. 
             If specified, these are used instead of the diagonal values
+        capacity : int, optional
+            Initial number of object slots. The pool doubles in size whenever it is full.
+            The default is 64.
+        IMM : dictionary, optional
+            If specified (or if INIT contains an "IMM" dictionary), the filter runs in IMM mode.
+            Keys are "transition" ([K,K] model transition probabilities per predict, row i gives
+            the probability of switching from model i to each model j), either "Q" (list of K
+            [s,s] model covariances) or "Q_scale" (list of K factors applied to Q), and 
+            optionally "mu0" (initial model probabilities, uniform by default)
         """
         # initialize tensors
         self.meas_size = 5
@@ -41,6 +65,7 @@ class Torch_KF(object):
         self.X = None
         self.D = None
         self.T = None
+        self.capacity = capacity
         
         self.P0 = torch.zeros(self.state_size,self.state_size) # state covariance
         self.F = torch.zeros(self.state_size,self.state_size) # dynamical model
@@ -52,6 +77,13 @@ class Torch_KF(object):
         # obj_ids[a] stores index in X along dim 0 where object a is stored
         self.obj_idxs = {}
         
+        # slot pool - slot_ids[i] is the obj_id stored in slot i (None if free), free holds 
+        # unused slots (popped from the end, so lowest slots are reused first)
+        self.slot_ids = []
+        self.free = []
+        self.active = None
+        self._active_idxs = None
+        
         if INIT is None:
             # set intial value for state covariance
             self.P0 = torch.eye(self.state_size).unsqueeze(0) * state_err
@@ -114,6 +146,31 @@ class Torch_KF(object):
         self.mu_Q = self.mu_Q.to(device).float()
         self.mu_R = self.mu_R.to(device).float()
         #self.mu_R2 = self.mu_R.to(device).float()
+        
+        # if F is the identity apart from F[0,5] (constant velocity along x, signed by direction), 
+        # predict and view use closed-form updates rather than per-object copies of F and Q
+        F_static = self.F.clone()
+        F_static[0,5] = 0
+        self.cv_model = bool((F_static == torch.eye(self.state_size,device = device)).all())
+        
+        # IMM mode
+        if IMM is None and INIT is not None and "IMM" in INIT.keys():
+            IMM = INIT["IMM"]
+        self.imm = IMM is not None
+        self.Xm = None
+        self.Pm = None
+        self.mu = None
+        if self.imm:
+            if "Q" in IMM.keys():
+                self.imm_Q = torch.stack([torch.as_tensor(Q).float() for Q in IMM["Q"]]).to(device)
+            else:
+                self.imm_Q = torch.stack([self.Q.reshape(self.state_size,self.state_size) * scale for scale in IMM["Q_scale"]])
+            self.n_models = self.imm_Q.shape[0]
+            self.imm_transition = torch.as_tensor(IMM["transition"]).float().to(device)
+            if "mu0" in IMM.keys():
+                self.imm_mu0 = torch.as_tensor(IMM["mu0"]).float().to(device)
+            else:
+                self.imm_mu0 = torch.ones(self.n_models,device = device) / self.n_models
     
    
     
@@ -121,38 +178,73 @@ class Torch_KF(object):
         """
         Given a time, computes dt for each object in the filter. There are 4 acceptable input formats:
             1. time (float) - dt predicted for the same time for all objects
-            2. time (list) - dt predicted for each time in list (list dimension must match self.X dimension)
+            2. time (list) - dt predicted for each time in list (list dimension must match the number of objects)
             3. time (tensor) - same as 2
-            4. time (list) and idxs (list) of same length - idxs index self.X, all other 
-                objects are returned dt if use_default, otherwise returned 0
+            4. time (list or tensor) and idxs (list or long tensor) of same length - idxs index the objects 
+                (in view() order), all other objects are returned dt if use_default, otherwise returned 0
         
         """
         
-        if self.X is None or len(self.X) == 0:
+        if len(self.obj_idxs) == 0:
             return None
         
-        if type(target_time) == float: # 1.
-            dt = target_time - self.T
-            return dt
+        T = self.T[self.active_idxs()]
+        if not torch.is_tensor(target_time):
+            target_time = torch.tensor(target_time,dtype = torch.double)
+        target_time = target_time.to(T.device)
         
-        elif type(target_time) == list: # 2 and 4.
-            target_time = torch.tensor(target_time,dtype = torch.double) 
-            
-            if idxs is None:
-                dt = target_time - self.T
-                return dt
-            else:
-                dt = torch.zeros(len(self.X))
-                dt = dt + self.dt_default if use_default else dt
-                
-                for i in range(len(idxs)):
-                    dt[idxs[i]] = target_time[i] - self.T[idxs[i]]
-                
-                return dt
-                    
-        else: # 3. time is tensor
-            dt = target_time - self.T
+        if idxs is None: # 1, 2 and 3.
+            return target_time - T
+        
+        else: # 4. scatter dt for the selected objects
+            idxs = torch.as_tensor(idxs,dtype = torch.long,device = T.device)
+            dt = torch.full([len(T)],self.dt_default if use_default else 0.0,dtype = torch.double,device = T.device)
+            dt[idxs] = target_time - T[idxs]
             return dt
+    
+    def active_idxs(self):
+        """
+        Returns [n] long tensor of the slots in use, in ascending order (the row order of view())
+        """
+        if self._active_idxs is None:
+            if self.active is None:
+                self._active_idxs = torch.zeros(0,dtype = torch.long,device = self.device)
+            else:
+                self._active_idxs = self.active.nonzero().squeeze(1)
+        return self._active_idxs
+    
+    def grow(self,capacity,D_dtype = torch.float):
+        """
+        Reallocates the slot pool with the given capacity, copying all existing slots
+        """
+        old_capacity = 0 if self.X is None else len(self.X)
+        
+        X = torch.zeros([capacity,self.state_size],device = self.device)
+        P = torch.zeros([capacity,self.state_size,self.state_size],device = self.device)
+        D = torch.zeros(capacity,dtype = D_dtype if self.D is None else self.D.dtype,device = self.device)
+        T = torch.zeros(capacity,dtype = torch.double,device = self.device)
+        active = torch.zeros(capacity,dtype = torch.bool,device = self.device)
+        
+        if old_capacity > 0:
+            X[:old_capacity] = self.X
+            P[:old_capacity] = self.P
+            D[:old_capacity] = self.D
+            T[:old_capacity] = self.T
+            active[:old_capacity] = self.active
+        
+        self.X,self.P,self.D,self.T,self.active = X,P,D,T,active
+        
+        if self.imm:
+            Xm = torch.zeros([capacity,self.n_models,self.state_size],device = self.device)
+            Pm = torch.zeros([capacity,self.n_models,self.state_size,self.state_size],device = self.device)
+            mu = torch.zeros([capacity,self.n_models],device = self.device)
+            if old_capacity > 0:
+                Xm[:old_capacity] = self.Xm
+                Pm[:old_capacity] = self.Pm
+                mu[:old_capacity] = self.mu
+            self.Xm,self.Pm,self.mu = Xm,Pm,mu
+        self.slot_ids.extend([None]*(capacity - old_capacity))
+        self.free = list(range(capacity-1,old_capacity-1,-1)) + self.free
         
 
         
@@ -206,25 +298,32 @@ class Torch_KF(object):
             
             # overwrite l,w,h portion of p with known covariance
         
-        # store state and initialize P with defaults
-        try:
-            new_idx = len(self.X)
-            self.X = torch.cat((self.X,newX), dim = 0)
-            self.P = torch.cat((self.P,newP), dim = 0)
-            self.D = torch.cat((self.D,newD), dim = 0)
-            self.T = torch.cat((self.T,newT), dim = 0)
-        except:
-            new_idx = 0
-            self.X = newX.to(self.device).float()
-            self.P = newP.to(self.device)
-            self.D = newD.to(self.device)
-            self.T = newT.to(self.device).double()
+        # make sure there are enough free slots, doubling capacity as needed
+        if len(self.free) < len(obj_ids):
+            capacity = self.capacity if self.X is None else len(self.X)
+            while capacity - len(self.obj_idxs) < len(obj_ids):
+                capacity *= 2
+            self.grow(capacity,D_dtype = newD.dtype)
             
+        # store state and initialize P with defaults
+        slots = [self.free.pop() for _ in obj_ids]
+        new_idxs = torch.tensor(slots,dtype = torch.long,device = self.device)
+        self.X[new_idxs] = newX.to(self.device).float()
+        self.P[new_idxs] = newP.to(self.device).float()
+        self.D[new_idxs] = newD.to(self.device).to(self.D.dtype)
+        self.T[new_idxs] = newT.to(self.device).double()
+        self.active[new_idxs] = True
+        if self.imm:
+            # all models start from the same state
+            self.Xm[new_idxs] = self.X[new_idxs].unsqueeze(1)
+            self.Pm[new_idxs] = self.P[new_idxs].unsqueeze(1)
+            self.mu[new_idxs] = self.imm_mu0
+        self._active_idxs = None
             
         # add obj_ids to dictionary
-        for idx,id in enumerate(obj_ids):
-            self.obj_idxs[id] = new_idx
-            new_idx = new_idx + 1
+        for slot,id in zip(slots,obj_ids):
+            self.obj_idxs[id] = slot
+            self.slot_ids[slot] = id
         
     
     def remove(self,obj_ids):
@@ -237,114 +336,231 @@ class Torch_KF(object):
         ----------
         obj_ids : list of (int) object ids
         """
-        if self.X is not None:
-            keepers = list(range(len(self.X)))
-            for id in obj_ids:
-                keepers.remove(self.obj_idxs[id])
-                self.obj_idxs[id] = None    
-            keepers.sort()
-            
-            self.X = self.X[keepers,:]
-            self.P = self.P[keepers,:]
-            self.D = self.D[keepers]
-            self.T = self.T[keepers]
+        if self.X is not None and len(obj_ids) > 0:
+            # return slots to the free list, other slots are untouched
+            slots = [self.obj_idxs.pop(id) for id in obj_ids]
+            for slot in slots:
+                self.slot_ids[slot] = None
+            self.free.extend(slots)
             
-            # since rows were deleted from X and P, shift idxs accordingly
-            new_id = 0
-            removals = []
-            for id in self.obj_idxs:
-                if self.obj_idxs[id] is not None:
-                    self.obj_idxs[id] = new_id
-                    new_id += 1
-                else:
-                    removals.append(id)
-            for id in removals:
-                del self.obj_idxs[id]
+            self.active[torch.tensor(slots,dtype = torch.long,device = self.device)] = False
+            self._active_idxs = None
     
     def view(self,dt = None,with_direction = False):
         """
         Predicts the state for the given or default dt, but does not update the object states within the filter
         (i.e. non in-place version of predict())
         """
-        if self.X is None or len(self.X) == 0:
+        if len(self.obj_idxs) == 0:
             return [],[]
         
+        idxs = self.active_idxs()
+        X = self.X[idxs]
+        D = self.D[idxs]
+        
         if dt is None:
-            X_pred = self.X
+            X_pred = X
+        
+        elif self.cv_model:
+            # F only adds direction*dt*x_dot to x
+            X_pred = X.clone()
+            X_pred[:,0] += (D * dt).float() * X[:,5]
          
         else:
-            F_rep = self.F.unsqueeze(0).repeat(len(self.X),1,1)
-            F_rep[:,0,5] = self.D * dt
-            X_pred = torch.bmm(F_rep,self.X.unsqueeze(2)).squeeze(2)
+            F_rep = self.F.unsqueeze(0).repeat(len(X),1,1)
+            F_rep[:,0,5] = D * dt
+            X_pred = torch.bmm(F_rep,X.unsqueeze(2)).squeeze(2)
         
         states = X_pred
         
-        inverted = dict([(self.obj_idxs[key],key) for key in self.obj_idxs.keys()])
-        id_list = [inverted[i] for i in range(states.shape[0])]
         # get list of IDs - i.e. what obj id does each row correspond to 
+        id_list = [self.slot_ids[i] for i in idxs.tolist()]
         
         if with_direction:
-            states = torch.cat((states[:,:-1],self.D.float().unsqueeze(1),states[:,-1:]),dim = 1)
+            states = torch.cat((states[:,:-1],D.float().unsqueeze(1),states[:,-1:]),dim = 1)
             
         return id_list,states
          
     
-    def predict(self,dt = None):
+    def predict_to(self,times,idxs = None):
+        """
+        Description:
+        -----------
+        Predicts objects forward (in place) to the given times, leaving all other objects untouched
+        
+        Parameters
+        ----------
+        times : float or [m] tensor
+            time to predict each selected object to
+        idxs : list or [m] long tensor, optional
+            objects to predict (in view() order). If None, all objects are predicted
+        """
+        if len(self.obj_idxs) == 0:
+            return
+        
+        slots = self.active_idxs()
+        if idxs is not None:
+            slots = slots[torch.as_tensor(idxs,dtype = torch.long,device = slots.device)]
+        if not torch.is_tensor(times):
+            times = torch.tensor(times,dtype = torch.double)
+        
+        self.predict_slots(slots,times.to(self.T.device) - self.T[slots])
+        
+    def predict(self,dt = None,idxs = None):
         """
         Description:
         -----------
         Uses prediction equations to update X and P without a measurement
+        
+        Parameters
+        ----------
+        dt : float or tensor, optional
+            time step, either a single value or one value per predicted object. The default is dt_default
+        idxs : list or [m] long tensor, optional
+            objects to predict (in view() order). If None, all objects are predicted
         """
-        if self.X is None or len(self.X) == 0:
+        if len(self.obj_idxs) == 0:
             return
         
         if dt is None:
             dt = self.dt_default
+        
+        slots = self.active_idxs()
+        if idxs is not None:
+            slots = slots[torch.as_tensor(idxs,dtype = torch.long,device = slots.device)]
+        self.predict_slots(slots,dt)
+        
+    def predict_slots(self,idxs,dt):
+        """
+        Predicts the objects stored in the given slots by dt (float or one value per slot)
+        """
+        if self.imm:
+            # interaction - mix model estimates and propagate model probabilities through the transition matrix
+            Xm,Pm,mu = self.mix(self.Xm[idxs],self.Pm[idxs],self.mu[idxs])
             
-        # here we use t and direction. We alter F such that x_dot is signed by direction
-        # and corresponds to the timestep t
+            # predict all K models of each object as one batch, [K,s,s] model covariances are broadcast over objects
+            D = self.D[idxs].unsqueeze(1)
+            dt_m = dt.unsqueeze(1) if torch.is_tensor(dt) and dt.dim() > 0 else dt
+            Xm,Pm = self.predict_states(Xm,Pm,D,dt_m,self.imm_Q)
             
-        # update X --> X = XF + mu_F--> [n,7] x [7,7] + [n,7] = [n,7]
-        #self.X = torch.mm(self.X,self.F.transpose(0,1)) + self.mu_Q
-        F_rep = self.F.unsqueeze(0).repeat(len(self.X),1,1)
-        F_rep[:,0,5] = self.D * dt
-        self.X = torch.bmm(F_rep,self.X.unsqueeze(2)).squeeze(2)
+            self.Xm[idxs] = Xm
+            self.Pm[idxs] = Pm
+            self.mu[idxs] = mu
+            self.X[idxs],self.P[idxs] = self.combine(Xm,Pm,mu)
+            
+        else:
+            X,P = self.predict_states(self.X[idxs],self.P[idxs],self.D[idxs],dt,self.Q)
+            self.X[idxs] = X
+            self.P[idxs] = P
         
+        self.T[idxs] += dt  # either dt is a single value, or dt is a vector with one entry per object
         
-        # update P --> P = FPF^(-1) + Q --> [nx7x7] = [nx7x7] bx [nx7x7] bx [nx7x7] + [n+7x7]
-        #F_rep = self.F.unsqueeze(0).repeat(len(self.P),1,1)
-        step1 = torch.bmm(F_rep,self.P.float())
-        step2 = F_rep.transpose(1,2)
-        step3 = torch.bmm(step1,step2)
-        step4 = self.Q.repeat(len(self.P),1,1)
+    def predict_states(self,X,P,D,dt,Q):
+        """
+        Prediction equations for a batch of states. Leading dimensions are broadcast, 
+        e.g. [m,K,s] IMM model states with [m,1] directions and [K,s,s] model covariances
+        
+        X - [m,s] states
+        P - [m,s,s] covariances
+        D - [m] directions
+        dt - float or [m] tensor
+        Q - [1,s,s] or [m,s,s] model covariances for time step dt_default
+        
+        returns - predicted X and P
+        """
+        # here we use t and direction. We alter F such that x_dot is signed by direction
+        # and corresponds to the timestep t
+        
+        if self.cv_model:
+            # F = I + a*e0*e5^T with a = direction*dt, so FX and FPF^T only change x 
+            # and row/column 0 of P:
+            #   X[0] += a*X[5]
+            #   FP   = P  with row 0 += a*P[5,:]
+            #   FPFt = FP with column 0 += a*FP[:,5]
+            a = (D * dt).float()
+            X[...,0] += a * X[...,5]
+            P[...,0,:] += a.unsqueeze(-1) * P[...,5,:]
+            P[...,:,0] += a.unsqueeze(-1) * P[...,:,5]
+            step3 = P
+            
+        else:
+            # update X --> X = XF + mu_F--> [n,7] x [7,7] + [n,7] = [n,7]
+            #self.X = torch.mm(self.X,self.F.transpose(0,1)) + self.mu_Q
+            F_rep = self.F.expand(X.shape[:-1] + self.F.shape).clone()
+            F_rep[...,0,5] = D * dt
+            X = torch.matmul(F_rep,X.unsqueeze(-1)).squeeze(-1)
+            
+            # update P --> P = FPF^(-1) + Q --> [nx7x7] = [nx7x7] bx [nx7x7] bx [nx7x7] + [n+7x7]
+            step1 = torch.matmul(F_rep,P.float())
+            step2 = F_rep.transpose(-1,-2)
+            step3 = torch.matmul(step1,step2)
         
         # scale Q by the timestamp, assuming model error is linearly correlated to dt
-        try:
-            step4 = step4 * dt/self.dt_default
-        except:
-            step4 = step4 * dt.unsqueeze(1).unsqueeze(2).repeat(1,self.Q.shape[1],self.Q.shape[2]) / self.dt_default
+        # (Q is broadcast along dim 0, a per-object dt is broadcast per object)
+        if torch.is_tensor(dt):
+            step4 = Q * (dt.view(dt.shape + (1,1)) / self.dt_default).float()
+        else:
+            step4 = Q * (dt/self.dt_default)
             
-        self.P = step3 + step4
-        self.P = self.P.float()
+        return X,(step3 + step4).float()
+    
+    def combine(self,Xm,Pm,mu):
+        """
+        Moment-matched combination of IMM model estimates
+        
+        Xm - [m,K,s], Pm - [m,K,s,s], mu - [m,K]
         
-        self.T += dt  # either dt is a single value, or dt is a vector of the same length as self.T
+        returns - X [m,s] and P [m,s,s]
+        """
+        X = torch.einsum("mk,mks->ms",mu,Xm)
+        dX = Xm - X.unsqueeze(1)
+        P = torch.einsum("mk,mkst->mst",mu,Pm + dX.unsqueeze(3)*dX.unsqueeze(2))
+        return X,P
+    
+    def mix(self,Xm,Pm,mu):
+        """
+        IMM interaction step, run before each prediction - computes predicted model 
+        probabilities c = transition^T mu and the mixed initial state and covariance of 
+        each model
         
-        # each item in F_rep[:,0,5] is associated with an obj_id -> we need to get the idea for each
+        Xm - [m,K,s], Pm - [m,K,s,s], mu - [m,K] model probabilities
         
+        returns - mixed Xm, Pm and predicted model probabilities [m,K]
+        """
+        # c[j] = sum_i p_ij mu_i, w[i,j] = p_ij mu_i / c[j]
+        c = torch.matmul(mu,self.imm_transition)
+        w = mu.unsqueeze(2) * self.imm_transition.unsqueeze(0) / (c.unsqueeze(1) + 1e-30)
+        
+        X0 = torch.einsum("mij,mis->mjs",w,Xm)
+        dX = Xm.unsqueeze(2) - X0.unsqueeze(1) # [m,i,j,s]
+        P0 = torch.einsum("mij,mijst->mjst",w,Pm.unsqueeze(2) + dX.unsqueeze(4)*dX.unsqueeze(3))
+        return X0,P0,c
+    
+    def slots(self,obj_ids):
+        """
+        Returns [m] long tensor of the slots (rows of X and P) storing each obj_id in obj_ids
+        """
+        return torch.tensor([self.obj_idxs[id] for id in obj_ids],dtype = torch.long,device = self.device)
         
-    def update(self,detections,obj_ids,measurement_idx = 1):
+    def update(self,detections,obj_ids,measurement_idx = 1,idxs = None):
         """
         Description
         -----------
         Updates state for objects corresponding to each obj_id in obj_ids
         Equations taken from: wikipedia.org/wiki/Kalman_filter#Predict
+        S is factorized with a batched Cholesky decomposition rather than inverted, and
+        P is updated in Joseph form so that it stays symmetric positive definite
         
         Parameters
         ----------
-        detection - np array of size [m,4] 
-            Specifies bounding box x,y,scale and ratio for each of m detections
+        detection - np array or tensor of size [m,meas_size] 
+            Specifies measurement for each of m detections
         obj_ids - list of length m
             Unique obj_id (int) for each detection
+        measurement_idx - int (1,2 or 3)
+            Specifies which measurement model (H,R,mu_R) to use
+        idxs - [m] long tensor, optional
+            slots of the updated objects (see slots()), used instead of obj_ids if given
         """
         
         if measurement_idx == 1:
@@ -364,43 +580,80 @@ class Torch_KF(object):
             raise ValueError
         
         # get relevant portions of X and P
-        relevant = [self.obj_idxs[id] for id in obj_ids]
-        X_up = self.X[relevant,:]
-        P_up = self.P[relevant,:,:].float()
-        
-        # state innovation --> y = z - XHt --> mx4 = mx4 - [mx7] x [4x7]t  
-        try:
-            z = torch.from_numpy(detections).to(self.device).double()
-        except:
-             z = detections.to(self.device).double()
-        y = z + mu_R - torch.mm(X_up, H.transpose(0,1))  ######### Not sure if this is right but..
-        
-        # covariance innovation --> HPHt + R --> [mx4x4] = [mx4x7] bx [mx7x7] bx [mx4x7]t + [mx4x4]
-        # where bx is batch matrix multiplication broadcast along dim 0
-        # in this case, S = [m,4,4]
-        H_rep = H.unsqueeze(0).repeat(len(P_up),1,1)
-        step1 = torch.bmm(H_rep,P_up) # this needs to be batched along dim 0
-        step2 = torch.bmm(step1,H_rep.transpose(1,2))
-        S = step2 + R.repeat(len(P_up),1,1)
-        
-        # kalman gain --> K = P Ht S^(-1) --> [m,7,4] = [m,7,7] bx [m,7,4]t bx [m,4,4]^-1
-        step1 = torch.bmm(P_up,H_rep.transpose(1,2))
-        K = torch.bmm(step1,S.inverse())
-        
-        # A posteriori state estimate --> X_updated = X + Ky --> [mx7] = [mx7] + [mx7x4] bx [mx4x1]
-        # must first unsqueeze y to third dimension, then unsqueeze at end
-        y = y.unsqueeze(-1).float() # [mx4] --> [mx4x1]
-        step1 = torch.bmm(K,y).squeeze(-1) # mx7
-        X_up = X_up + step1
-        
-        # P_updated --> (I-KH)P --> [m,7,7] = ([m,7,7 - [m,7,4] bx [m,4,7]) bx [m,7,7]    
-        I = torch.eye(self.state_size).unsqueeze(0).repeat(len(P_up),1,1).to(self.device)
-        step1 = I - torch.bmm(K,H_rep)
-        P_up = torch.bmm(step1,P_up)
-        
-        # store updated values
-        self.X[relevant,:] = X_up
-        self.P[relevant,:,:] = P_up
+        if idxs is None:
+            idxs = self.slots(obj_ids)
+        if isinstance(detections,np.ndarray):
+            detections = torch.from_numpy(detections)
+        z = detections.to(self.device).to(self.X.dtype)
+        
+        if self.imm:
+            # update all K models of each object as one batch of m*K states
+            m = len(idxs)
+            K = self.n_models
+            X_up = self.Xm[idxs].reshape(m*K,self.state_size)
+            P_up = self.Pm[idxs].reshape(m*K,self.state_size,self.state_size)
+            X_up,P_up,log_likelihood = self.update_states(X_up,P_up,z.repeat_interleave(K,dim = 0),H,R,mu_R,likelihood = True)
+            Xm = X_up.view(m,K,self.state_size)
+            Pm = P_up.view(m,K,self.state_size,self.state_size)
+            
+            # model probabilities --> mu_posterior ~ mu_predicted * likelihood
+            mu = torch.softmax(torch.log(self.mu[idxs] + 1e-30) + log_likelihood.view(m,K),dim = 1)
+            
+            self.Xm[idxs] = Xm
+            self.Pm[idxs] = Pm
+            self.mu[idxs] = mu
+            self.X[idxs],self.P[idxs] = self.combine(Xm,Pm,mu)
+            
+        else:
+            X_up,P_up = self.update_states(self.X[idxs],self.P[idxs],z,H,R,mu_R)
+            self.X[idxs] = X_up
+            self.P[idxs] = P_up
+        
+    def update_states(self,X_up,P_up,z,H,R,mu_R,likelihood = False):
+        """
+        Update equations for a batch of states
+        
+        X_up - [m,s] states
+        P_up - [m,s,s] covariances
+        z - [m,k] measurements
+        H,R,mu_R - measurement model
+        likelihood - if True, also returns [m] measurement log-likelihoods (up to a constant)
+        
+        returns - updated X and P (and log-likelihood)
+        """
+        # state innovation --> y = z - XHt --> [m,k] = [m,k] - [m,s] x [k,s]t  
+        y = z + mu_R - torch.matmul(X_up, H.transpose(0,1))
+        
+        # covariance innovation --> S = HPHt + R --> [m,k,k], with H and R broadcast along dim 0
+        PHt = torch.matmul(P_up,H.transpose(0,1)) # [m,s,k]
+        S = torch.matmul(H,PHt) + R
+        
+        # kalman gain --> K = P Ht S^(-1), computed as Kt = S^(-1) (PHt)t since S is symmetric
+        L,info = torch.linalg.cholesky_ex(S)
+        if info.any():
+            # fall back to LU solve if some S is not numerically positive definite
+            K = torch.linalg.solve(S,PHt.transpose(1,2)).transpose(1,2)
+            if likelihood:
+                log_likelihood = -0.5 * ((y.unsqueeze(1) @ torch.linalg.solve(S,y.unsqueeze(-1))).view(-1) + torch.linalg.slogdet(S)[1])
+        else:
+            K = torch.cholesky_solve(PHt.transpose(1,2),L).transpose(1,2) # [m,s,k]
+            if likelihood:
+                # -1/2 (yt S^-1 y + log|S|) with S = LLt
+                Ly = torch.linalg.solve_triangular(L,y.unsqueeze(-1),upper = False)
+                log_likelihood = -0.5 * (Ly.pow(2).sum(dim = (1,2)) + 2*torch.log(torch.diagonal(L,dim1 = 1,dim2 = 2)).sum(dim = 1))
+        
+        # A posteriori state estimate --> X_updated = X + Ky --> [m,s] = [m,s] + [m,s,k] bx [m,k,1]
+        X_up = X_up + torch.matmul(K,y.unsqueeze(-1)).squeeze(-1)
+        
+        # Joseph form --> P_updated = (I-KH)P(I-KH)t + KRKt
+        A = -torch.matmul(K,H)
+        A.diagonal(dim1 = 1,dim2 = 2).add_(1)
+        P_up = torch.matmul(torch.matmul(A,P_up),A.transpose(1,2)) + torch.matmul(torch.matmul(K,R),K.transpose(1,2))
+        P_up = (P_up + P_up.transpose(1,2)) / 2.0
+        
+        if likelihood:
+            return X_up,P_up,log_likelihood
+        return X_up,P_up
     
     # def objs(self,with_direction = False):
     #     """
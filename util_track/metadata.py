@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar per-object bookkeeping (frames since last detection, class evidence,
+confidence and camera statistics) for the trackers
+"""
+
+import numpy as np
+import torch
+
+
+class TrackMetadata():
+    """
+    Stores tracker metadata for each object in preallocated arrays with one row per
+    slot. Slots are assigned when objects are added and recycled when they are removed,
+    so memory is bounded by the number of simultaneously tracked objects rather than
+    by the length of the run. ids are mapped to slots with a dict for O(1) lookup, and
+    all updates are vectorized over the given ids.
+
+    Only running aggregates are kept for each object: class histogram, number of
+    detections, confidence sum and last camera. When an object is removed, its number
+    of detections and most likely class are archived by id (ids are assumed to be
+    non-negative ints), so they remain available when results are written. Ids that
+    were never added have 0 detections and class -1
+    """
+
+    def __init__(self,n_classes = 8,capacity = 64):
+        """
+        Parameters
+        ----------
+        n_classes : int, optional
+            Number of object classes (length of class histogram). The default is 8.
+        capacity : int, optional
+            Initial number of slots. The pool doubles in size whenever it is full.
+            The default is 64.
+        """
+        self.n_classes = n_classes
+        self.slot_of = {}     # slot_of[id] = slot storing object id
+        self.free = []        # unused slots
+        self.capacity = 0
+
+        self.ids          = np.zeros(0,dtype = np.int64)
+        self.fsld         = np.zeros(0,dtype = np.int32)  # frames since last detection
+        self.class_counts = np.zeros([0,n_classes],dtype = np.int32)
+        self.n_dets       = np.zeros(0,dtype = np.int32)
+        self.conf_sum     = np.zeros(0,dtype = np.float64)
+        self.last_camera  = np.zeros(0,dtype = np.int32)
+        self.grow(capacity)
+
+        # archived aggregates of removed objects, indexed by id
+        self.archived_dets  = np.zeros(0,dtype = np.int32)
+        self.archived_class = np.zeros(0,dtype = np.int16)
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def __contains__(self,id):
+        return id in self.slot_of
+
+    def grow(self,capacity):
+        """
+        Reallocates all slot arrays to hold capacity objects, copying existing rows
+        """
+        old = self.capacity
+
+        def resized(array):
+            new = np.zeros((capacity,) + array.shape[1:],dtype = array.dtype)
+            new[:old] = array
+            return new
+
+        self.ids          = resized(self.ids)
+        self.fsld         = resized(self.fsld)
+        self.class_counts = resized(self.class_counts)
+        self.n_dets       = resized(self.n_dets)
+        self.conf_sum     = resized(self.conf_sum)
+        self.last_camera  = resized(self.last_camera)
+
+        # lowest slots are popped first
+        self.free = list(range(capacity-1,old-1,-1)) + self.free
+        self.capacity = capacity
+
+    def slots(self,ids):
+        """
+        Returns [m] int array of the slots storing each id in ids
+        """
+        return np.array([self.slot_of[id] for id in _array(ids,np.int64).tolist()],dtype = np.int64)
+
+    def add(self,ids,classes,confs,cameras = None):
+        """
+        Adds new objects, each with one detection
+
+        ids     - list or array of m (int) new object ids
+        classes - [m] class of each detection
+        confs   - [m] confidence of each detection
+        cameras - [m] camera index of each detection
+        """
+        ids = _array(ids,np.int64)
+        if len(ids) == 0:
+            return
+
+        if len(self.free) < len(ids):
+            self.grow(max(2*self.capacity,self.capacity + len(ids)))
+        slots = np.array([self.free.pop() for _ in ids],dtype = np.int64)
+        for id,slot in zip(ids.tolist(),slots.tolist()):
+            self.slot_of[id] = slot
+
+        self.ids[slots] = ids
+        self.fsld[slots] = 0
+        self.class_counts[slots] = 0
+        self.n_dets[slots] = 0
+        self.conf_sum[slots] = 0
+        self.last_camera[slots] = -1
+        self._record(slots,classes,confs,cameras,None)
+
+    def update(self,ids,classes,confs,cameras = None,detected = None):
+        """
+        Records one detection for each tracked object in ids
+
+        detected - [m] bool array, optional. fsld is reset for objects where True
+                   and incremented otherwise. By default all objects are detected
+        """
+        slots = self.slots(ids)
+        if len(slots) > 0:
+            self._record(slots,classes,confs,cameras,detected)
+
+    def _record(self,slots,classes,confs,cameras,detected):
+        classes = _array(classes,np.int64)
+        np.add.at(self.class_counts,(slots,classes),1)
+        self.n_dets[slots] += 1
+        self.conf_sum[slots] += _array(confs,np.float64)
+        if cameras is not None:
+            self.last_camera[slots] = _array(cameras,np.int32)
+
+        if detected is None:
+            self.fsld[slots] = 0
+        else:
+            detected = _array(detected,bool)
+            self.fsld[slots] = np.where(detected,0,self.fsld[slots] + 1)
+
+    def missed(self,ids):
+        """
+        Increments frames since last detection for each object in ids
+        """
+        self.fsld[self.slots(ids)] += 1
+
+    def lost(self,ids,f_max):
+        """
+        Returns list of the ids in ids with at least f_max frames since last detection
+        """
+        ids = _array(ids,np.int64)
+        if len(ids) == 0:
+            return []
+        return ids[self.fsld[self.slots(ids)] >= f_max].tolist()
+
+    def remove(self,ids):
+        """
+        Removes objects, archiving their detection count and most likely class
+        """
+        ids = _array(ids,np.int64)
+        if len(ids) == 0:
+            return
+        slots = self.slots(ids)
+
+        max_id = int(ids.max())
+        if max_id >= len(self.archived_dets):
+            size = max(2*len(self.archived_dets),max_id + 1)
+            archived_dets = np.zeros(size,dtype = np.int32)
+            archived_class = np.full(size,-1,dtype = np.int16)
+            archived_dets[:len(self.archived_dets)] = self.archived_dets
+            archived_class[:len(self.archived_class)] = self.archived_class
+            self.archived_dets,self.archived_class = archived_dets,archived_class
+        self.archived_dets[ids] = self.n_dets[slots]
+        self.archived_class[ids] = np.argmax(self.class_counts[slots],axis = 1)
+
+        for id in ids.tolist():
+            self.free.append(self.slot_of.pop(id))
+
+    def _lookup(self,ids,live,archived,unknown):
+        """
+        Gathers live(slots) for tracked ids and archived[ids] for removed ids. Ids that
+        are neither tracked nor archived get the value unknown
+        """
+        ids = _array(ids,np.int64)
+        slots = np.array([self.slot_of.get(id,-1) for id in ids.tolist()],dtype = np.int64)
+        tracked = slots >= 0
+
+        out = np.full(len(ids),unknown,dtype = archived.dtype)
+        out[tracked] = live(slots[tracked])
+        removed = ~tracked & (ids >= 0) & (ids < len(archived))
+        if removed.any():
+            out[removed] = archived[ids[removed]]
+        return out
+
+    def n_detections(self,ids):
+        """
+        Returns [m] int array with the number of detections of each (tracked or removed) object,
+        0 for unknown ids
+        """
+        return self._lookup(ids,lambda slots: self.n_dets[slots],self.archived_dets,0)
+
+    def best_class(self,ids):
+        """
+        Returns [m] int array with the most frequently detected class of each (tracked or removed) object,
+        -1 for unknown ids
+        """
+        return self._lookup(ids,lambda slots: np.argmax(self.class_counts[slots],axis = 1),self.archived_class,-1).astype(np.int64)
+
+    def mean_conf(self,ids):
+        """
+        Returns [m] array with the mean detection confidence of each tracked object
+        """
+        slots = self.slots(ids)
+        return self.conf_sum[slots] / np.maximum(self.n_dets[slots],1)
+
+
+def _array(values,dtype):
+    """
+    Converts a tensor, array, list of numbers or list of 0-d tensors to a 1D np array
+    """
+    if isinstance(values,torch.Tensor):
+        return values.detach().cpu().numpy().astype(dtype).reshape(-1)
+    if isinstance(values,np.ndarray):
+        return values.astype(dtype).reshape(-1)
+    return np.array([v.item() if isinstance(v,(torch.Tensor,np.generic)) else v for v in values],dtype = dtype).reshape(-1)
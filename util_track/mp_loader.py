@@ -18,12 +18,14 @@ import torch
 
 from torchvision.transforms import functional as F
 import torch.multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
 import timestamp_utilities as tsu
+from util_track.preprocess import FramePreprocessor
 
 
 class FrameLoader():
     
-    def __init__(self,track_directory,device, det_step, init_frames, buffer_size = 5,downsample = 1):
+    def __init__(self,track_directory,device, det_step, init_frames, buffer_size = 5,downsample = 1,shared_memory = False, frame_size = (1920,1080),sync_tolerance = 0.02):
         
         """
         Parameters
@@ -38,6 +40,15 @@ class FrameLoader():
             Number of frames used to initialize Kalman filter every det_step frames
         cutoff : int, optional
             If not None, only this many frames are loaded into memory. The default is None.
+        shared_memory : bool, optional
+            If True (video sequences only), frames are written into a preallocated 
+            shared-memory ring of buffer_size + 2 slots and only slot indices are 
+            sent through the queue. The default is False.
+        frame_size : tuple of (int,int), optional
+            (width,height) of frames stored in the shared-memory ring. The default is (1920,1080).
+        sync_tolerance : float, optional
+            After a call to skip_to(), frames with timestamps lagging the target 
+            time by at least this many seconds are skipped. The default is 0.02.
     
         """
         try:
@@ -91,7 +102,27 @@ class FrameLoader():
             self.len = test.get(7)
             test.release()
             
-            self.worker = ctx.Process(target=load_to_queue_video, args=(self.queue,sequence,device,buffer_size,))
+            # clock time that frames must reach to be used, set by skip_to()
+            self.target_time = ctx.Value("d",-np.inf)
+            self.sync_tolerance = sync_tolerance
+            
+            self.shared_memory = shared_memory
+            if shared_memory:
+                # preallocate one slot per queued frame, plus one held by the consumer 
+                # and one being written by the worker
+                n_slots = buffer_size + 2
+                w,h = frame_size
+                self.im_ring   = torch.zeros([n_slots,3,h,w]).share_memory_()
+                self.orig_ring = torch.zeros([n_slots,h,w,3],dtype = torch.uint8).share_memory_()
+                
+                self.free_slots = ctx.Queue()
+                for slot in range(n_slots):
+                    self.free_slots.put(slot)
+                self.held_slot = None
+                
+                self.worker = ctx.Process(target=load_to_ring_video, args=(self.queue,self.free_slots,self.im_ring,self.orig_ring,sequence,self.target_time,sync_tolerance))
+            else:
+                self.worker = ctx.Process(target=load_to_queue_video, args=(self.queue,sequence,device,buffer_size,self.target_time,sync_tolerance))
             self.worker.start()
             time.sleep(5)
         
@@ -119,12 +150,38 @@ class FrameLoader():
             Frame index in track
         frame : tuple of (tensor,tensor,tensor)
             image, image dimensions and original image
+        
+        In shared_memory mode, the returned image and original image are views 
+        into the ring buffer and are only valid until the next call to __next__
 
         """
         
         if self.frame_idx < len(self) -1:
-        
+            
+            if getattr(self,"shared_memory",False):
+                # frames buffered before the last call to skip_to() may still be stale
+                while True:
+                    # the slot held since the last call can now be overwritten by the worker
+                    if self.held_slot is not None:
+                        self.free_slots.put(self.held_slot)
+                        self.held_slot = None
+                    
+                    frame_idx,slot,timestamp = self.queue.get(timeout = 10)
+                    self.frame_idx = frame_idx
+                    if frame_idx == -1:
+                        return -1,None,None,None
+                    
+                    self.held_slot = slot
+                    if not self.is_stale(timestamp):
+                        break
+                
+                im = self.im_ring[slot].to(self.device)
+                original_im = self.orig_ring[slot].numpy()
+                return frame_idx,im,original_im,timestamp
+            
             frame = self.queue.get(timeout = 10)
+            while hasattr(self,"target_time") and frame[0] != -1 and self.is_stale(frame[3]):
+                frame = self.queue.get(timeout = 10)
             self.frame_idx = frame[0]
             return  frame
         
@@ -132,6 +189,412 @@ class FrameLoader():
             self.worker.terminate()
             self.worker.join()
             return -1,None,None,None
+    
+    def skip_to(self,target_time):
+        """
+        Description
+        -----------
+        Sets a target clock time for a video sequence. From now on, frames whose 
+        timestamps lag target_time by at least sync_tolerance are skipped by the 
+        worker (never resized, normalized or queued), and any such frames that 
+        were already buffered are dropped by __next__
+        
+        Parameters
+        ----------
+        target_time : float
+            clock time (s) 
+        """
+        self.target_time.value = target_time
+    
+    def is_stale(self,timestamp):
+        """
+        Returns True if a frame with this timestamp lags the current target time
+        """
+        return timestamp is not None and self.target_time.value - timestamp >= self.sync_tolerance
+
+class MultiCameraLoader():
+    """
+    Loads synchronized frames from several video sequences at once. A single worker
+    process owns all cv2.VideoCapture handles and decodes them with a thread pool,
+    so startup cost and process count do not grow with the number of cameras. 
+    The worker only decodes - raw frames are shipped through shared memory and 
+    each call to __next__ resizes and normalizes all cameras in one batched op 
+    on device, returning a ready [n_cams,3,H,W] batch
+    """
+    
+    def __init__(self,sequences,device,buffer_size = 3,frame_size = (1920,1080),n_workers = None,sync_tolerance = 0.02,return_originals = True):
+        """
+        Parameters
+        ----------
+        sequences : list of str
+            Paths to video sequences, one per camera
+        device : torch.device
+            specifies where frames should be loaded to , memory or GPU
+        buffer_size : int, optional
+            Number of batches decoded ahead of the consumer. The default is 3.
+        frame_size : tuple of (int,int), optional
+            (width,height) to which frames are resized. The default is (1920,1080).
+        n_workers : int, optional
+            Number of decoding threads. The default is None (one per camera).
+        sync_tolerance : float or None, optional
+            Cameras lagging the most recent camera timestamp of a batch by at least
+            this many seconds are advanced until they are within tolerance. If None, 
+            cameras are not synchronized. The default is 0.02.
+        return_originals : bool, optional
+            If False, None is returned instead of the resized original images, which
+            avoids copying them back from device. The default is True.
+        """
+        
+        self.sequences = sequences
+        self.device = device
+        self.frame_idx = -1
+        
+        lengths = []
+        for sequence in sequences:
+            test = cv2.VideoCapture(sequence)
+            lengths.append(test.get(7))
+            if len(lengths) == 1:
+                raw_size = (int(test.get(3)),int(test.get(4)))
+            test.release()
+        self.len = min(lengths)
+        
+        # one slot of raw frames per queued batch, plus one being written
+        n_cams = len(sequences)
+        n_slots = buffer_size + 1
+        raw_w,raw_h = raw_size
+        self.raw_ring = torch.zeros([n_slots,n_cams,raw_h,raw_w,3],dtype = torch.uint8).share_memory_()
+        self.preprocessor = FramePreprocessor(device,size = frame_size)
+        self.return_originals = return_originals
+        
+        ctx = mp.get_context('spawn')
+        self.queue = ctx.Queue()
+        self.free_slots = ctx.Queue()
+        for slot in range(n_slots):
+            self.free_slots.put(slot)
+        
+        if n_workers is None:
+            n_workers = n_cams
+        
+        # clock time that all cameras must reach to be used, set by skip_to()
+        self.target_time = ctx.Value("d",-np.inf)
+        
+        self.worker = ctx.Process(target=load_batches_to_ring, args=(self.queue,self.free_slots,self.raw_ring,sequences,n_workers,sync_tolerance,self.target_time))
+        self.worker.start()
+        
+    def __len__(self):
+        """
+        Description
+        -----------
+        Returns number of frames in the shortest sequence
+        """
+        return int(self.len)
+    
+    def __next__(self):
+        """
+        Description
+        -----------
+        Returns next batch of frames unless at end of any sequence, in which
+        case returns -1 for frame num and None for all other outputs
+
+        Returns
+        -------
+        frame_num : int
+            Frame index of batch
+        frames : tensor of size [n_cams,3,H,W]
+            normalized image for each camera
+        original_ims : list of np.arrays of size [H,W,3] or None
+            resized original image for each camera (None if not return_originals)
+        timestamps : list of float or None
+            parsed timestamp for each camera
+        """
+        
+        if self.frame_idx < len(self) -1:
+            frame_idx,slot,timestamps = self.queue.get(timeout = 30)
+            self.frame_idx = frame_idx
+            if frame_idx != -1:
+                if self.return_originals:
+                    frames,original_ims = self.preprocessor(self.raw_ring[slot],return_resized = True)
+                    original_ims = [im for im in original_ims.cpu().numpy()]
+                else:
+                    frames = self.preprocessor(self.raw_ring[slot])
+                    original_ims = None
+                
+                # frames have been copied out of the slot, so it can be reused right away
+                self.free_slots.put(slot)
+                return frame_idx,frames,original_ims,timestamps
+        
+        self.worker.terminate()
+        self.worker.join()
+        return -1,None,None,None
+    
+    def skip_to(self,target_time):
+        """
+        Description
+        -----------
+        Sets a target clock time for all cameras. Batches decoded after this call
+        contain no frames lagging target_time by sync_tolerance or more; such frames
+        are grabbed without being preprocessed. Batches already buffered are unaffected.
+        
+        Parameters
+        ----------
+        target_time : float
+            clock time (s) 
+        """
+        self.target_time.value = target_time
+
+
+def load_batches_to_ring(batch_queue,free_slots,raw_ring,sequences,n_workers,sync_tolerance,target_time = None):
+    """
+    Description
+    -----------
+    Worker for MultiCameraLoader. Decodes one frame per camera (cameras with the
+    earliest timestamps are submitted first), advances any camera lagging the 
+    latest timestamp by more than sync_tolerance, then copies only the frames that
+    will be used into a free slot of the shared ring buffer. Preprocessing is left 
+    to MultiCameraLoader.
+    
+    Parameters
+    ----------
+    batch_queue : multiprocessing Queue
+        shared queue in which (frame_idx,slot,timestamps) tuples are put
+    free_slots : multiprocessing Queue
+        slot indices that may be (over)written 
+    raw_ring : uint8 tensor of size [n_slots,n_cams,H,W,3] in shared memory
+    sequences : list of str
+        paths to video sequences
+    n_workers : int
+        number of decoding threads
+    sync_tolerance : float or None
+        maximum allowed lag (s) of any camera behind the latest camera in a batch
+    target_time : multiprocessing Value or None, optional
+        clock time (s) set by MultiCameraLoader.skip_to(). Cameras are also advanced
+        to within sync_tolerance of this time. The default is None.
+    """
+    
+    checksum_path="/home/worklab/Documents/derek/I24-video-processing/I24-video-ingest/resources/timestamp_pixel_checksum_6.pkl"
+    geom_path="/home/worklab/Documents/derek/I24-video-processing/I24-video-ingest/resources/timestamp_geometry_4K.pkl"
+    checksums = tsu.get_checksum_table(tsu.get_precomputed_checksums(checksum_path))
+    geom = tsu.get_timestamp_geometry(geom_path)
+    
+    parse = lambda im: tsu.parse_frame_timestamp(frame_pixels = im, timestamp_geometry = geom, precomputed_checksums = checksums)[0]
+    caps = [TimestampedCapture(sequence,parse,tsu.TimestampIndex.parser_signature(geom,checksums)) for sequence in sequences]
+    pool = ThreadPoolExecutor(max_workers = n_workers)
+    size = (raw_ring.shape[3],raw_ring.shape[2])
+    
+    frames = [None for cap in caps]
+    timestamps = [None for cap in caps]
+    
+    def read(i):
+        ret,frame,ts = caps[i].read()
+        if not ret:
+            return False
+        
+        if ts is None and timestamps[i] is not None:
+            ts = timestamps[i] + 1/30.0
+        frames[i] = frame
+        timestamps[i] = ts
+        return True
+    
+    def advance(i,latest):
+        # frames that are certainly too early are grabbed but never retrieved
+        frame,ts,n_skipped = caps[i].skip_to(timestamps[i],latest,sync_tolerance = sync_tolerance)
+        if frame is None:
+            return False
+        frames[i] = frame
+        timestamps[i] = ts
+        return True
+    
+    def copy_to_slot(i,slot):
+        frame = frames[i]
+        if (frame.shape[1],frame.shape[0]) != size:
+            frame = cv2.resize(frame,size)
+        raw_ring[slot,i].numpy()[:] = frame
+    
+    frame_idx = 0
+    while frame_idx < 30*5*60:
+        
+        # blocks until the consumer has released a slot
+        slot = free_slots.get()
+        
+        # decode one frame per camera, earliest timestamps first
+        order = sorted(range(len(caps)), key = lambda i: -np.inf if timestamps[i] is None else timestamps[i])
+        ok = all(pool.map(read,order))
+        
+        # advance lagging cameras - skipped frames are never preprocessed
+        if ok and sync_tolerance is not None and None not in timestamps:
+            latest = max(timestamps)
+            if target_time is not None:
+                latest = max(latest,target_time.value)
+            lagging = [i for i in order if latest - timestamps[i] >= sync_tolerance]
+            if len(lagging) > 0:
+                ok = all(pool.map(advance,lagging,[latest for i in lagging]))
+        
+        if not ok:
+            batch_queue.put((-1,None,None))
+            break
+        
+        list(pool.map(copy_to_slot,range(len(caps)),[slot for cap in caps]))
+        batch_queue.put((frame_idx,slot,timestamps.copy()))
+        frame_idx += 1
+    
+    for cap in caps:
+        cap.release()
+    pool.shutdown()
+    
+    # see load_to_queue_video - keep the process (and thus the shared storage) alive
+    while True:  
+           time.sleep(5)
+
+
+def skip_to_time(cap,timestamp,target_time,parse,sync_tolerance = 0.02,fps = 30.0):
+    """
+    Description
+    -----------
+    Advances cap until the last read frame's timestamp is within sync_tolerance of 
+    target_time. Frames that must lie before the target based on fps are only 
+    grabbed (not retrieved or timestamp-parsed); frames close to the target are read 
+    and their timestamps are parsed to check. Since grabbed frames cannot be undone,
+    only half of the estimated number of frames to the target is grabbed before the
+    timestamp is parsed again, so dropped frames (which bring the target closer than 
+    the estimate) do not make the capture overshoot the target.
+    
+    Parameters
+    ----------
+    cap : cv2.VideoCapture
+    timestamp : float
+        timestamp of the most recently read frame
+    target_time : float
+        clock time (s) to advance to
+    parse : function
+        returns parsed timestamp (or None) for a frame
+    sync_tolerance : float, optional
+        maximum allowed lag (s) behind target_time. The default is 0.02.
+    fps : float, optional
+        nominal frame rate of cap. The default is 30.0.
+
+    Returns
+    -------
+    frame : np.array or None
+        last frame read, or None if no frame was read or the end of the video was reached
+    timestamp : float
+        timestamp of frame 
+    n_skipped : int
+        number of frames advanced
+    """
+    frame = None
+    n_skipped = 0
+    while timestamp is not None and target_time - timestamp >= sync_tolerance:
+        
+        # frames that are certainly too early need not be retrieved. With dropped frames
+        # fewer frames than estimated remain, so only half of the estimate is grabbed
+        n_grab = int((target_time - timestamp) * fps) // 2
+        for i in range(n_grab):
+            if not cap.grab():
+                return None,timestamp,n_skipped
+            n_skipped += 1
+        
+        ret,frame = cap.read()
+        if not ret:
+            return None,timestamp,n_skipped
+        n_skipped += 1
+        
+        new_timestamp = parse(frame)
+        timestamp = new_timestamp if new_timestamp is not None else timestamp + (n_grab + 1)/fps
+        
+    return frame,timestamp,n_skipped
+
+
+class TimestampedCapture():
+    """
+    Wrapper around cv2.VideoCapture that also returns the timestamp of each frame.
+    Timestamps are looked up in the video's TimestampIndex if a valid one exists,
+    otherwise they are parsed from each frame and the index is written once the 
+    whole video has been parsed
+    """
+    
+    def __init__(self,sequence,parse,parser):
+        """
+        sequence - path to video sequence
+        parse - function that returns parsed timestamp (or None) for a frame
+        parser - signature of the geometry and checksums used by parse, an index
+                 is only reused if it was parsed with the same signature
+        """
+        self.sequence = sequence
+        self.cap = cv2.VideoCapture(sequence)
+        self.fps = self.cap.get(5) if self.cap.get(5) > 0 else 30.0
+        self.n_frames = int(self.cap.get(7))
+        self.parse = parse
+        self.parser = parser
+        
+        self.index = tsu.TimestampIndex.load(sequence,parser)
+        self.position = -1      # index of the last frame read
+        self.parsed = []        # timestamps parsed so far, if there is no index
+        self.complete = True    # False once any frame has been skipped without parsing
+    
+    def read(self):
+        """
+        Returns ret, frame, timestamp (None if timestamp could not be parsed)
+        """
+        ret,frame = self.cap.read()
+        if not ret:
+            self.write_index()
+            return False,None,None
+        
+        self.position += 1
+        if self.index is not None:
+            timestamp = self.index[self.position] if self.position < len(self.index) else None
+        else:
+            timestamp = self.parse(frame)
+            self.parsed.append(timestamp)
+            
+            # consumers often stop reading at the last frame rather than at end of video
+            if self.position == self.n_frames - 1:
+                self.write_index()
+        return True,frame,timestamp
+    
+    def skip_to(self,timestamp,target_time,sync_tolerance = 0.02):
+        """
+        Advances to the first frame whose timestamp is within sync_tolerance of 
+        target_time. With an index, the frame is found with a binary search and all
+        earlier frames are only grabbed. Otherwise see skip_to_time()
+        
+        timestamp - timestamp of the most recently read frame
+        target_time - clock time (s) to advance to
+        
+        Returns frame (None if end of video was reached), timestamp, number of frames advanced
+        """
+        if self.index is None:
+            frame,timestamp,n_skipped = skip_to_time(self.cap,timestamp,target_time,self.parse,sync_tolerance = sync_tolerance,fps = self.fps)
+            self.position += n_skipped
+            if n_skipped > 0:
+                self.complete = False
+            return frame,timestamp,n_skipped
+        
+        target = self.index.seek(target_time - sync_tolerance,side = "right")
+        n_skipped = 0
+        while self.position + 1 < target:
+            if not self.cap.grab():
+                return None,timestamp,n_skipped
+            self.position += 1
+            n_skipped += 1
+        
+        ret,frame,new_timestamp = self.read()
+        if not ret:
+            return None,timestamp,n_skipped
+        n_skipped += 1
+        timestamp = new_timestamp if new_timestamp is not None else self.index.filled(self.fps)[self.position]
+        return frame,timestamp,n_skipped
+    
+    def write_index(self):
+        if self.index is None and self.complete and len(self.parsed) > 0:
+            try:
+                self.index = tsu.TimestampIndex.write(self.sequence,self.parsed,self.parser)
+            except OSError:
+                pass
+    
+    def release(self):
+        self.cap.release()
+
 
 def load_to_queue(image_queue,files,det_step,init_frames,device,queue_size,downsample):
     """
@@ -203,14 +666,16 @@ def load_to_queue(image_queue,files,det_step,init_frames,device,queue_size,downs
     while True:  
            time.sleep(5)
         
-def load_to_queue_video(image_queue,sequence,device,queue_size):
+def load_to_queue_video(image_queue,sequence,device,queue_size,target_time = None,sync_tolerance = 0.02):
     
     checksum_path="/home/worklab/Documents/derek/I24-video-processing/I24-video-ingest/resources/timestamp_pixel_checksum_6.pkl"
     geom_path="/home/worklab/Documents/derek/I24-video-processing/I24-video-ingest/resources/timestamp_geometry_4K.pkl"
-    checksums = tsu.get_precomputed_checksums(checksum_path)
+    checksums = tsu.get_checksum_table(tsu.get_precomputed_checksums(checksum_path))
     geom = tsu.get_timestamp_geometry(geom_path)
     
-    cap = cv2.VideoCapture(sequence)
+    parse = lambda im: tsu.parse_frame_timestamp(frame_pixels = im, timestamp_geometry = geom, precomputed_checksums = checksums)[0]
+    cap = TimestampedCapture(sequence,parse,tsu.TimestampIndex.parser_signature(geom,checksums))
+    preprocessor = FramePreprocessor(device,size = (1920,1080))
     
     frame_idx = 0    
     while frame_idx < 30*5*60:
@@ -220,25 +685,28 @@ def load_to_queue_video(image_queue,sequence,device,queue_size):
             
             
             # load next image from videocapture object
-            ret,original_im = cap.read()
+            ret,original_im,timestamp = cap.read()
             if ret == False:
                 frame = (-1,None,None,None)
                 image_queue.put(frame)       
                 break
             else:
                 
-                timestamp = tsu.parse_frame_timestamp(frame_pixels = original_im, timestamp_geometry = geom, precomputed_checksums = checksums)
-                if timestamp[0] is None:
-                    timestamp = None
-                else:
-                    timestamp = timestamp[0]
+                # skip frames lagging the target time without preprocessing them
+                if target_time is not None and timestamp is not None and target_time.value - timestamp >= sync_tolerance:
+                    frame,timestamp,n_skipped = cap.skip_to(timestamp,target_time.value,sync_tolerance = sync_tolerance)
+                    frame_idx += n_skipped
+                    if frame is None:
+                        image_queue.put((-1,None,None,None))
+                        break
+                    original_im = frame
+                
+                # raw frame is uploaded once, then resized and normalized on device
+                im,original_im = preprocessor(original_im,return_resized = True)
+                im = im[0]
+                original_im = original_im[0].cpu().numpy()
                 
-                original_im = cv2.resize(original_im,(1920,1080))
-                im = F.to_tensor(original_im)
-                im = F.normalize(im,mean=[0.485, 0.456, 0.406],
-                                          std=[0.229, 0.224, 0.225])
                 # store preprocessed image, dimensions and original image
-                im = im.to(device)
                 dim = None
                 frame = (frame_idx,im,original_im,timestamp)
              
@@ -254,6 +722,73 @@ def load_to_queue_video(image_queue,sequence,device,queue_size):
            time.sleep(5)
     
     
+def load_to_ring_video(image_queue,free_slots,im_ring,orig_ring,sequence,target_time = None,sync_tolerance = 0.02):
+    """
+    Description
+    -----------
+    Shared-memory version of load_to_queue_video. Each decoded frame is written
+    into a free slot of the preallocated ring buffers and only (frame_idx,slot,timestamp)
+    is put in the queue, so frames are never pickled. The number of frames in 
+    flight is bounded by the number of free slots, which are returned by FrameLoader
+    
+    Parameters
+    ----------
+    image_queue : multiprocessing Queue
+        shared queue in which (frame_idx,slot,timestamp) tuples are put
+    free_slots : multiprocessing Queue
+        slot indices that may be (over)written 
+    im_ring : tensor of size [n_slots,3,H,W] in shared memory
+        normalized image for each slot
+    orig_ring : uint8 tensor of size [n_slots,H,W,3] in shared memory
+        resized original image for each slot
+    sequence : str
+        path to video sequence
+    target_time : multiprocessing Value or None, optional
+        clock time (s) set by FrameLoader.skip_to(). Frames lagging it by at least
+        sync_tolerance are skipped before preprocessing. The default is None.
+    sync_tolerance : float, optional
+        The default is 0.02.
+    """
+    
+    checksum_path="/home/worklab/Documents/derek/I24-video-processing/I24-video-ingest/resources/timestamp_pixel_checksum_6.pkl"
+    geom_path="/home/worklab/Documents/derek/I24-video-processing/I24-video-ingest/resources/timestamp_geometry_4K.pkl"
+    checksums = tsu.get_checksum_table(tsu.get_precomputed_checksums(checksum_path))
+    geom = tsu.get_timestamp_geometry(geom_path)
+    
+    parse = lambda im: tsu.parse_frame_timestamp(frame_pixels = im, timestamp_geometry = geom, precomputed_checksums = checksums)[0]
+    cap = TimestampedCapture(sequence,parse,tsu.TimestampIndex.parser_signature(geom,checksums))
+    preprocessor = FramePreprocessor(torch.device("cpu"),size = (orig_ring.shape[2],orig_ring.shape[1]))
+    
+    frame_idx = 0    
+    while frame_idx < 30*5*60:
+        
+        # blocks until the consumer has released a slot
+        slot = free_slots.get()
+        
+        ret,original_im,timestamp = cap.read()
+        if ret == False:
+            image_queue.put((-1,None,None))       
+            break
+        
+        # skip frames lagging the target time without preprocessing them
+        if target_time is not None and timestamp is not None and target_time.value - timestamp >= sync_tolerance:
+            original_im,timestamp,n_skipped = cap.skip_to(timestamp,target_time.value,sync_tolerance = sync_tolerance)
+            frame_idx += n_skipped
+            if original_im is None:
+                image_queue.put((-1,None,None))
+                break
+        
+        # write into the shared slot
+        im,original_im = preprocessor(original_im,return_resized = True)
+        orig_ring[slot] = original_im[0]
+        im_ring[slot] = im[0]
+        
+        image_queue.put((frame_idx,slot,timestamp))       
+        frame_idx += 1
+    
+    # see load_to_queue_video - keep the process (and thus the shared storage) alive
+    while True:  
+           time.sleep(5)
         
 if __name__ == "__main__":
     
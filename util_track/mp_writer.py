@@ -7,6 +7,7 @@ Created on Thu Oct 15 09:58:20 2020
 """
 
 import os
+import queue as queue_module
 import numpy as np
 import random 
 import time
@@ -47,3 +48,163 @@ def write_frames(queue,output_file):
         except:
             break
         
+
+class TrackWriter():
+    """
+    Streams tracked object states to disk. Rows (object id, clock time, state, ts_bias,
+    detection count, class) are buffered for chunk_frames frames and then handed to a 
+    background process that writes each chunk as a separate .npz file, so memory use is 
+    bounded by one chunk and all completed chunks survive a crash. Chunks are read back 
+    one at a time with load_track_chunks(). Each row also carries the object's metadata 
+    as of that frame, so the final metadata of every object can be recovered from the 
+    chunks alone with load_track_metadata()
+    """
+    
+    def __init__(self,directory,chunk_frames = 300):
+        """
+        directory    - (str) directory for chunk files. Existing chunk files are deleted
+        chunk_frames - (int) number of frames buffered before a chunk is written
+        """
+        self.directory = directory
+        self.chunk_frames = chunk_frames
+        
+        os.makedirs(directory,exist_ok = True)
+        for file in os.listdir(directory):
+            if file.startswith("tracks_") and file.endswith(".npz"):
+                os.remove(os.path.join(directory,file))
+        
+        self.buffer = []
+        self.n_buffered = 0
+        self.n_chunks = 0
+        
+        # create shared queue
+        ctx = mp.get_context('spawn')
+        self.queue = ctx.Queue()
+        
+        # daemon, so that an unclosed writer never blocks interpreter shutdown
+        self.worker = ctx.Process(target=write_track_chunks, args=(self.queue,directory),daemon = True)
+        self.worker.start()
+        
+    def __call__(self,ids,clock_time,states,ts_bias,n_detections,classes):
+        """
+        Stores one frame of outputs
+        
+        ids          - list of n (int) object ids
+        clock_time   - (float) time at which states are given
+        states       - [n,state_size] tensor or array of object states
+        ts_bias      - list of (float) timestamp bias for each camera
+        n_detections - [n] number of detections of each object so far
+        classes      - [n] most likely class of each object so far
+        """
+        if len(ids) > 0:
+            if isinstance(states,torch.Tensor):
+                states = states.cpu().numpy()
+            self.buffer.append((np.asarray(ids,dtype = np.int64),
+                                np.full(len(ids),clock_time,dtype = np.float64),
+                                np.asarray(states,dtype = np.float32),
+                                np.repeat(np.asarray(ts_bias,dtype = np.float64)[None,:],len(ids),axis = 0),
+                                np.asarray(n_detections,dtype = np.int32),
+                                np.asarray(classes,dtype = np.int16)))
+        
+        self.n_buffered += 1
+        if self.n_buffered >= self.chunk_frames:
+            self.flush()
+    
+    def flush(self):
+        """
+        Sends all buffered frames to the writer process as one chunk
+        """
+        if len(self.buffer) > 0:
+            chunk = [np.concatenate(item) for item in zip(*self.buffer)]
+            self.queue.put((self.n_chunks,chunk))
+            self.n_chunks += 1
+        self.buffer = []
+        self.n_buffered = 0
+        
+    def close(self):
+        """
+        Writes remaining frames and waits for all chunks to reach disk
+        """
+        if self.worker is not None:
+            self.flush()
+            self.queue.put(None)
+            self.worker.join()
+            self.worker = None
+    
+    def chunks(self):
+        """
+        Closes the writer and yields each chunk in order (see load_track_chunks)
+        """
+        self.close()
+        return load_track_chunks(self.directory)
+    
+def write_track_chunks(queue,directory):
+    
+    parent = mp.parent_process()
+    while True:
+        try:
+            item = queue.get(timeout = 10)
+        except queue_module.Empty:
+            # chunks may be minutes apart, so only stop waiting once the tracker has exited
+            if parent is not None and not parent.is_alive():
+                break
+            continue
+        
+        if item is None:
+            break
+        
+        # write to a temporary file first so partially written chunks are never read
+        idx,(ids,times,states,ts_bias,n_detections,classes) = item
+        path = os.path.join(directory,"tracks_{}.npz".format(str(idx).zfill(6)))
+        tmp_path = path[:-4] + ".tmp.npz"
+        np.savez(tmp_path,ids = ids,times = times,states = states,ts_bias = ts_bias,n_detections = n_detections,classes = classes)
+        os.replace(tmp_path,path)
+            
+def load_track_chunks(directory):
+    """
+    Yields (ids,times,states,ts_bias) arrays for each chunk file written by a TrackWriter
+    in directory, in order, loading only one chunk at a time
+    
+    ids     - [r] int array of object ids
+    times   - [r] array of clock times
+    states  - [r,state_size] array of object states
+    ts_bias - [r,n_cameras] array of timestamp bias for each camera
+    """
+    for file in chunk_files(directory):
+        with np.load(file) as data:
+            yield data["ids"],data["times"],data["states"],data["ts_bias"]
+
+def load_track_metadata(directory):
+    """
+    Returns the detection count and most likely class of every object in the chunk files
+    written by a TrackWriter in directory, as of the last frame in which each object was 
+    written. Only the metadata columns are loaded, so this is cheap relative to the states
+    
+    ids          - [m] sorted int array of object ids
+    n_detections - [m] int array of detection counts
+    classes      - [m] int array of classes
+    """
+    ids,n_detections,classes = [],[],[]
+    for file in chunk_files(directory):
+        with np.load(file) as data:
+            ids.append(data["ids"])
+            n_detections.append(data["n_detections"])
+            classes.append(data["classes"])
+    if len(ids) == 0:
+        return np.zeros(0,dtype = np.int64),np.zeros(0,dtype = np.int32),np.zeros(0,dtype = np.int16)
+    
+    ids = np.concatenate(ids)
+    n_detections = np.concatenate(n_detections)
+    classes = np.concatenate(classes)
+    
+    # rows are in frame order, so keep the last row of each object
+    unique_ids,first_reversed = np.unique(ids[::-1],return_index = True)
+    last = len(ids) - 1 - first_reversed
+    return unique_ids,n_detections[last],classes[last]
+
+def chunk_files(directory):
+    """
+    Returns sorted paths of all completed chunk files in directory
+    """
+    files = sorted([file for file in os.listdir(directory) if file.startswith("tracks_") and file.endswith(".npz") and not file.endswith(".tmp.npz")])
+    return [os.path.join(directory,file) for file in files]
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched frame preprocessing (color conversion, resize and normalization) for
+the frame loaders and detection scripts
+"""
+
+import numpy as np
+import cv2
+import torch
+from torch.nn.functional import interpolate
+
+
+class FramePreprocessor():
+    """
+    Converts raw uint8 frames (as read by cv2) into normalized float tensors on
+    device. On GPU, the raw frames are uploaded once and color conversion, resize
+    and mean/std normalization run as one batched tensor op for all frames. On
+    CPU, frames are resized with cv2 and the remaining steps are one vectorized pass
+    over the stacked batch. Outputs are equivalent to cv2.resize, F.to_tensor and
+    F.normalize applied frame by frame
+    """
+
+    def __init__(self,device,size = (1920,1080),to_rgb = False,mean = [0.485, 0.456, 0.406],std = [0.229, 0.224, 0.225]):
+        """
+        Parameters
+        ----------
+        device : torch.device
+            device on which frames are preprocessed and returned
+        size : tuple of (int,int), optional
+            (width,height) of output frames. The default is (1920,1080).
+        to_rgb : bool, optional
+            If True, channel order of the input frames is reversed (BGR -> RGB)
+            before normalization. The default is False.
+        mean, std : list of float, optional
+            per-channel normalization parameters, applied after color conversion
+        """
+        self.device = device
+        self.size = size
+        self.to_rgb = to_rgb
+
+        # (x/255 - mean)/std is computed as x*scale + bias
+        mean = torch.tensor(mean)
+        std = torch.tensor(std)
+        self.scale = (1.0/(255.0*std)).view(1,3,1,1).to(device)
+        self.bias  = (-mean/std).view(1,3,1,1).to(device)
+
+    def __call__(self,frames,return_resized = False):
+        """
+        Parameters
+        ----------
+        frames : np.array or uint8 tensor of size [H,W,3] or [N,H,W,3], or list of [H,W,3] np.arrays
+            raw frames
+        return_resized : bool, optional
+            If True, resized uint8 frames are also returned. The default is False.
+
+        Returns
+        -------
+        ims : float tensor of size [N,3,h,w] on device
+            normalized frames
+        resized : uint8 tensor of size [N,h,w,3]
+            (only if return_resized) resized frames in input channel order. On CPU
+            its storage is shared with a numpy array
+        """
+        w,h = self.size
+
+        if self.device.type == "cpu":
+            # cv2 resize is the fastest CPU path, the rest is one pass over the batch
+            if isinstance(frames,torch.Tensor):
+                frames = frames.numpy()
+            if isinstance(frames,np.ndarray) and frames.ndim == 3:
+                frames = [frames]
+            resized = np.stack([frame if frame.shape[:2] == (h,w) else cv2.resize(frame,(w,h)) for frame in frames])
+            resized = torch.from_numpy(resized)
+            ims = resized.permute(0,3,1,2).float()
+
+        else:
+            # upload raw frames once, then do everything on device
+            if isinstance(frames,list):
+                frames = np.stack(frames)
+            if isinstance(frames,np.ndarray):
+                frames = torch.from_numpy(frames)
+            if frames.dim() == 3:
+                frames = frames.unsqueeze(0)
+            ims = frames.to(self.device,non_blocking = True).permute(0,3,1,2).float()
+            if ims.shape[2] != h or ims.shape[3] != w:
+                ims = interpolate(ims,size = (h,w),mode = "bilinear",align_corners = False)
+            if return_resized:
+                resized = ims.round().clamp(0,255).byte().permute(0,2,3,1)
+
+        if self.to_rgb:
+            ims = ims.flip(1)
+        ims = torch.addcmul(self.bias,ims,self.scale)
+
+        if return_resized:
+            return ims,resized
+        return ims